@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Analysis, AnalysisSource, Script, ScriptSegment, MediaFile
+from .models import Analysis, AnalysisJob, AnalysisSource, AnalysisVersion, Upload, CachedDownload, VideoAnalysisResult, Script, ScriptSegment, MediaFile, Voiceover, UpstreamCall
 
 
 @admin.register(Analysis)
@@ -10,13 +10,53 @@ class AnalysisAdmin(admin.ModelAdmin):
     readonly_fields = ['id', 'created_at', 'updated_at']
 
 
+@admin.register(AnalysisVersion)
+class AnalysisVersionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'analysis', 'number', 'created_at']
+    list_filter = ['created_at']
+    search_fields = ['analysis__id']
+    readonly_fields = ['id', 'created_at']
+
+
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'analysis', 'status', 'attempts', 'worker_id', 'created_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['id', 'analysis__id', 'worker_id']
+    readonly_fields = ['id', 'created_at', 'updated_at']
+
+
 @admin.register(AnalysisSource)
 class AnalysisSourceAdmin(admin.ModelAdmin):
-    list_display = ['id', 'analysis', 'source_type', 'label', 'created_at']
-    list_filter = ['source_type', 'created_at']
+    list_display = ['id', 'analysis', 'source_type', 'label', 'download_status', 'created_at']
+    list_filter = ['source_type', 'download_status', 'created_at']
     search_fields = ['label', 'url']
 
 
+@admin.register(Upload)
+class UploadAdmin(admin.ModelAdmin):
+    list_display = ['id', 'filename', 'status', 'received_size', 'total_size', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['id', 'filename']
+    readonly_fields = ['id', 'created_at', 'updated_at']
+
+
+@admin.register(CachedDownload)
+class CachedDownloadAdmin(admin.ModelAdmin):
+    list_display = ['cache_key', 'title', 'file_size', 'hit_count', 'created_at', 'last_accessed_at']
+    list_filter = ['extractor', 'created_at']
+    search_fields = ['cache_key', 'title']
+    readonly_fields = ['id', 'created_at']
+
+
+@admin.register(VideoAnalysisResult)
+class VideoAnalysisResultAdmin(admin.ModelAdmin):
+    list_display = ['content_key', 'hit_count', 'created_at', 'last_accessed_at']
+    list_filter = ['created_at']
+    search_fields = ['content_key', 'cache_key']
+    readonly_fields = ['id', 'created_at']
+
+
 @admin.register(Script)
 class ScriptAdmin(admin.ModelAdmin):
     list_display = ['id', 'analysis', 'topic', 'created_at']
@@ -36,3 +76,18 @@ class MediaFileAdmin(admin.ModelAdmin):
     list_display = ['id', 'segment', 'media_type', 'status', 'created_at']
     list_filter = ['media_type', 'status', 'created_at']
     search_fields = ['segment__timeframe']
+
+
+@admin.register(Voiceover)
+class VoiceoverAdmin(admin.ModelAdmin):
+    list_display = ['id', 'script', 'status', 'duration_ms', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['script__topic']
+
+
+@admin.register(UpstreamCall)
+class UpstreamCallAdmin(admin.ModelAdmin):
+    list_display = ['started_at', 'service', 'operation', 'model', 'duration_ms', 'retries', 'outcome']
+    list_filter = ['service', 'operation', 'outcome', 'started_at']
+    search_fields = ['analysis_id', 'script_id', 'error']
+    readonly_fields = ['id', 'started_at']
@@ -0,0 +1,240 @@
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Optional
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Analysis, AnalysisSource, VideoAnalysisResult
+from .file_utils import hash_file
+from .gemini_service import GeminiService
+from .youtube_service import YouTubeService
+
+
+def compute_source_key(source: AnalysisSource, youtube_service: YouTubeService) -> str:
+    """
+    Ключ содержимого источника без обращения к сети
+    
+    Для поддерживаемых ссылок - канонический id видео, для прочих ссылок - сам URL,
+    для файлов - SHA-256 содержимого.
+    """
+    if source.source_type == 'url' and source.url:
+        canonical_id = youtube_service.get_canonical_id(source.url)
+        if canonical_id:
+            extractor, video_id = canonical_id
+            return f"{extractor}:{video_id}"
+        return f"url:{source.url.strip()}"
+    
+    if source.file:
+        return f"sha256:{hash_file(source.file)}"
+    
+    return ''
+
+
+def compute_fingerprint(source_keys: List[str], map_reduce: Optional[bool] = None) -> str:
+    """
+    Отпечаток набора источников вместе с версией промпта, моделью, профилем качества и режимом входных данных анализа
+    
+    Порядок источников не учитывается: один и тот же набор видео дает один отпечаток.
+    
+    Args:
+        source_keys: Ключи содержимого источников
+        map_reduce: Анализ выполняется в режиме map_reduce (None - по ANALYSIS_MODE)
+    """
+    if map_reduce is None:
+        map_reduce = settings.ANALYSIS_MODE == 'map_reduce'
+    
+    payload = {
+        'sources': sorted(source_keys),
+        'prompt_version': GeminiService.ANALYSIS_PROMPT_VERSION,
+        'model': GeminiService.ANALYSIS_MODEL,
+        'quality_profile': settings.ANALYSIS_QUALITY_PROFILE,
+        'input_mode': settings.ANALYSIS_INPUT_MODE,
+    }
+    if map_reduce:
+        # Сведенная ДНК зависит еще и от промпта сведения
+        payload['mode'] = 'map_reduce'
+        payload['reduce_prompt_version'] = GeminiService.REDUCE_PROMPT_VERSION
+        payload['reduce_model'] = GeminiService.REDUCE_MODEL
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def compute_video_result_key(content_key: str) -> str:
+    """Ключ кеша анализа отдельного видео: ключ содержимого вместе с версией промпта, моделью и параметрами входных данных"""
+    payload = {
+        'source': content_key,
+        'prompt_version': GeminiService.ANALYSIS_PROMPT_VERSION,
+        'model': GeminiService.ANALYSIS_MODEL,
+        'quality_profile': settings.ANALYSIS_QUALITY_PROFILE,
+        'input_mode': settings.ANALYSIS_INPUT_MODE,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _video_result_keys(sources: Iterable[AnalysisSource], youtube_service: Optional[YouTubeService] = None) -> Dict[Any, str]:
+    """
+    Ключи кеша анализов видео для источников
+    
+    Ключи содержимого источников вычисляются и сохраняются, если их еще нет (без обращения к сети).
+    
+    Returns:
+        {id источника: ключ VideoAnalysisResult} для источников с известным ключом содержимого
+    """
+    youtube_service = youtube_service or YouTubeService()
+    keys = {}
+    
+    for source in sources:
+        if not source.content_key:
+            source.content_key = compute_source_key(source, youtube_service)
+            source.save(update_fields=['content_key'])
+        if source.content_key:
+            keys[source.id] = compute_video_result_key(source.content_key)
+    
+    return keys
+
+
+def has_video_results(sources: Iterable[AnalysisSource], youtube_service: Optional[YouTubeService] = None) -> bool:
+    """
+    Есть ли готовый анализ каждого видео из источников (счетчики попаданий не меняются)
+    
+    Анализы отдельных видео сохраняются только в режиме map_reduce, поэтому у анализа,
+    выполненного в режиме single, их нет.
+    """
+    sources = list(sources)
+    keys = _video_result_keys(sources, youtube_service)
+    if len(keys) < len(sources):
+        return False
+    return VideoAnalysisResult.objects.filter(cache_key__in=set(keys.values())).count() == len(set(keys.values()))
+
+
+def find_video_results(analysis: Analysis, youtube_service: Optional[YouTubeService] = None) -> Dict[Any, VideoAnalysisResult]:
+    """
+    Готовые анализы отдельных видео для источников анализа
+    
+    Ключи содержимого источников вычисляются, если их еще нет (без обращения к сети).
+    
+    Returns:
+        {id источника: VideoAnalysisResult} для источников, видео которых уже анализировалось
+    """
+    keys = _video_result_keys(analysis.sources.all(), youtube_service)
+    entries = VideoAnalysisResult.objects.in_bulk(list(keys.values()), field_name='cache_key')
+    found = {source_id: entries[key] for source_id, key in keys.items() if key in entries}
+    
+    if found:
+        VideoAnalysisResult.objects.filter(id__in=[entry.id for entry in found.values()]).update(
+            hit_count=F('hit_count') + 1,
+            last_accessed_at=timezone.now()
+        )
+        # Метрики монтажа видео из кеша - как если бы видео обработали заново
+        for source_id, entry in found.items():
+            if entry.montage_stats:
+                AnalysisSource.objects.filter(id=source_id).update(montage_stats=entry.montage_stats)
+    
+    return found
+
+
+def store_video_result(content_key: str, result: Dict[str, Any], montage_stats: Optional[Dict[str, Any]] = None) -> Optional[VideoAnalysisResult]:
+    """
+    Сохранение анализа отдельного видео
+    
+    Returns:
+        Запись кеша или None, если ключ содержимого неизвестен
+    """
+    if not content_key:
+        return None
+    
+    entry, _ = VideoAnalysisResult.objects.update_or_create(
+        cache_key=compute_video_result_key(content_key),
+        defaults={
+            'content_key': content_key,
+            'result': result,
+            'montage_stats': montage_stats or {},
+            'last_accessed_at': timezone.now(),
+        }
+    )
+    return entry
+
+
+def assign_fingerprint(
+    analysis: Analysis,
+    youtube_service: Optional[YouTubeService] = None,
+    map_reduce: Optional[bool] = None
+) -> str:
+    """
+    Вычисление ключей источников и отпечатка анализа
+    
+    Returns:
+        Отпечаток или пустая строка, если ключ хотя бы одного источника неизвестен
+    """
+    youtube_service = youtube_service or YouTubeService()
+    source_keys = []
+    
+    for source in analysis.sources.all():
+        if not source.content_key:
+            source.content_key = compute_source_key(source, youtube_service)
+            source.save(update_fields=['content_key'])
+        if not source.content_key:
+            return ''
+        source_keys.append(source.content_key)
+    
+    if not source_keys:
+        return ''
+    
+    analysis.fingerprint = compute_fingerprint(source_keys, map_reduce)
+    analysis.save(update_fields=['fingerprint', 'updated_at'])
+    return analysis.fingerprint
+
+
+def find_cached_analysis(analysis: Analysis) -> Optional[Analysis]:
+    """Поиск готового анализа с тем же отпечатком (анализы с нескачанными источниками не подходят)"""
+    if not analysis.fingerprint:
+        return None
+    
+    return (
+        Analysis.objects
+        .filter(fingerprint=analysis.fingerprint, status='ready')
+        .exclude(id=analysis.id)
+        .exclude(sources__download_status='error')
+        .order_by('-updated_at')
+        .first()
+    )
+
+
+def clone_analysis_result(analysis: Analysis, origin: Analysis) -> Analysis:
+    """
+    Копирование результатов готового анализа вместо нового вызова Gemini
+    
+    Файлы источников берутся из источников исходного анализа с тем же ключом содержимого,
+    поэтому видео не скачиваются повторно.
+    """
+    origin_files = {
+        source.content_key: source
+        for source in origin.sources.all()
+        if source.content_key and source.file
+    }
+    
+    with transaction.atomic():
+        for source in analysis.sources.all():
+            origin_source = origin_files.get(source.content_key)
+            if origin_source is None or source.file:
+                continue
+            source.file.name = origin_source.file.name
+            source.file_mime_type = origin_source.file_mime_type
+            source.proxy_file.name = origin_source.proxy_file.name
+            source.montage_stats = origin_source.montage_stats
+            source.transcript = origin_source.transcript
+            source.source_type = 'file'
+            source.download_status = 'done'
+            source.save()
+        
+        analysis.transcript = origin.transcript
+        analysis.style_passport = origin.style_passport
+        analysis.patterns = origin.patterns
+        analysis.grounding_sources = origin.grounding_sources
+        analysis.cloned_from = origin
+        analysis.error_message = ''
+        analysis.status = 'ready'
+        analysis.save()
+    
+    return analysis
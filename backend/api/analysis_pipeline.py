@@ -0,0 +1,803 @@
+import contextvars
+import hashlib
+import os
+import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from typing import List, Dict, Any, Optional, Set
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import Analysis, AnalysisSource, AnalysisVersion, CachedDownload, VideoAnalysisResult
+from .file_utils import LocalFile, save_local_file, get_local_path
+from .transcode import TranscodeError, get_quality_profile, is_ffmpeg_available, make_analysis_proxy
+from .scene_detection import preprocess_video, aggregate_montage_stats
+from .scratch_space import job_directory
+from .download_scheduler import get_download_scheduler
+from .download_cache import DownloadCache
+from .analysis_cache import (
+    assign_fingerprint, find_cached_analysis, clone_analysis_result, find_video_results, store_video_result
+)
+from .gemini_service import GeminiService
+from .instrumentation import call_context
+from .resilience import CircuitOpenError
+from .youtube_service import YouTubeService
+
+
+class AnalysisPipelineError(Exception):
+    """Ошибка выполнения одного из этапов анализа"""
+    pass
+
+
+def _set_status(analysis: Analysis, new_status: str) -> None:
+    """Обновление статуса анализа (сохраняется сразу, чтобы его видели клиенты)"""
+    analysis.status = new_status
+    analysis.save(update_fields=['status', 'updated_at'])
+
+
+PLATFORM_NAMES = {
+    'youtube': 'YouTube',
+    'tiktok': 'TikTok',
+    'instagram': 'Instagram',
+}
+
+def _attach_cached_download(source: AnalysisSource, entry: CachedDownload) -> Dict[str, Any]:
+    """Привязка файла из кеша к источнику (без копирования файла)"""
+    source.file.name = entry.file.name
+    source.file_mime_type = entry.file_mime_type
+    source.transcript = entry.transcript
+    source.source_type = 'file'  # Меняем тип на file после скачивания
+    source.download_status = 'done'
+    source.save()
+    
+    return {
+        'type': 'file',
+        'value': {
+            'path': get_local_path(source.file),
+            'mimeType': entry.file_mime_type or 'video/mp4'
+        },
+        'label': entry.title or source.label,
+        'source_id': source.id,
+        'transcript': source.transcript
+    }
+
+
+# Скачивания, выполняемые сейчас в процессе воркера: ключ кеша скачивания -> ожидание завершения
+_inflight_downloads: Dict[str, Dict[str, Any]] = {}
+_inflight_lock = threading.Lock()
+
+
+def _claim_download(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Захват скачивания видео по ключу кеша
+    
+    Returns:
+        None, если скачивание захвачено вызывающим кодом (он обязан вызвать _release_download),
+        иначе запись уже идущего скачивания {'event': threading.Event, 'error': текст ошибки}
+    """
+    with _inflight_lock:
+        if key in _inflight_downloads:
+            return _inflight_downloads[key]
+        _inflight_downloads[key] = {'event': threading.Event(), 'error': ''}
+        return None
+
+
+def _release_download(key: str, error: str = '') -> None:
+    """Завершение скачивания: ожидающие источники берут файл из кеша или получают ошибку"""
+    with _inflight_lock:
+        inflight = _inflight_downloads.pop(key, None)
+    if inflight:
+        inflight['error'] = error
+        inflight['event'].set()
+
+
+def _save_downloaded_video(
+    source: AnalysisSource,
+    future: Future,
+    youtube_service: YouTubeService,
+    cache: Optional[DownloadCache]
+) -> Optional[Dict[str, Any]]:
+    """
+    Сохранение результата скачивания в источник (выполняется в потоке, который пишет в БД)
+    
+    Returns:
+        Входные данные источника для Gemini или None, если скачивание завершилось ошибкой
+        (ошибка сохраняется в источнике)
+    """
+    try:
+        video_data = future.result()
+    except Exception as e:
+        platform = PLATFORM_NAMES.get(youtube_service.get_platform(source.url), 'URL')
+        source.download_status = 'error'
+        source.error_message = f'Ошибка при скачивании видео с {platform}: {str(e)}'
+        source.download_wait_seconds = getattr(e, 'queue_wait', 0)
+        source.download_attempts = getattr(e, 'attempts', 1)
+        source.save(update_fields=[
+            'download_status', 'error_message', 'download_wait_seconds', 'download_attempts'
+        ])
+        return None
+    
+    source.download_wait_seconds = video_data.get('queue_wait', 0)
+    source.download_attempts = video_data.get('attempts', 1)
+    
+    try:
+        entry = cache.store(source.url, video_data) if cache else None
+        if entry:
+            return _attach_cached_download(source, entry)
+        
+        # Перемещаем скачанный файл в хранилище (без чтения в память)
+        file_name = f"{youtube_service._sanitize_filename(video_data['title'])}.mp4"
+        save_local_file(source.file, file_name, video_data['file_path'])
+    finally:
+        shutil.rmtree(video_data['temp_dir'], ignore_errors=True)
+    
+    source.file_mime_type = video_data['mime_type']
+    source.transcript = video_data.get('transcript') or []
+    source.source_type = 'file'  # Меняем тип на file после скачивания
+    source.download_status = 'done'
+    source.save()
+    
+    # Дальше передаем путь к файлу, а не его содержимое
+    return {
+        'type': 'file',
+        'value': {
+            'path': get_local_path(source.file),
+            'mimeType': video_data['mime_type']
+        },
+        'label': video_data['title'],
+        'source_id': source.id,
+        'transcript': source.transcript
+    }
+
+
+def download_sources(
+    analysis: Analysis,
+    keep_original: bool = False,
+    work_dir: Optional[str] = None,
+    skip_source_ids: Optional[Set] = None
+) -> List[Dict[str, Any]]:
+    """
+    Этап скачивания: параллельно загружает видео по поддерживаемым ссылкам и готовит входные данные для Gemini
+    
+    Скачивания выполняются в ограниченном пуле потоков через планировщик скачиваний:
+    одновременные загрузки с одной платформы ограничены DOWNLOAD_PLATFORM_CONCURRENCY,
+    частота запросов - DOWNLOAD_RATE_LIMITS, временные ошибки повторяются. Ошибка скачивания
+    одного источника не останавливает остальные: она сохраняется в самом источнике,
+    а анализ продолжается по успешно скачанным видео. Видео, которое уже скачивается
+    другим анализом процесса (например, из того же пакета), не скачивается повторно.
+    
+    Высота кадра ограничена профилем качества анализа, если не запрошено
+    сохранение оригинала (тогда легкая копия делается на этапе prepare_proxies).
+    
+    Args:
+        analysis: Анализ, источники которого нужно подготовить
+        keep_original: Скачивать видео в исходном качестве
+        work_dir: Рабочая директория задачи (None - временные директории в SCRATCH_ROOT)
+        skip_source_ids: Источники, которые не нужно готовить (например, уже проанализированные видео)
+    
+    Returns:
+        Список источников в формате GeminiService.analyze_content
+    """
+    max_height = None if keep_original else get_quality_profile()['max_height']
+    youtube_service = YouTubeService(max_height=max_height)
+    sources = [source for source in analysis.sources.all() if source.id not in (skip_source_ids or set())]
+    
+    to_download = [
+        source for source in sources
+        if source.source_type == 'url' and source.url and youtube_service.is_supported_url(source.url)
+    ]
+    downloaded = {}
+    errors = []
+    
+    if to_download:
+        AnalysisSource.objects.filter(id__in=[source.id for source in to_download]).update(
+            download_status='downloading',
+            error_message=''
+        )
+        
+        # Видео из кеша скачивания не требуют обращения к сети
+        cache = DownloadCache(youtube_service) if settings.DOWNLOAD_CACHE_ENABLED else None
+        needs_download = []
+        
+        for source in to_download:
+            entry = cache.lookup(source.url) if cache else None
+            if entry:
+                downloaded[source.id] = _attach_cached_download(source, entry)
+            else:
+                needs_download.append(source)
+        
+        # Одно и то же видео не скачивается дважды: если его уже скачивает другой анализ
+        # этого процесса (или этот же анализ по другой ссылке), источник ждет и берет файл из кеша
+        leaders = []
+        followers = {}
+        claimed_keys = {}
+        
+        for source in needs_download:
+            key = cache.get_key(source.url) if cache else None
+            inflight = _claim_download(key) if key else None
+            if inflight:
+                followers[source.id] = inflight
+            else:
+                leaders.append(source)
+                if key:
+                    claimed_keys[source.id] = key
+        
+        # Потоки только скачивают, все записи в БД выполняются в текущем потоке.
+        # Лимиты частоты и повторы при ограничениях платформ - в планировщике скачиваний
+        scheduler = get_download_scheduler()
+        max_workers = max(min(settings.DOWNLOAD_MAX_WORKERS, len(leaders)), 1)
+        try:
+            with (
+                ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download') as executor,
+                ThreadPoolExecutor(max_workers=max(len(followers), 1), thread_name_prefix='download-wait') as waiter,
+            ):
+                futures = {
+                    executor.submit(
+                        scheduler.download,
+                        youtube_service,
+                        source.url,
+                        os.path.join(work_dir, 'downloads', str(source.id)) if work_dir else None
+                    ): source
+                    for source in leaders
+                }
+                # Ожидание чужих скачиваний - в отдельном пуле, чтобы не занимать потоки скачивания
+                futures.update({
+                    waiter.submit(followers[source.id]['event'].wait): source
+                    for source in needs_download if source.id in followers
+                })
+                
+                for future in as_completed(futures):
+                    source = futures[future]
+                    
+                    if source.id in followers:
+                        entry = cache.lookup(source.url)
+                        if entry:
+                            downloaded[source.id] = _attach_cached_download(source, entry)
+                        else:
+                            source.download_status = 'error'
+                            source.error_message = followers[source.id]['error'] or 'Не удалось скачать видео'
+                            source.save(update_fields=['download_status', 'error_message'])
+                            errors.append(source.error_message)
+                        continue
+                    
+                    try:
+                        result = _save_downloaded_video(source, future, youtube_service, cache)
+                        if result:
+                            downloaded[source.id] = result
+                        else:
+                            errors.append(source.error_message)
+                    finally:
+                        if source.id in claimed_keys:
+                            _release_download(claimed_keys.pop(source.id), source.error_message)
+        finally:
+            # Скачивания, которые не дошли до конца (ошибка этапа), не должны держать ожидающих
+            for key in claimed_keys.values():
+                _release_download(key, 'Скачивание видео прервано')
+    
+    # Собираем входные данные в исходном порядке источников
+    sources_list = []
+    
+    for source in sources:
+        if source.id in downloaded:
+            sources_list.append(downloaded[source.id])
+        elif source.download_status == 'error':
+            continue
+        elif source.source_type == 'url' and source.url:
+            sources_list.append({
+                'type': 'url',
+                'value': source.url,
+                'label': source.label,
+                'source_id': source.id
+            })
+        elif source.file:
+            sources_list.append({
+                'type': 'file',
+                'value': {
+                    'path': get_local_path(source.file),
+                    'mimeType': source.file_mime_type or 'video/mp4'
+                },
+                'label': source.label,
+                'source_id': source.id,
+                'transcript': source.transcript
+            })
+    
+    if not sources_list and errors:
+        raise AnalysisPipelineError('; '.join(errors))
+    
+    return sources_list
+
+
+def _needs_proxy(profile: Dict[str, Any], keep_original: bool) -> bool:
+    """Нужна ли легкая копия видео для профиля качества"""
+    return bool(profile['transcode'] or (keep_original and profile['max_height']))
+
+
+def _proxy_file_name(source: AnalysisSource, profile: Dict[str, Any]) -> str:
+    """
+    Имя легкой копии в хранилище
+    
+    Зависит от файла оригинала и профиля, поэтому источники, ссылающиеся на один
+    файл (например, из кеша скачивания), используют одну копию.
+    """
+    stem = os.path.splitext(os.path.basename(source.file.name))[0]
+    digest = hashlib.sha1(source.file.name.encode('utf-8')).hexdigest()[:8]
+    return source.proxy_file.field.generate_filename(source, f"{stem}.{digest}.{profile['name']}.mp4")
+
+
+def _set_proxy(source: AnalysisSource, proxy_name: str) -> None:
+    """
+    Привязка легкой копии к источнику (пустое имя - в Gemini передается оригинал)
+    
+    Ссылка Gemini в источнике всегда относится к файлу, который передается в анализ,
+    поэтому при смене файла она сбрасывается.
+    """
+    if (source.proxy_file.name or '') == proxy_name:
+        return
+    
+    source.proxy_file.name = proxy_name
+    source.gemini_file_name = ''
+    source.gemini_file_uri = ''
+    source.gemini_file_expires_at = None
+    source.save(update_fields=['proxy_file', 'gemini_file_name', 'gemini_file_uri', 'gemini_file_expires_at'])
+
+
+def prepare_proxies(
+    sources_list: List[Dict[str, Any]],
+    keep_original: bool = False,
+    work_dir: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Этап перекодирования: для каждого видео делается легкая копия по профилю качества
+    (ANALYSIS_QUALITY_PROFILE), которая передается в Gemini вместо оригинала
+    
+    Оригинал остается в источнике, копия сохраняется в proxy_file и переиспользуется
+    при повторных анализах. Если ffmpeg не установлен или перекодирование не удалось,
+    в Gemini передается оригинал.
+    
+    Args:
+        sources_list: Результат download_sources
+        keep_original: Видео скачаны в исходном качестве
+        work_dir: Рабочая директория задачи для временных копий
+    
+    Returns:
+        Список источников, в котором пути к файлам заменены путями к легким копиям
+    """
+    profile = get_quality_profile()
+    use_proxy = _needs_proxy(profile, keep_original)
+    
+    if use_proxy and not is_ffmpeg_available():
+        print(f"Предупреждение: {settings.FFMPEG_BINARY} не найден, в Gemini передаются исходные видео")
+        use_proxy = False
+    
+    file_inputs = [
+        item for item in sources_list
+        if item['type'] == 'file' and 'path' in item['value'] and item.get('source_id')
+    ]
+    sources = AnalysisSource.objects.in_bulk([item['source_id'] for item in file_inputs])
+    to_transcode = []
+    
+    for item in file_inputs:
+        source = sources[item['source_id']]
+        
+        if not use_proxy or not item['value']['mimeType'].startswith('video/'):
+            _set_proxy(source, '')
+            continue
+        
+        # Копия уже сделана для этого файла (этим или другим источником)
+        proxy_name = _proxy_file_name(source, profile)
+        if source.proxy_file.storage.exists(proxy_name):
+            _set_proxy(source, proxy_name)
+            item['value'] = {'path': get_local_path(source.proxy_file), 'mimeType': 'video/mp4'}
+        else:
+            to_transcode.append((item, source, proxy_name))
+    
+    if to_transcode:
+        # Потоки только запускают ffmpeg, записи в БД выполняются в текущем потоке
+        max_workers = max(min(settings.TRANSCODE_MAX_WORKERS, len(to_transcode)), 1)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='transcode') as executor:
+            futures = {
+                executor.submit(make_analysis_proxy, item['value']['path'], profile, work_dir): (item, source, proxy_name)
+                for item, source, proxy_name in to_transcode
+            }
+            
+            for future in as_completed(futures):
+                item, source, proxy_name = futures[future]
+                
+                try:
+                    proxy_path = future.result()
+                except TranscodeError as e:
+                    print(f"Предупреждение: не удалось перекодировать источник {source.id}: {e}")
+                    _set_proxy(source, '')
+                    continue
+                
+                try:
+                    with open(proxy_path, 'rb') as f:
+                        stored_name = source.proxy_file.storage.save(proxy_name, LocalFile(f, proxy_path))
+                finally:
+                    if os.path.exists(proxy_path):
+                        os.remove(proxy_path)
+                
+                _set_proxy(source, stored_name)
+                item['value'] = {'path': get_local_path(source.proxy_file), 'mimeType': 'video/mp4'}
+    
+    return sources_list
+
+
+def preprocess_sources(sources_list: List[Dict[str, Any]], work_dir: str) -> List[Dict[str, Any]]:
+    """
+    Этап предобработки (ANALYSIS_INPUT_MODE = 'keyframes'): вместо видео в Gemini
+    передаются ключевые кадры сцен, звуковая дорожка и измеренные метрики монтажа
+    
+    Метрики сохраняются в источнике (montage_stats). Если предобработка видео
+    не удалась, в Gemini передается само видео.
+    
+    Args:
+        sources_list: Результат download_sources
+        work_dir: Директория для ключевых кадров и звука (удаляется после анализа)
+    
+    Returns:
+        Список источников, в котором видео заменены на {'type': 'preprocessed', ...}
+    """
+    if settings.ANALYSIS_INPUT_MODE != 'keyframes':
+        return sources_list
+    
+    if not is_ffmpeg_available():
+        print(f"Предупреждение: {settings.FFMPEG_BINARY} не найден, в Gemini передаются видео целиком")
+        return sources_list
+    
+    video_inputs = [
+        (index, item) for index, item in enumerate(sources_list)
+        if item['type'] == 'file' and 'path' in item['value'] and item.get('source_id')
+        and item['value']['mimeType'].startswith('video/')
+    ]
+    if not video_inputs:
+        return sources_list
+    
+    # Потоки только запускают ffmpeg и NumPy, записи в БД выполняются в текущем потоке
+    max_workers = max(min(settings.TRANSCODE_MAX_WORKERS, len(video_inputs)), 1)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='preprocess') as executor:
+        futures = {
+            executor.submit(
+                preprocess_video, item['value']['path'], os.path.join(work_dir, str(item['source_id']))
+            ): (index, item)
+            for index, item in video_inputs
+        }
+        
+        for future in as_completed(futures):
+            index, item = futures[future]
+            
+            try:
+                result = future.result()
+            except TranscodeError as e:
+                print(f"Предупреждение: не удалось обработать источник {item['source_id']}: {e}")
+                continue
+            
+            AnalysisSource.objects.filter(id=item['source_id']).update(montage_stats=result['stats'])
+            sources_list[index] = {
+                'type': 'preprocessed',
+                'value': result,
+                'label': item.get('label', ''),
+                'source_id': item['source_id'],
+                'transcript': item.get('transcript') or []
+            }
+    
+    return sources_list
+
+
+def _upload_reuse_deadline():
+    """Загруженный файл переиспользуется, только если он действителен дольше этого момента"""
+    return timezone.now() + timedelta(seconds=settings.GEMINI_FILE_REUSE_MARGIN)
+
+
+def _has_reusable_upload(source: AnalysisSource) -> bool:
+    """Проверка, что загруженный в Gemini файл еще действителен на время анализа"""
+    return bool(
+        source.gemini_file_uri
+        and source.gemini_file_expires_at
+        and source.gemini_file_expires_at > _upload_reuse_deadline()
+    )
+
+
+def upload_sources(sources_list: List[Dict[str, Any]], gemini_service: GeminiService) -> List[Dict[str, Any]]:
+    """
+    Этап загрузки: каждый файл передается в Gemini через Files API один раз
+    
+    Ссылка на загруженный файл и срок ее действия сохраняются в источнике. Повторные
+    попытки запроса и повторные анализы того же файла (в том числе другими анализами,
+    использующими тот же файл из кеша скачивания) переиспользуют ссылку до истечения срока.
+    
+    Args:
+        sources_list: Результат download_sources
+        gemini_service: Сервис Gemini
+    
+    Returns:
+        Список источников, в котором файлы заменены ссылками {'fileUri': ..., 'mimeType': ...}
+    """
+    file_inputs = [
+        item for item in sources_list
+        if item['type'] == 'file' and 'path' in item['value'] and item.get('source_id')
+    ]
+    sources = AnalysisSource.objects.in_bulk([item['source_id'] for item in file_inputs])
+    to_upload = []
+    
+    for item in file_inputs:
+        source = sources[item['source_id']]
+        
+        # Тот же файл мог быть уже загружен для другого источника
+        if not _has_reusable_upload(source):
+            if source.proxy_file:
+                same_file = Q(proxy_file=source.proxy_file.name)
+            else:
+                same_file = Q(file=source.file.name) & (Q(proxy_file='') | Q(proxy_file__isnull=True))
+            donor = (
+                AnalysisSource.objects
+                .filter(same_file, gemini_file_expires_at__gt=_upload_reuse_deadline())
+                .exclude(id=source.id)
+                .exclude(gemini_file_uri='')
+                .order_by('-gemini_file_expires_at')
+                .first()
+            )
+            if donor:
+                source.gemini_file_name = donor.gemini_file_name
+                source.gemini_file_uri = donor.gemini_file_uri
+                source.gemini_file_expires_at = donor.gemini_file_expires_at
+                source.save(update_fields=['gemini_file_name', 'gemini_file_uri', 'gemini_file_expires_at'])
+        
+        if _has_reusable_upload(source) and gemini_service.is_file_active(source.gemini_file_name):
+            item['value'] = {'fileUri': source.gemini_file_uri, 'mimeType': item['value']['mimeType']}
+        else:
+            to_upload.append((item, source))
+    
+    if to_upload:
+        # Потоки только загружают, записи в БД выполняются в текущем потоке.
+        # Контекст копируется, чтобы замеры загрузок были привязаны к анализу
+        max_workers = min(settings.GEMINI_UPLOAD_CONCURRENCY, len(to_upload))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gemini-upload') as executor:
+            futures = {
+                executor.submit(contextvars.copy_context().run, gemini_service.upload_file, item['value']['path'], item['value']['mimeType']): (item, source)
+                for item, source in to_upload
+            }
+            
+            for future in as_completed(futures):
+                item, source = futures[future]
+                uploaded = future.result()
+                
+                source.gemini_file_name = uploaded['name']
+                source.gemini_file_uri = uploaded['uri']
+                source.gemini_file_expires_at = uploaded['expiresAt']
+                source.save(update_fields=['gemini_file_name', 'gemini_file_uri', 'gemini_file_expires_at'])
+                
+                item['value'] = {'fileUri': uploaded['uri'], 'mimeType': uploaded['mimeType']}
+    
+    return sources_list
+
+
+def map_sources(
+    analysis: Analysis,
+    sources_list: List[Dict[str, Any]],
+    cached_results: Dict[Any, VideoAnalysisResult],
+    gemini_service: GeminiService
+) -> List[Dict[str, Any]]:
+    """
+    Этап map (ANALYSIS_MODE = 'map_reduce'): каждое видео анализируется отдельным запросом
+    
+    Запросы выполняются параллельно (не больше ANALYSIS_MAP_CONCURRENCY), результат каждого
+    сохраняется в кеше по ключу содержимого видео. Ошибка анализа одного видео не останавливает
+    остальные: она сохраняется в источнике, а ДНК сводится по успешно проанализированным видео.
+    
+    Args:
+        analysis: Анализ
+        sources_list: Результат upload_sources для видео без готового анализа
+        cached_results: Готовые анализы видео (find_video_results)
+        gemini_service: Сервис Gemini
+    
+    Returns:
+        Анализы видео в исходном порядке источников:
+        [{'label': ..., 'transcript': ..., 'stylePassport': ..., 'patterns': ..., 'sources': ..., 'montage': ...}, ...]
+    """
+    sources = list(analysis.sources.all())
+    content_keys = {source.id: source.content_key for source in sources}
+    items = {item['source_id']: item for item in sources_list if item.get('source_id')}
+    results = {
+        source_id: {**entry.result, 'montage': entry.montage_stats}
+        for source_id, entry in cached_results.items()
+    }
+    errors = []
+    
+    if items:
+        # Потоки только обращаются к Gemini, записи в БД выполняются в текущем потоке.
+        # Контекст копируется, чтобы замеры вызовов были привязаны к анализу
+        max_workers = max(min(settings.ANALYSIS_MAP_CONCURRENCY, len(items)), 1)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis-map') as executor:
+            futures = {
+                executor.submit(contextvars.copy_context().run, gemini_service.analyze_content, [item]): source_id
+                for source_id, item in items.items()
+            }
+            
+            for future in as_completed(futures):
+                source_id = futures[future]
+                item = items[source_id]
+                
+                try:
+                    result = future.result()
+                except CircuitOpenError:
+                    # Gemini недоступен - анализ откладывается целиком, а не сводится по части видео
+                    raise
+                except Exception as e:
+                    message = f'Не удалось проанализировать видео: {str(e)}'
+                    print(f"Предупреждение: источник {source_id}: {message}")
+                    AnalysisSource.objects.filter(id=source_id).update(error_message=message)
+                    errors.append(message)
+                    continue
+                
+                montage = item['value']['stats'] if item['type'] == 'preprocessed' else {}
+                store_video_result(content_keys.get(source_id, ''), result, montage)
+                results[source_id] = {**result, 'montage': montage}
+    
+    if not results:
+        raise AnalysisPipelineError('; '.join(errors) or 'Нет источников для анализа')
+    
+    # Ошибки прошлых запусков у проанализированных видео больше не актуальны
+    AnalysisSource.objects.filter(id__in=list(results)).exclude(error_message='').update(error_message='')
+    
+    if errors and analysis.fingerprint:
+        # ДНК части видео не должна попасть в кеш результатов как ДНК всего набора
+        analysis.fingerprint = ''
+        analysis.save(update_fields=['fingerprint', 'updated_at'])
+    
+    return [
+        {**results[source.id], 'label': source.label}
+        for source in sources if source.id in results
+    ]
+
+
+def reduce_results(results: List[Dict[str, Any]], gemini_service: GeminiService) -> Dict[str, Any]:
+    """
+    Этап reduce: анализы отдельных видео сводятся в ДНК группы текстовым запросом
+    
+    Для одного видео запрос не нужен - его анализ и есть ДНК группы.
+    
+    Returns:
+        Результат в формате GeminiService.analyze_content
+    """
+    if len(results) == 1:
+        result = results[0]
+        return {
+            'transcript': result['transcript'],
+            'stylePassport': dict(result['stylePassport']),
+            'patterns': result['patterns'],
+            'sources': result['sources'],
+        }
+    return gemini_service.reduce_analyses(results)
+
+
+def record_version(analysis: Analysis) -> AnalysisVersion:
+    """
+    Сохранение текущей ДНК анализа новой версией (версия становится текущей)
+    
+    Сценарии привязываются к текущей версии при создании, поэтому после изменения
+    источников старые сценарии остаются связанными с ДНК, по которой они сгенерированы.
+    """
+    last_number = analysis.versions.aggregate(last=Max('number'))['last'] or 0
+    version = AnalysisVersion.objects.create(
+        analysis=analysis,
+        number=last_number + 1,
+        transcript=analysis.transcript,
+        style_passport=analysis.style_passport,
+        patterns=analysis.patterns,
+        grounding_sources=analysis.grounding_sources,
+        sources=[
+            {'id': str(source.id), 'label': source.label, 'url': source.url, 'content_key': source.content_key}
+            for source in analysis.sources.all()
+            if source.download_status != 'error'
+        ],
+    )
+    analysis.current_version = version
+    analysis.save(update_fields=['current_version', 'updated_at'])
+    return version
+
+
+def run_analysis(
+    analysis: Analysis,
+    force_refresh: bool = False,
+    keep_original: bool = False,
+    incremental: bool = False
+) -> Analysis:
+    """
+    Полный цикл анализа: downloading → transcribing → analyzing → ready/error
+    
+    downloading - скачивание источников, transcribing - подготовка видео (сцены, легкие копии)
+    и загрузка в Gemini, analyzing - запросы анализа к Gemini.
+    
+    Статус анализа сохраняется после каждого этапа. При ошибке анализ
+    переводится в статус error, текст ошибки сохраняется в error_message,
+    а исключение пробрасывается дальше (в воркер очереди).
+    
+    Если уже есть готовый анализ того же набора источников (с той же версией
+    промпта и моделью), его результаты копируются без скачивания и вызова Gemini.
+    
+    В режиме map_reduce (ANALYSIS_MODE) каждое видео анализируется отдельно, а готовые
+    анализы видео берутся из кеша: видео с готовым анализом не скачиваются и не передаются
+    в Gemini, поэтому новое видео в группе стоит один запрос анализа и один запрос сведения.
+    
+    Каждое успешное завершение сохраняет ДНК новой версией анализа (record_version).
+    
+    Args:
+        analysis: Анализ с уже созданными источниками
+        force_refresh: Не использовать кеш результатов анализа
+        keep_original: Скачивать и хранить видео в исходном качестве (в Gemini все равно передается легкая копия)
+        incremental: Пересчет после изменения источников в режиме map_reduce: анализы оставшихся
+            видео берутся из кеша, новые видео анализируются по одному. Ставится, только если у прежних
+            источников есть готовые анализы видео (views.add_analysis_sources), иначе map_reduce
+            проанализировал бы заново все видео по одному - дороже полного пересчета в режиме single
+    
+    Returns:
+        Обновленный анализ
+    """
+    # Вызовы Gemini на всех этапах записываются в замеры этого анализа
+    with call_context(analysis_id=analysis.id):
+        try:
+            map_reduce = incremental or settings.ANALYSIS_MODE == 'map_reduce'
+            
+            if settings.ANALYSIS_RESULT_CACHE_ENABLED:
+                assign_fingerprint(analysis, map_reduce=map_reduce)
+                if not force_refresh:
+                    origin = find_cached_analysis(analysis)
+                    if origin:
+                        clone_analysis_result(analysis, origin)
+                        record_version(analysis)
+                        return analysis
+            
+            cached_results = find_video_results(analysis) if map_reduce and not force_refresh else {}
+            
+            # Все временные файлы задачи (скачивания, копии, кадры) - в одной рабочей директории
+            with job_directory(f"analysis-{analysis.id}") as work_dir:
+                _set_status(analysis, 'downloading')
+                sources_list = download_sources(
+                    analysis, keep_original=keep_original, work_dir=work_dir, skip_source_ids=set(cached_results)
+                )
+                
+                if not sources_list and not cached_results:
+                    raise AnalysisPipelineError('Нет источников для анализа')
+                
+                _set_status(analysis, 'transcribing')
+                sources_list = preprocess_sources(sources_list, os.path.join(work_dir, 'preprocess'))
+                sources_list = prepare_proxies(sources_list, keep_original=keep_original, work_dir=work_dir)
+                
+                gemini_service = GeminiService()
+                sources_list = upload_sources(sources_list, gemini_service)
+                
+                _set_status(analysis, 'analyzing')
+                if map_reduce:
+                    map_results = map_sources(analysis, sources_list, cached_results, gemini_service)
+                    montage_stats = [result['montage'] for result in map_results if result['montage']]
+                else:
+                    analysis_result = gemini_service.analyze_content(sources_list)
+                    montage_stats = [item['value']['stats'] for item in sources_list if item['type'] == 'preprocessed']
+            
+            if map_reduce:
+                analysis_result = reduce_results(map_results, gemini_service)
+            
+            # Метрики монтажа в паспорте стиля - измеренные, а не оценка модели
+            montage = aggregate_montage_stats(montage_stats)
+            if montage:
+                analysis_result['stylePassport']['montage'] = montage
+            
+            # Сохраняем результаты
+            analysis.transcript = analysis_result['transcript']
+            analysis.style_passport = analysis_result['stylePassport']
+            analysis.patterns = analysis_result['patterns']
+            analysis.grounding_sources = analysis_result['sources']
+            analysis.error_message = ''
+            analysis.status = 'ready'
+            analysis.save()
+            record_version(analysis)
+        except Exception as e:
+            analysis.status = 'error'
+            analysis.error_message = str(e)
+            analysis.save(update_fields=['status', 'error_message', 'updated_at'])
+            raise
+    
+    return analysis
@@ -0,0 +1,197 @@
+import json
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, HttpRequest
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from .models import Analysis
+from .serializers import (
+    AnalysisSerializer, AnalysisCreateSerializer, ScriptSerializer, ScriptCreateSerializer, ScriptStreamCreateSerializer
+)
+from .gemini_service import AsyncGeminiService
+from .kie_service import AsyncKieService, format_task_status
+from .views import create_analysis, save_script
+from .script_cache import agenerate_script_cached
+from .context_cache import get_script_context
+from .script_stream import ScriptStreamWriter, sse_event, sse_response
+from .instrumentation import call_context
+from .resilience import CircuitOpenError
+
+
+# Асинхронные варианты эндпоинтов для запуска под ASGI (dnk/asgi.py).
+# Ожидание ответов Gemini и Kie.ai не занимает поток, поэтому число одновременных
+# запросов не ограничено количеством потоков и воркеров сервера. Работа с БД
+# выполняется в потоках через sync_to_async.
+
+
+def _parse_json_body(request: HttpRequest) -> Optional[Dict[str, Any]]:
+    """Тело запроса в JSON (None, если тело не разобралось)"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _error(message: Any, status: int) -> JsonResponse:
+    """Ответ с ошибкой в формате основных эндпоинтов"""
+    return JsonResponse({'error': message}, status=status)
+
+
+def _unavailable(error: CircuitOpenError) -> JsonResponse:
+    """Внешний API временно недоступен: 503 с Retry-After"""
+    response = _error(str(error), 503)
+    response['Retry-After'] = str(int(error.retry_after) + 1)
+    return response
+
+
+@sync_to_async
+def _serialize(serializer_class, instance, request: HttpRequest) -> Dict[str, Any]:
+    """Сериализация модели (связанные объекты читаются из БД, поэтому в потоке)"""
+    return serializer_class(instance, context={'request': request}).data
+
+
+@sync_to_async
+def _validate(serializer_class, data: Dict[str, Any]):
+    """Валидация данных запроса (может обращаться к БД)"""
+    serializer = serializer_class(data=data)
+    serializer.is_valid()
+    return serializer
+
+
+@csrf_exempt
+@require_POST
+async def create_analysis_view(request: HttpRequest) -> JsonResponse:
+    """Создание нового анализа (сам анализ выполняется воркером очереди)"""
+    data = _parse_json_body(request)
+    if data is None:
+        return _error('Тело запроса должно быть JSON-объектом', 400)
+    
+    serializer = await _validate(AnalysisCreateSerializer, data)
+    if serializer.errors:
+        return JsonResponse(serializer.errors, status=400)
+    
+    analysis = await sync_to_async(create_analysis)(serializer.validated_data)
+    return JsonResponse(await _serialize(AnalysisSerializer, analysis, request), status=202)
+
+
+@require_GET
+async def analysis_detail_view(request: HttpRequest, pk) -> JsonResponse:
+    """Статус и результат анализа"""
+    analysis = await Analysis.objects.filter(pk=pk).afirst()
+    if analysis is None:
+        return _error('Анализ не найден', 404)
+    
+    return JsonResponse(await _serialize(AnalysisSerializer, analysis, request))
+
+
+@csrf_exempt
+@require_POST
+async def create_script_view(request: HttpRequest) -> JsonResponse:
+    """Создание нового сценария (ожидание Gemini не занимает поток)"""
+    data = _parse_json_body(request)
+    if data is None:
+        return _error('Тело запроса должно быть JSON-объектом', 400)
+    
+    serializer = await _validate(ScriptCreateSerializer, data)
+    if serializer.errors:
+        return JsonResponse(serializer.errors, status=400)
+    
+    topic = serializer.validated_data['topic']
+    analysis = await Analysis.objects.filter(pk=serializer.validated_data['analysis_id']).afirst()
+    if analysis is None:
+        return _error('Анализ не найден', 404)
+    
+    cached = False
+    script_id = uuid.uuid4()
+    try:
+        gemini_service = AsyncGeminiService()
+        with call_context(analysis_id=analysis.id, script_id=script_id):
+            context = await sync_to_async(get_script_context)(analysis)
+            if serializer.validated_data['use_cache']:
+                segments_data, cached = await agenerate_script_cached(
+                    gemini_service,
+                    topic=topic,
+                    variants=serializer.validated_data['variants'],
+                    regenerate=serializer.validated_data['regenerate'],
+                    **context
+                )
+            else:
+                segments_data = await gemini_service.generate_script(topic=topic, **context)
+    except CircuitOpenError as e:
+        return _unavailable(e)
+    except Exception as e:
+        return _error(f'Ошибка генерации сценария: {str(e)}', 500)
+    
+    script = await sync_to_async(save_script)(analysis, topic, segments_data, script_id=script_id)
+    response = JsonResponse(await _serialize(ScriptSerializer, script, request), status=201)
+    response['X-Script-Cache'] = 'hit' if cached else 'miss'
+    return response
+
+
+async def _stream_script_events(writer: ScriptStreamWriter, segments: AsyncIterator[Dict[str, str]]) -> AsyncIterator[str]:
+    """События потоковой генерации (см. script_stream.stream_script_events)"""
+    yield sse_event('script', await sync_to_async(writer.start)())
+    
+    finished = False
+    with call_context(analysis_id=writer.analysis.id, script_id=writer.script.id):
+        try:
+            async for segment_data in segments:
+                yield sse_event('segment', await sync_to_async(writer.append)(segment_data))
+            finished = True
+            yield sse_event('done', await sync_to_async(writer.finish)())
+        except Exception as e:
+            finished = True
+            yield sse_event('error', await sync_to_async(writer.finish)(f'Ошибка генерации сценария: {str(e)}'))
+        finally:
+            if not finished:
+                # Клиент отключился - генерация прервана
+                await sync_to_async(writer.finish)('Генерация прервана: клиент отключился')
+
+
+@csrf_exempt
+@require_POST
+async def stream_script_view(request: HttpRequest):
+    """Потоковое создание сценария (text/event-stream, см. ScriptViewSet.stream)"""
+    data = _parse_json_body(request)
+    if data is None:
+        return _error('Тело запроса должно быть JSON-объектом', 400)
+    
+    serializer = await _validate(ScriptStreamCreateSerializer, data)
+    if serializer.errors:
+        return JsonResponse(serializer.errors, status=400)
+    
+    topic = serializer.validated_data['topic']
+    analysis = await Analysis.objects.filter(pk=serializer.validated_data['analysis_id']).afirst()
+    if analysis is None:
+        return _error('Анализ не найден', 404)
+    
+    try:
+        gemini_service = AsyncGeminiService()
+        with call_context(analysis_id=analysis.id):
+            context = await sync_to_async(get_script_context)(analysis)
+    except Exception as e:
+        return _error(f'Ошибка генерации сценария: {str(e)}', 500)
+    
+    segments = gemini_service.generate_script_stream(topic=topic, **context)
+    writer = ScriptStreamWriter(analysis, topic, request)
+    return sse_response(_stream_script_events(writer, segments))
+
+
+@require_GET
+async def video_task_status_view(request: HttpRequest) -> JsonResponse:
+    """Получение статуса задачи генерации видео"""
+    task_id = request.GET.get('task_id')
+    if not task_id:
+        return _error('Не указан task_id', 400)
+    
+    try:
+        status_data = await AsyncKieService().get_task_status(task_id)
+    except CircuitOpenError as e:
+        return _unavailable(e)
+    except Exception as e:
+        return _error(f'Ошибка получения статуса: {str(e)}', 500)
+    
+    return JsonResponse(format_task_status(status_data))
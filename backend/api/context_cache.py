@@ -0,0 +1,121 @@
+import hashlib
+import json
+import threading
+from datetime import timedelta
+from typing import Any, Dict, Optional
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Analysis
+from .gemini_service import GeminiService
+
+
+# Блокировки по анализам: одновременные запросы сценариев одного анализа создают один кеш
+_locks: Dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+# Если кеш создать не удалось (ошибка API), следующая попытка - не раньше чем через столько секунд
+FAILED_CACHE_RETRY_AFTER = 300
+
+
+def compute_dna_key(analysis: Analysis) -> str:
+    """Хеш ДНК анализа и модели сценариев: при его изменении кеш контекста создается заново"""
+    payload = {
+        'style_passport': analysis.style_passport,
+        'patterns': analysis.patterns,
+        'transcript': analysis.transcript,
+        'model': GeminiService.SCRIPT_MODEL,
+        'prompt_version': GeminiService.SCRIPT_PROMPT_VERSION,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _get_lock(analysis_id) -> threading.Lock:
+    """Блокировка анализа (создается при первом обращении)"""
+    with _locks_lock:
+        return _locks.setdefault(str(analysis_id), threading.Lock())
+
+
+def _is_fresh(analysis: Analysis, dna_key: str) -> bool:
+    """Запись о кеше относится к текущей ДНК и не истекает в ближайшее время"""
+    if analysis.context_cache_key != dna_key or not analysis.context_cache_expires_at:
+        return False
+    margin = timedelta(seconds=settings.GEMINI_CONTEXT_CACHE_REFRESH_MARGIN)
+    return analysis.context_cache_expires_at - margin > timezone.now()
+
+
+def ensure_context_cache(analysis: Analysis, gemini_service: Optional[GeminiService] = None) -> Optional[str]:
+    """
+    Кеш контекста Gemini с ДНК анализа (создается или пересоздается при необходимости)
+    
+    Кеш создается при первом сценарии анализа и используется следующими до истечения TTL.
+    Если ДНК слишком мала для кеширования или создать кеш не удалось, это тоже запоминается,
+    чтобы не повторять попытку на каждом сценарии - ДНК тогда передается в запросе.
+    
+    Returns:
+        Имя кеша для cached_content или None
+    """
+    dna_key = compute_dna_key(analysis)
+    if _is_fresh(analysis, dna_key):
+        return analysis.context_cache_name or None
+    
+    with _get_lock(analysis.id):
+        # Пока ждали блокировку, кеш мог создать другой запрос
+        analysis.refresh_from_db(fields=['context_cache_name', 'context_cache_key', 'context_cache_expires_at'])
+        if _is_fresh(analysis, dna_key):
+            return analysis.context_cache_name or None
+        
+        gemini_service = gemini_service or GeminiService()
+        if analysis.context_cache_name:
+            # Кеш старой ДНК больше не нужен
+            gemini_service.delete_script_context_cache(analysis.context_cache_name)
+        
+        ttl = settings.GEMINI_CONTEXT_CACHE_TTL
+        name = ''
+        expires_at = timezone.now() + timedelta(seconds=ttl)
+        context = gemini_service._build_dna_context(analysis.style_passport, analysis.patterns, analysis.transcript)
+        
+        if len(context) / 4 >= settings.GEMINI_CONTEXT_CACHE_MIN_TOKENS:
+            try:
+                cache = gemini_service.create_script_context_cache(
+                    analysis.style_passport,
+                    analysis.patterns,
+                    analysis.transcript,
+                    ttl=ttl,
+                    display_name=f"analysis-{analysis.id}"
+                )
+                name = cache['name']
+                expires_at = cache['expiresAt'] or expires_at
+            except Exception as e:
+                print(f"Не удалось создать кеш контекста для анализа {analysis.id}: {str(e)}")
+                expires_at = timezone.now() + timedelta(seconds=min(ttl, FAILED_CACHE_RETRY_AFTER))
+        
+        Analysis.objects.filter(pk=analysis.pk).update(
+            context_cache_name=name,
+            context_cache_key=dna_key,
+            context_cache_expires_at=expires_at
+        )
+        analysis.context_cache_name = name
+        analysis.context_cache_key = dna_key
+        analysis.context_cache_expires_at = expires_at
+    
+    return name or None
+
+
+def get_script_context(analysis: Analysis, gemini_service: Optional[GeminiService] = None) -> Dict[str, Any]:
+    """
+    Аргументы generate_script / generate_script_stream для анализа
+    
+    Returns:
+        {'style_passport': ..., 'patterns': ..., 'transcript': ..., 'cached_content': имя кеша или None}
+    """
+    cached_content = None
+    if settings.GEMINI_CONTEXT_CACHE_ENABLED:
+        cached_content = ensure_context_cache(analysis, gemini_service)
+    
+    return {
+        'style_passport': analysis.style_passport,
+        'patterns': analysis.patterns,
+        'transcript': analysis.transcript or None,
+        'cached_content': cached_content,
+    }
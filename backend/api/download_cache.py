@@ -0,0 +1,164 @@
+import os
+from datetime import timedelta
+from typing import Optional, Dict, Any
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import AnalysisSource, CachedDownload
+from .file_utils import save_local_file
+from .youtube_service import YouTubeService
+
+
+class DownloadCache:
+    """
+    Кеш скачанных видео перед YouTubeService.download_video
+    
+    Ключ - канонический id видео (определяется по URL без обращения к сети) и формат yt-dlp.
+    Файл кеша хранится в хранилище один раз, источники анализа ссылаются на него,
+    а не получают собственную копию. Записи вытесняются по TTL и по общему размеру (LRU).
+    """
+    
+    def __init__(self, youtube_service: Optional[YouTubeService] = None):
+        self.youtube_service = youtube_service or YouTubeService()
+    
+    def _build_key(self, extractor: str, video_id: str, format_selector: str) -> str:
+        """Формирование ключа кеша"""
+        return f"{extractor}:{video_id}:{format_selector}"
+    
+    def get_key(self, url: str) -> Optional[str]:
+        """Ключ кеша для URL (None, если id видео нельзя определить без сети)"""
+        canonical_id = self.youtube_service.get_canonical_id(url)
+        if not canonical_id:
+            return None
+        extractor, video_id = canonical_id
+        return self._build_key(extractor, video_id, self.youtube_service.get_format_selector(url))
+    
+    def _is_expired(self, entry: CachedDownload) -> bool:
+        """Проверка, истек ли срок жизни записи"""
+        return entry.created_at < timezone.now() - timedelta(seconds=settings.DOWNLOAD_CACHE_TTL)
+    
+    def _remove_entry(self, entry: CachedDownload) -> None:
+        """
+        Удаление записи кеша
+        
+        Файл удаляется из хранилища, только если на него не ссылается ни один источник анализа.
+        """
+        file_name = entry.file.name
+        storage = entry.file.storage
+        entry.delete()
+        if file_name and not AnalysisSource.objects.filter(file=file_name).exists():
+            storage.delete(file_name)
+    
+    def lookup(self, url: str) -> Optional[CachedDownload]:
+        """
+        Поиск видео в кеше
+        
+        Args:
+            url: URL видео
+        
+        Returns:
+            Запись кеша или None
+        """
+        key = self.get_key(url)
+        if not key:
+            return None
+        
+        entry = CachedDownload.objects.filter(cache_key=key).first()
+        if entry is None:
+            return None
+        
+        if self._is_expired(entry) or not entry.file.storage.exists(entry.file.name):
+            self._remove_entry(entry)
+            return None
+        
+        CachedDownload.objects.filter(id=entry.id).update(
+            last_accessed_at=timezone.now(),
+            hit_count=F('hit_count') + 1,
+        )
+        return entry
+    
+    def store(self, url: str, video_data: Dict[str, Any]) -> Optional[CachedDownload]:
+        """
+        Сохранение скачанного видео в кеш (файл перемещается в хранилище)
+        
+        Args:
+            url: URL видео
+            video_data: Результат YouTubeService.download_video(..., keep_file=True)
+        
+        Returns:
+            Запись кеша или None, если для URL нельзя построить ключ (get_key) -
+            такую запись lookup все равно не нашел бы; файл в этом случае остается на месте
+        """
+        canonical_id = self.youtube_service.get_canonical_id(url)
+        if not canonical_id:
+            return None
+        
+        extractor, video_id = canonical_id
+        format_selector = self.youtube_service.get_format_selector(url)
+        key = self._build_key(extractor, video_id, format_selector)
+        
+        # Устаревшая запись с тем же ключом заменяется новой
+        for stale in CachedDownload.objects.filter(cache_key=key):
+            self._remove_entry(stale)
+        
+        entry = CachedDownload(
+            cache_key=key,
+            extractor=extractor,
+            video_id=video_id,
+            format_selector=format_selector,
+            file_mime_type=video_data['mime_type'],
+            file_size=video_data.get('file_size') or 0,
+            title=(video_data.get('title') or '')[:500],
+            duration=video_data.get('duration') or 0,
+            transcript=video_data.get('transcript') or [],
+        )
+        extension = os.path.splitext(video_data['file_path'])[1] or '.mp4'
+        file_name = f"{self.youtube_service._sanitize_filename(video_id)}{extension}"
+        save_local_file(entry.file, file_name, video_data['file_path'])
+        
+        try:
+            with transaction.atomic():
+                entry.save()
+        except IntegrityError:
+            # То же видео одновременно закешировал другой воркер - используем его запись
+            entry.file.delete(save=False)
+            return CachedDownload.objects.get(cache_key=key)
+        
+        self.evict(keep=entry)
+        return entry
+    
+    def evict(self, keep: Optional[CachedDownload] = None) -> int:
+        """
+        Вытеснение записей: сначала с истекшим TTL, затем самые давно использованные,
+        пока общий размер кеша больше DOWNLOAD_CACHE_MAX_BYTES
+        
+        Args:
+            keep: Запись, которую нельзя вытеснять (только что сохраненная)
+        
+        Returns:
+            Количество удаленных записей
+        """
+        removed = 0
+        expired_before = timezone.now() - timedelta(seconds=settings.DOWNLOAD_CACHE_TTL)
+        for entry in CachedDownload.objects.filter(created_at__lt=expired_before):
+            self._remove_entry(entry)
+            removed += 1
+        
+        total_size = CachedDownload.objects.aggregate(total=Sum('file_size'))['total'] or 0
+        if total_size <= settings.DOWNLOAD_CACHE_MAX_BYTES:
+            return removed
+        
+        lru_entries = CachedDownload.objects.order_by('last_accessed_at')
+        if keep is not None:
+            lru_entries = lru_entries.exclude(id=keep.id)
+        
+        for entry in lru_entries:
+            if total_size <= settings.DOWNLOAD_CACHE_MAX_BYTES:
+                break
+            total_size -= entry.file_size
+            self._remove_entry(entry)
+            removed += 1
+        
+        return removed
@@ -0,0 +1,174 @@
+import os
+import random
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+from django.conf import settings
+
+from .scratch_space import reserve as reserve_scratch_space
+from .youtube_service import YouTubeService, DownloadError, DownloadTransientError, DownloadThrottled
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов (token bucket)
+    
+    Токены пополняются со скоростью rate в секунду до capacity. После ограничения
+    со стороны платформы бакет можно приостановить: новые токены не выдаются до конца паузы.
+    """
+    
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate: Скорость пополнения (токенов в секунду)
+            capacity: Максимальное количество токенов (допустимый всплеск запросов)
+        """
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float) -> None:
+        """Пополнение токенов за время с последнего обращения"""
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+    
+    def acquire(self) -> float:
+        """
+        Получение токена (блокирует поток, пока токен не появится)
+        
+        Returns:
+            Время ожидания в секундах
+        """
+        started_at = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return now - started_at
+                
+                delay = max(self._paused_until - now, (1 - self._tokens) / self.rate if self.rate else 1.0)
+            time.sleep(min(max(delay, 0.01), 5))
+    
+    def pause(self, seconds: float) -> None:
+        """Приостановка выдачи токенов (платформа ответила ограничением частоты)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class DownloadScheduler:
+    """
+    Планировщик скачиваний с платформ
+    
+    Для каждой пары (платформа, cookies) свой token bucket: аккаунты с разными cookies
+    ограничиваются независимо. Одновременные скачивания с платформы ограничены семафором.
+    Временные ошибки и ограничения частоты повторяются с экспоненциальной задержкой,
+    при ограничении частоты приостанавливается весь бакет, чтобы не усугублять блокировку.
+    """
+    
+    def __init__(self):
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+    
+    def get_bucket(self, platform: str, identity: str) -> TokenBucket:
+        """Бакет платформы и cookies (создается при первом обращении)"""
+        with self._lock:
+            key = (platform, identity)
+            if key not in self._buckets:
+                limits = settings.DOWNLOAD_RATE_LIMITS.get(platform, {})
+                self._buckets[key] = TokenBucket(
+                    rate=limits.get('per_minute', 60) / 60,
+                    capacity=limits.get('burst', 1)
+                )
+            return self._buckets[key]
+    
+    def get_semaphore(self, platform: str) -> threading.BoundedSemaphore:
+        """Семафор платформы (создается при первом обращении)"""
+        with self._lock:
+            if platform not in self._semaphores:
+                limit = settings.DOWNLOAD_PLATFORM_CONCURRENCY.get(platform, settings.DOWNLOAD_MAX_WORKERS)
+                self._semaphores[platform] = threading.BoundedSemaphore(max(limit, 1))
+            return self._semaphores[platform]
+    
+    def _retry_delay(self, attempt: int, error: DownloadTransientError) -> float:
+        """Задержка перед повтором: экспоненциальная с разбросом, не меньше Retry-After платформы"""
+        delay = min(settings.DOWNLOAD_RETRY_BASE_DELAY * 2 ** (attempt - 1), settings.DOWNLOAD_RETRY_MAX_DELAY)
+        delay = delay * random.uniform(0.5, 1.0)
+        if isinstance(error, DownloadThrottled) and error.retry_after:
+            delay = max(delay, min(error.retry_after, settings.DOWNLOAD_RETRY_MAX_DELAY))
+        return delay
+    
+    def download(self, youtube_service: YouTubeService, url: str, output_dir: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Скачивание видео на диск через очередь платформы
+        
+        Args:
+            youtube_service: Сервис скачивания
+            url: URL видео
+            output_dir: Директория для файла
+        
+        Returns:
+            Результат YouTubeService.download_video(..., keep_file=True) с дополнительными ключами
+            'queue_wait' (секунды ожидания очереди, лимитов и повторов) и 'attempts' (число попыток)
+        
+        Raises:
+            DownloadError: Постоянная ошибка или исчерпаны попытки (в атрибутах queue_wait и attempts)
+        """
+        platform = youtube_service.get_platform(url) or 'other'
+        cookie_file = youtube_service.get_cookie_file(url)
+        bucket = self.get_bucket(platform, os.path.basename(cookie_file) if cookie_file else 'anonymous')
+        semaphore = self.get_semaphore(platform)
+        
+        queue_wait = 0.0
+        attempt = 0
+        
+        while True:
+            attempt += 1
+            queue_wait += bucket.acquire()
+            
+            waiting_since = time.monotonic()
+            try:
+                with semaphore, reserve_scratch_space():
+                    queue_wait += time.monotonic() - waiting_since
+                    video_data = youtube_service.download_video(url, output_dir=output_dir, keep_file=True)
+            except DownloadTransientError as e:
+                if attempt > settings.DOWNLOAD_MAX_RETRIES:
+                    e.queue_wait, e.attempts = queue_wait, attempt
+                    raise
+                
+                delay = self._retry_delay(attempt, e)
+                print(f"Повтор скачивания {url} через {delay:.1f} с (попытка {attempt}): {str(e)}")
+                if isinstance(e, DownloadThrottled):
+                    # Пауза для всех скачиваний с этими cookies, ожидание учтется в bucket.acquire
+                    bucket.pause(delay)
+                else:
+                    time.sleep(delay)
+                    queue_wait += delay
+                continue
+            except DownloadError as e:
+                e.queue_wait, e.attempts = queue_wait, attempt
+                raise
+            
+            video_data['queue_wait'] = round(queue_wait, 2)
+            video_data['attempts'] = attempt
+            return video_data
+
+
+# Один планировщик на процесс: лимиты общие для всех анализов, выполняемых воркером
+_scheduler: Optional[DownloadScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_download_scheduler() -> DownloadScheduler:
+    """Планировщик скачиваний процесса"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = DownloadScheduler()
+        return _scheduler
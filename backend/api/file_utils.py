@@ -0,0 +1,69 @@
+import hashlib
+import os
+import tempfile
+from django.conf import settings
+from django.core.files import File
+
+from .scratch_space import get_scratch_root
+
+
+class LocalFile(File):
+    """
+    Файл на локальном диске, который хранилище может переместить вместо копирования
+    
+    FileSystemStorage перемещает файлы с temporary_file_path() (как загрузки Django),
+    остальные хранилища читают файл частями через chunks().
+    """
+    
+    def __init__(self, file, path: str):
+        super().__init__(file)
+        self._path = path
+    
+    def temporary_file_path(self) -> str:
+        return self._path
+
+
+def save_local_file(field_file, name: str, path: str) -> None:
+    """Перенос файла с диска в хранилище без чтения целиком в память"""
+    with open(path, 'rb') as f:
+        field_file.save(name, LocalFile(f, path), save=False)
+
+
+def get_local_path(field_file) -> str:
+    """
+    Путь к файлу из хранилища на локальном диске
+    
+    Для хранилищ без локальных путей файл копируется частями во временный файл
+    в рабочем пространстве (брошенные копии удаляет scratch_space.sweep).
+    """
+    try:
+        return field_file.path
+    except NotImplementedError:
+        suffix = os.path.splitext(field_file.name)[1]
+        with tempfile.NamedTemporaryFile(prefix='copy-', suffix=suffix, dir=get_scratch_root(), delete=False) as tmp:
+            with field_file.open('rb') as f:
+                for chunk in f.chunks():
+                    tmp.write(chunk)
+        return tmp.name
+
+
+def hash_file(field_file) -> str:
+    """SHA-256 содержимого файла из хранилища (файл читается частями)"""
+    digest = hashlib.sha256()
+    with field_file.open('rb') as f:
+        for chunk in f.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_local_file(path: str) -> str:
+    """SHA-256 содержимого файла на локальном диске (файл читается частями)"""
+    with open(path, 'rb') as f:
+        return hash_file(File(f))
+
+
+def get_partial_upload_path(upload_id) -> str:
+    """Путь к незавершенной загрузке на локальном диске (UPLOAD_PARTIAL_ROOT)"""
+    root = str(settings.UPLOAD_PARTIAL_ROOT)
+    os.makedirs(root, exist_ok=True)
+    return os.path.join(root, f"{upload_id}.part")
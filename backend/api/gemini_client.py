@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import weakref
+from typing import Dict, Any, Optional
+import httpx
+from google.genai import Client
+from google.genai import types as genai_types
+from django.conf import settings
+
+from .instrumentation import current_call
+from .loop_resources import close_in_loop, close_on_loop_shutdown
+
+
+class ClientStats:
+    """Счетчики запросов одного клиента (общие для синхронного и асинхронного транспорта)"""
+    
+    def __init__(self):
+        self.created_at = time.time()
+        self.requests_total = 0
+        self.errors_total = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+    
+    def started(self) -> None:
+        """Начало запроса"""
+        with self._lock:
+            self.requests_total += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    
+    def finished(self, failed: bool = False) -> None:
+        """Завершение запроса (failed - сетевая ошибка или ответ 5xx)"""
+        with self._lock:
+            self.in_flight -= 1
+            if failed:
+                self.errors_total += 1
+    
+    def as_dict(self) -> Dict[str, Any]:
+        """Снимок счетчиков"""
+        with self._lock:
+            return {
+                'created_at': self.created_at,
+                'requests_total': self.requests_total,
+                'errors_total': self.errors_total,
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+            }
+
+
+def _pool_connections(transport: httpx.BaseTransport) -> Dict[str, int]:
+    """Открытые и простаивающие соединения пула httpcore (если транспорт их отдает)"""
+    connections = getattr(getattr(transport, '_pool', None), 'connections', None) or []
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {'open': len(connections), 'idle': idle}
+
+
+def _request_size(request: httpx.Request) -> int:
+    """Размер тела запроса (для потоковой загрузки - по Content-Length)"""
+    try:
+        return len(request.content)
+    except httpx.RequestNotRead:
+        return int(request.headers.get('content-length') or 0)
+
+
+class _CountingStream(httpx.SyncByteStream):
+    """Тело ответа с подсчетом полученных байт в текущем вызове внешнего API"""
+    
+    def __init__(self, stream: httpx.SyncByteStream, record):
+        self._stream = stream
+        self._record = record
+    
+    def __iter__(self):
+        for chunk in self._stream:
+            self._record.response_bytes += len(chunk)
+            yield chunk
+    
+    def close(self) -> None:
+        self._stream.close()
+
+
+class _AsyncCountingStream(httpx.AsyncByteStream):
+    """Асинхронное тело ответа с подсчетом полученных байт"""
+    
+    def __init__(self, stream: httpx.AsyncByteStream, record):
+        self._stream = stream
+        self._record = record
+    
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._record.response_bytes += len(chunk)
+            yield chunk
+    
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+class _TrackingTransport(httpx.HTTPTransport):
+    """HTTP-транспорт пула соединений с подсчетом запросов и объема данных"""
+    
+    def __init__(self, stats: ClientStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+    
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.started()
+        failed = True
+        try:
+            response = super().handle_request(request)
+            failed = response.status_code >= 500
+            record = current_call()
+            if record:
+                record.request_bytes += _request_size(request)
+                response.stream = _CountingStream(response.stream, record)
+            return response
+        finally:
+            self.stats.finished(failed)
+
+
+class _AsyncTrackingTransport(httpx.AsyncHTTPTransport):
+    """Асинхронный HTTP-транспорт пула соединений с подсчетом запросов"""
+    
+    def __init__(self, stats: ClientStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.started()
+        failed = True
+        try:
+            response = await super().handle_async_request(request)
+            failed = response.status_code >= 500
+            record = current_call()
+            if record:
+                record.request_bytes += _request_size(request)
+                response.stream = _AsyncCountingStream(response.stream, record)
+            return response
+        finally:
+            self.stats.finished(failed)
+
+
+class GeminiClientRegistry:
+    """
+    Реестр клиентов Gemini на весь процесс
+    
+    google.genai.Client создает собственные пулы HTTP-соединений, поэтому клиент создается
+    один раз на API-ключ и переиспользуется всеми запросами процесса (клиент потокобезопасен).
+    Размер пула и таймауты задаются настройками GEMINI_HTTP_*.
+    """
+    
+    def __init__(self):
+        self._clients: Dict[str, Dict[str, Any]] = {}
+        # Асинхронные клиенты по циклам событий: соединения asyncio нельзя использовать
+        # из другого цикла, поэтому клиенты цикла закрываются вместе с ним
+        self._async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]' = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+    
+    def _limits(self) -> httpx.Limits:
+        """Размер пула соединений из настроек"""
+        return httpx.Limits(
+            max_connections=settings.GEMINI_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.GEMINI_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.GEMINI_HTTP_KEEPALIVE_EXPIRY,
+        )
+    
+    def _http_options(self, **kwargs) -> genai_types.HttpOptions:
+        """Настройки HTTP клиента SDK"""
+        # Таймаут в HttpOptions задается в миллисекундах
+        return genai_types.HttpOptions(timeout=int(settings.GEMINI_HTTP_TIMEOUT * 1000), **kwargs)
+    
+    def _build_client(self, api_key: str) -> Dict[str, Any]:
+        """Создание клиента с настроенным пулом соединений"""
+        stats = ClientStats()
+        limits = self._limits()
+        transport = _TrackingTransport(stats, limits=limits)
+        async_transport = _AsyncTrackingTransport(stats, limits=limits)
+        
+        client = Client(
+            api_key=api_key,
+            http_options=self._http_options(
+                client_args={'transport': transport},
+                async_client_args={'transport': async_transport},
+            ),
+        )
+        return {'client': client, 'stats': stats, 'transport': transport, 'async_transport': async_transport}
+    
+    def _resolve_key(self, api_key: Optional[str]) -> tuple:
+        """API-ключ (по умолчанию из окружения) и его короткий хеш для реестра"""
+        api_key = api_key or os.environ.get('GEMINI_API_KEY')
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY environment variable is not set")
+        return api_key, hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+    
+    def _get_entry(self, api_key: str, key: str) -> Dict[str, Any]:
+        """Запись реестра для ключа (создается при первом обращении, вызывается под блокировкой)"""
+        if key not in self._clients:
+            self._clients[key] = self._build_client(api_key)
+        return self._clients[key]
+    
+    def get_client(self, api_key: Optional[str] = None) -> Client:
+        """
+        Клиент Gemini для API-ключа (создается при первом обращении)
+        
+        Args:
+            api_key: API-ключ (по умолчанию GEMINI_API_KEY из окружения)
+        """
+        api_key, key = self._resolve_key(api_key)
+        with self._lock:
+            return self._get_entry(api_key, key)['client']
+    
+    def get_async_client(self, api_key: Optional[str] = None):
+        """
+        Асинхронный клиент Gemini (client.aio) для текущего цикла событий
+        
+        Под ASGI-сервером цикл один на процесс, и клиент фактически общий. Под runserver
+        и в async_to_sync цикл создается на запрос, поэтому клиент тоже свой и не
+        переиспользует соединения закрытого цикла; его соединения закрываются при
+        завершении цикла. Счетчики общие с синхронным клиентом.
+        
+        Args:
+            api_key: API-ключ (по умолчанию GEMINI_API_KEY из окружения)
+        """
+        api_key, key = self._resolve_key(api_key)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._get_entry(api_key, key)
+            if loop not in self._async_clients:
+                self._async_clients[loop] = {}
+                close_on_loop_shutdown(self._close_loop_clients)
+            loop_clients = self._async_clients[loop]
+            if key not in loop_clients:
+                transport = _AsyncTrackingTransport(entry['stats'], limits=self._limits())
+                client = Client(
+                    api_key=api_key,
+                    http_options=self._http_options(async_client_args={'transport': transport}),
+                )
+                loop_clients[key] = {'client': client, 'transport': transport}
+            return loop_clients[key]['client'].aio
+    
+    async def _close_loop_clients(self) -> None:
+        """Закрытие асинхронных клиентов текущего цикла событий (при его завершении)"""
+        with self._lock:
+            loop_clients = self._async_clients.pop(asyncio.get_running_loop(), {})
+        for entry in loop_clients.values():
+            await entry['transport'].aclose()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Статистика пулов: запросы, ошибки, активные запросы и соединения каждого клиента"""
+        with self._lock:
+            entries = dict(self._clients)
+        
+        return {
+            'clients': [
+                {
+                    'key': key,
+                    **entry['stats'].as_dict(),
+                    'connections': _pool_connections(entry['transport']),
+                }
+                for key, entry in entries.items()
+            ],
+            'limits': {
+                'max_connections': settings.GEMINI_HTTP_MAX_CONNECTIONS,
+                'max_keepalive_connections': settings.GEMINI_HTTP_MAX_KEEPALIVE,
+                'keepalive_expiry': settings.GEMINI_HTTP_KEEPALIVE_EXPIRY,
+                'timeout': settings.GEMINI_HTTP_TIMEOUT,
+            },
+        }
+    
+    def close(self) -> None:
+        """Закрытие всех клиентов (например, при остановке воркера)"""
+        with self._lock:
+            entries, self._clients = self._clients, {}
+            async_entries = list(self._async_clients.items())
+            self._async_clients = weakref.WeakKeyDictionary()
+        for entry in entries.values():
+            entry['transport'].close()
+        for loop, loop_clients in async_entries:
+            for entry in loop_clients.values():
+                close_in_loop(loop, entry['transport'].aclose)
+
+
+_registry = GeminiClientRegistry()
+
+
+def get_gemini_client(api_key: Optional[str] = None) -> Client:
+    """Общий клиент Gemini процесса"""
+    return _registry.get_client(api_key)
+
+
+def get_async_gemini_client(api_key: Optional[str] = None):
+    """Асинхронный клиент Gemini текущего цикла событий"""
+    return _registry.get_async_client(api_key)
+
+
+def get_gemini_client_stats() -> Dict[str, Any]:
+    """Статистика общих клиентов Gemini"""
+    return _registry.stats()
+
+
+def close_gemini_clients() -> None:
+    """Закрытие общих клиентов Gemini"""
+    _registry.close()
@@ -1,25 +1,114 @@
+import asyncio
 import os
 import time
 import base64
 import json
 import re
-from typing import List, Dict, Any, Optional
-from google.genai import Client
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator
 from google.genai import types as genai_types
+from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 import io
 from .kie_service import KieService
+from .gemini_client import get_gemini_client, get_async_gemini_client
+from .subtitles import transcript_to_text
+from .json_stream import JsonArrayStream
+from .instrumentation import instrumented, note_retry, note_usage
+from .resilience import RetryGuard, call_with_retries, acall_with_retries
+
+
+# Схема ответа анализа
+ANALYZE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "transcript": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "start": {"type": "string"},
+                    "end": {"type": "string"},
+                    "text": {"type": "string"},
+                },
+                "required": ["start", "end", "text"],
+            },
+            "description": "Объединенный или наиболее репрезентативный транскрипт.",
+        },
+        "stylePassport": {
+            "type": "object",
+            "properties": {
+                "structure": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "segment": {"type": "string"},
+                            "start": {"type": "string"},
+                            "end": {"type": "string"},
+                            "description": {"type": "string"},
+                        },
+                        "required": ["segment", "start", "end", "description"],
+                    },
+                },
+                "speech_rate_wpm": {"type": "number"},
+                "catchphrases": {"type": "array", "items": {"type": "string"}},
+                "fillers": {"type": "array", "items": {"type": "string"}},
+                "sentiment": {"type": "string"},
+                "tone_tags": {"type": "array", "items": {"type": "string"}},
+                "visual_context": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["structure", "speech_rate_wpm", "catchphrases", "fillers", "sentiment", "tone_tags", "visual_context"],
+        },
+        "patterns": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "description": {"type": "string"},
+                    "impact": {"type": "string", "enum": ["Высокий", "Средний", "Низкий"]},
+                    "evidence_segments": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["name", "description", "impact", "evidence_segments"],
+            },
+            "description": "Общие паттерны успеха, найденные во ВСЕХ предоставленных видео.",
+        },
+    },
+    "required": ["transcript", "stylePassport", "patterns"],
+}
+
+# Схема ДНК без транскрипта: транскрипт уже известен (субтитры) или собирается из анализов отдельных видео
+DNA_SCHEMA = {
+    **ANALYZE_SCHEMA,
+    "properties": {k: v for k, v in ANALYZE_SCHEMA["properties"].items() if k != "transcript"},
+    "required": ["stylePassport", "patterns"],
+}
 
 
 class GeminiService:
     """Сервис для работы с Gemini API"""
     
+    ANALYSIS_MODEL = "gemini-3-flash-preview"
+    # Сведение анализов отдельных видео в ДНК группы - только текст, без видео
+    REDUCE_MODEL = "gemini-3-flash-preview"
+    SCRIPT_MODEL = "gemini-3-flash-preview"
+    SCRIPT_TEMPERATURE = 0.7
+    SPEECH_MODEL = "gemini-2.5-flash-preview-tts"
+    # Речь модели - PCM 16 бит, моно, с этой частотой дискретизации
+    SPEECH_SAMPLE_RATE = 24000
+    
+    # Версия промпта и схемы анализа - входит в ключ кеша результатов анализа,
+    # ее нужно увеличивать при любом изменении промпта или ANALYZE_SCHEMA
+    ANALYSIS_PROMPT_VERSION = 2
+    # То же для промпта сведения анализов (ANALYSIS_MODE = 'map_reduce')
+    REDUCE_PROMPT_VERSION = 1
+    # То же для промпта и схемы сценария (ключ кеша сценариев)
+    SCRIPT_PROMPT_VERSION = 2
+    
     def __init__(self):
-        api_key = os.environ.get('GEMINI_API_KEY')
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY environment variable is not set")
-        self.client = Client(api_key=api_key)
+        # Клиент общий для процесса: пул соединений и TLS-сессии переиспользуются между запросами
+        self.client = get_gemini_client()
     
     def _safe_json_parse(self, text: str, fallback: Any) -> Any:
         """Безопасный парсинг JSON из ответа"""
@@ -65,101 +154,184 @@ class GeminiService:
             pass
         return sources
     
-    def _with_retries(self, fn, retries=2, base_delay_ms=400):
-        """Повторные попытки при ошибках"""
-        base = base_delay_ms
-        last_err = None
+    def _with_retries(self, operation: str, fn):
+        """
+        Повторные попытки при сбоях API (см. resilience.RetryGuard)
         
-        for attempt in range(retries + 1):
-            try:
-                return fn()
-            except Exception as e:
-                last_err = e
-                err_msg = str(e).lower()
-                is_retryable = '500' in err_msg or 'xhr' in err_msg or 'proxyunarycall' in err_msg or 'retry' in err_msg
-                if attempt == retries or not is_retryable:
-                    break
-                time.sleep(base * (2 ** attempt) / 1000)
+        Args:
+            operation: Название операции (время на нее - UPSTREAM_DEADLINES['gemini.<operation>'])
+            fn: Функция попытки, получает таймаут попытки в секундах
+        """
+        return call_with_retries('gemini', operation, fn)
+    
+    def _http_options(self, timeout: float) -> genai_types.HttpOptions:
+        """Таймаут запроса: остаток времени операции, но не больше GEMINI_HTTP_TIMEOUT"""
+        return genai_types.HttpOptions(timeout=int(min(timeout, settings.GEMINI_HTTP_TIMEOUT) * 1000))
+    
+    def _with_timeout(self, request: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """Аргументы generate_content с таймаутом попытки"""
+        config = request.get('config') or genai_types.GenerateContentConfig()
+        return {**request, 'config': config.model_copy(update={'http_options': self._http_options(timeout)})}
+    
+    def _wait_for_file_active(self, uploaded_file, timeout: int = 300):
+        """Ожидание окончания обработки загруженного файла на стороне Gemini"""
+        deadline = time.monotonic() + timeout
+        while uploaded_file.state == genai_types.FileState.PROCESSING:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Файл {uploaded_file.name} не обработан за {timeout} секунд")
+            time.sleep(2)
+            uploaded_file = self.client.files.get(name=uploaded_file.name)
+        
+        if uploaded_file.state == genai_types.FileState.FAILED:
+            raise ValueError(f"Gemini не смог обработать файл {uploaded_file.name}")
         
-        raise last_err
+        return uploaded_file
     
-    def analyze_content(self, inputs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    @instrumented('gemini', 'upload_file')
+    def upload_file(self, path: str, mime_type: str) -> Dict[str, Any]:
         """
-        Анализ контента для выявления ДНК успеха
+        Загрузка файла через Files API (файл читается с диска частями, а не целиком в память)
         
         Args:
-            inputs: Список источников [{'type': 'url', 'value': '...', 'label': '...'}, ...]
+            path: Путь к файлу на диске
+            mime_type: MIME тип файла
         
         Returns:
-            {
-                'transcript': [...],
-                'stylePassport': {...},
-                'patterns': [...],
-                'sources': [...]
-            }
+            {'name': ..., 'uri': ..., 'mimeType': ..., 'expiresAt': datetime или None}
         """
-        # Схема для анализа
-        ANALYZE_SCHEMA = {
-            "type": "object",
-            "properties": {
-                "transcript": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "start": {"type": "string"},
-                            "end": {"type": "string"},
-                            "text": {"type": "string"},
-                        },
-                        "required": ["start", "end", "text"],
-                    },
-                    "description": "Объединенный или наиболее репрезентативный транскрипт.",
-                },
-                "stylePassport": {
-                    "type": "object",
-                    "properties": {
-                        "structure": {
-                            "type": "array",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "segment": {"type": "string"},
-                                    "start": {"type": "string"},
-                                    "end": {"type": "string"},
-                                    "description": {"type": "string"},
-                                },
-                                "required": ["segment", "start", "end", "description"],
-                            },
-                        },
-                        "speech_rate_wpm": {"type": "number"},
-                        "catchphrases": {"type": "array", "items": {"type": "string"}},
-                        "fillers": {"type": "array", "items": {"type": "string"}},
-                        "sentiment": {"type": "string"},
-                        "tone_tags": {"type": "array", "items": {"type": "string"}},
-                        "visual_context": {"type": "array", "items": {"type": "string"}},
-                    },
-                    "required": ["structure", "speech_rate_wpm", "catchphrases", "fillers", "sentiment", "tone_tags", "visual_context"],
-                },
-                "patterns": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "name": {"type": "string"},
-                            "description": {"type": "string"},
-                            "impact": {"type": "string", "enum": ["Высокий", "Средний", "Низкий"]},
-                            "evidence_segments": {"type": "array", "items": {"type": "string"}},
-                        },
-                        "required": ["name", "description", "impact", "evidence_segments"],
-                    },
-                    "description": "Общие паттерны успеха, найденные во ВСЕХ предоставленных видео.",
-                },
-            },
-            "required": ["transcript", "stylePassport", "patterns"],
+        uploaded_file = self._with_retries('upload_file', lambda timeout: self.client.files.upload(
+            file=path,
+            config=genai_types.UploadFileConfig(mime_type=mime_type, http_options=self._http_options(timeout)),
+        ))
+        uploaded_file = self._wait_for_file_active(uploaded_file)
+        return {
+            'name': uploaded_file.name,
+            'uri': uploaded_file.uri,
+            'mimeType': uploaded_file.mime_type or mime_type,
+            'expiresAt': uploaded_file.expiration_time,
+        }
+    
+    @instrumented('gemini', 'get_file')
+    def is_file_active(self, name: str) -> bool:
+        """Проверка, что загруженный файл все еще доступен в Files API"""
+        try:
+            return self.client.files.get(name=name).state == genai_types.FileState.ACTIVE
+        except Exception:
+            return False
+    
+    def _path_part(self, path: str, mime_type: str) -> Dict[str, Any]:
+        """
+        Часть запроса для файла на диске
+        
+        Большие файлы помечаются для загрузки через Files API (загружаются один раз до запроса,
+        повторные попытки их не пересылают), небольшие передаются внутри запроса.
+        """
+        key = "upload_path" if os.path.getsize(path) > settings.GEMINI_INLINE_MAX_BYTES else "inline_path"
+        return {
+            key: {
+                "path": path,
+                "mime_type": mime_type
+            }
+        }
+    
+    def _uploaded_part(self, uploaded: Dict[str, Any]) -> Dict[str, Any]:
+        """Часть запроса для файла, загруженного через Files API"""
+        return {
+            "file_data": {
+                "file_uri": uploaded['uri'],
+                "mime_type": uploaded['mimeType']
+            }
         }
+    
+    def _to_genai_parts(self, content_parts: List[Dict[str, Any]]) -> List[genai_types.Part]:
+        """Части запроса в формате SDK (небольшие файлы читаются с диска только на время запроса)"""
+        parts = []
+        for part in content_parts:
+            if "text" in part:
+                parts.append(genai_types.Part(text=part["text"]))
+            elif "inline_data" in part:
+                parts.append(genai_types.Part(
+                    inline_data=genai_types.Blob(
+                        data=part["inline_data"]["data"],
+                        mime_type=part["inline_data"]["mime_type"]
+                    )
+                ))
+            elif "inline_path" in part:
+                with open(part["inline_path"]["path"], 'rb') as f:
+                    parts.append(genai_types.Part(
+                        inline_data=genai_types.Blob(
+                            data=f.read(),
+                            mime_type=part["inline_path"]["mime_type"]
+                        )
+                    ))
+            elif "file_data" in part:
+                parts.append(genai_types.Part(
+                    file_data=genai_types.FileData(
+                        file_uri=part["file_data"]["file_uri"],
+                        mime_type=part["file_data"]["mime_type"]
+                    )
+                ))
+        return parts
+    
+    def _response_text(self, resp) -> str:
+        """Текст ответа модели"""
+        text = ""
+        if hasattr(resp, 'text'):
+            text = resp.text
+        elif hasattr(resp, 'candidates') and resp.candidates:
+            for candidate in resp.candidates:
+                if hasattr(candidate, 'content') and candidate.content:
+                    for part in candidate.content.parts:
+                        if hasattr(part, 'text'):
+                            text += part.text
+        return text
+    
+    def _response_inline_data(self, resp) -> Optional[bytes]:
+        """Первые бинарные данные ответа модели (изображение или звук)"""
+        if hasattr(resp, 'candidates') and resp.candidates:
+            for candidate in resp.candidates:
+                if hasattr(candidate, 'content') and candidate.content:
+                    for part in candidate.content.parts:
+                        if hasattr(part, 'inline_data') and part.inline_data:
+                            data = part.inline_data.data
+                            # SDK отдает bytes, но в JSON-ответе данные приходят в base64
+                            return base64.b64decode(data) if isinstance(data, str) else data
+        return None
+    
+    def _combine_transcripts(self, inputs: List[Dict[str, Any]]) -> Optional[List[Dict[str, str]]]:
+        """
+        Общий транскрипт из готовых транскриптов источников
+        
+        Returns:
+            Сегменты транскрипта или None, если хотя бы у одного источника транскрипта нет.
+            Для нескольких видео первый сегмент каждого видео помечается его названием.
+        """
+        if not inputs or not all(input_item.get('transcript') for input_item in inputs):
+            return None
+        
+        if len(inputs) == 1:
+            return list(inputs[0]['transcript'])
+        
+        combined = []
+        for input_item in inputs:
+            label = input_item.get('label') or 'без названия'
+            for index, segment in enumerate(input_item['transcript']):
+                text = f"[{label}] {segment['text']}" if index == 0 else segment['text']
+                combined.append({**segment, 'text': text})
+        return combined
+    
+    def _build_analysis_request(self, inputs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Запрос анализа без обращения к API: части запроса, конфигурация и готовый транскрипт
         
+        Большие файлы в частях запроса помечены "upload_path" - их нужно загрузить через Files API.
+        
+        Returns:
+            {'content_parts': [...], 'config': GenerateContentConfig, 'ready_transcript': сегменты или None}
+        """
         content_parts = []
         has_url = False
+        has_preprocessed = False
         
         for input_item in inputs:
             if input_item.get('type') == 'url':
@@ -167,16 +339,55 @@ class GeminiService:
                 content_parts.append({
                     "text": f"ССЫЛКА НА ВИДЕО ДЛЯ АНАЛИЗА: {input_item['value']}"
                 })
+            elif input_item.get('type') == 'preprocessed':
+                # Видео передано ключевыми кадрами сцен, звуком и измеренными метриками монтажа
+                has_preprocessed = True
+                preprocessed = input_item['value']
+                content_parts.append({
+                    "text": (
+                        f"ВИДЕО «{input_item.get('label') or 'без названия'}»: переданы ключевые кадры каждой сцены "
+                        f"и звуковая дорожка. Измеренные метрики монтажа (точные значения): "
+                        f"{json.dumps(preprocessed['stats'], ensure_ascii=False)}"
+                    )
+                })
+                for index, keyframe in enumerate(preprocessed['keyframes']):
+                    content_parts.append({"text": f"Кадр сцены {index + 1}, {keyframe['time']:.1f} с"})
+                    content_parts.append(self._path_part(keyframe['path'], keyframe['mimeType']))
+                # Если есть готовый транскрипт, звук для расшифровки не нужен
+                if preprocessed.get('audio') and not input_item.get('transcript'):
+                    content_parts.append({"text": "Звуковая дорожка видео:"})
+                    content_parts.append(self._path_part(preprocessed['audio']['path'], preprocessed['audio']['mimeType']))
             else:
                 # Для файлов - нужно передать base64 данные
                 file_data = input_item.get('value', {})
-                if isinstance(file_data, dict) and 'data' in file_data:
+                if isinstance(file_data, dict) and 'fileUri' in file_data:
+                    # Файл уже загружен через Files API - передаем только ссылку
+                    content_parts.append({
+                        "file_data": {
+                            "file_uri": file_data['fileUri'],
+                            "mime_type": file_data.get('mimeType', 'video/mp4')
+                        }
+                    })
+                elif isinstance(file_data, dict) and 'data' in file_data:
                     content_parts.append({
                         "inline_data": {
                             "data": file_data['data'],
                             "mime_type": file_data.get('mimeType', 'video/mp4')
                         }
                     })
+                elif isinstance(file_data, dict) and 'path' in file_data:
+                    content_parts.append(self._path_part(file_data['path'], file_data.get('mimeType', 'video/mp4')))
+            
+            if input_item.get('transcript'):
+                content_parts.append({
+                    "text": (
+                        f"ГОТОВЫЙ ТРАНСКРИПТ ВИДЕО «{input_item.get('label') or 'без названия'}» "
+                        f"(из субтитров, таймкоды точные):\n{transcript_to_text(input_item['transcript'])}"
+                    )
+                })
+        
+        # Если транскрипты всех видео уже есть, модель не расшифровывает речь
+        ready_transcript = self._combine_transcripts(inputs)
         
         system_instruction = f"""
             Ты — высококлассный AI-продюсер. Тебе предоставлено {len(inputs)} видео.
@@ -192,72 +403,217 @@ class GeminiService:
             Ответ должен быть СТРОГО в формате JSON на РУССКОМ языке.
         """
         
-        prompt_text = "Проведи групповой анализ DNA. Сфокусируйся на том, ЧТО ПРОИСХОДИТ ВНУТРИ ВИДЕО. Выяви общие паттерны успеха."
+        if any(input_item.get('transcript') for input_item in inputs):
+            system_instruction += """
+            Для видео с готовым транскриптом НЕ расшифровывай речь заново: используй переданный текст
+            и его таймкоды для анализа структуры, темпа речи и фраз.
+        """
         
-        def _analyze():
-            # Формируем parts правильно для API
-            parts = []
-            for part in content_parts:
-                if "text" in part:
-                    parts.append(genai_types.Part(text=part["text"]))
-                elif "inline_data" in part:
-                    parts.append(genai_types.Part(
-                        inline_data=genai_types.Blob(
-                            data=part["inline_data"]["data"],
-                            mime_type=part["inline_data"]["mime_type"]
-                        )
-                    ))
-            parts.append(genai_types.Part(text=prompt_text))
-            
-            # Используем правильный API для Python
-            resp = self.client.models.generate_content(
-                model="gemini-3-flash-preview",
-                contents=parts,
-                config=genai_types.GenerateContentConfig(
-                    system_instruction=system_instruction,
-                    temperature=0.1,
-                    response_mime_type="application/json",
-                    response_schema=ANALYZE_SCHEMA,
-                    tools=[genai_types.Tool(google_search={})] if has_url else None,
-                ),
+        if has_preprocessed:
+            system_instruction += """
+            Часть видео передана не целиком, а ключевыми кадрами каждой сцены (по порядку, с отметкой времени)
+            и звуковой дорожкой. Для этих видео структуру и темп монтажа бери из переданных измеренных метрик,
+            не оценивай их заново.
+        """
+        
+        content_parts.append({
+            "text": "Проведи групповой анализ DNA. Сфокусируйся на том, ЧТО ПРОИСХОДИТ ВНУТРИ ВИДЕО. Выяви общие паттерны успеха."
+        })
+        
+        return {
+            'content_parts': content_parts,
+            'config': genai_types.GenerateContentConfig(
+                system_instruction=system_instruction,
+                temperature=0.1,
+                response_mime_type="application/json",
+                response_schema=ANALYZE_SCHEMA if ready_transcript is None else DNA_SCHEMA,
+                tools=[genai_types.Tool(google_search={})] if has_url else None,
+            ),
+            'ready_transcript': ready_transcript,
+        }
+    
+    def _parse_analysis_response(self, resp, ready_transcript: Optional[List[Dict[str, str]]]) -> Dict[str, Any]:
+        """Результат анализа из ответа модели"""
+        data = self._safe_json_parse(self._response_text(resp), None)
+        
+        if data and ready_transcript is not None:
+            data['transcript'] = ready_transcript
+        
+        if not data or (not data.get('transcript') and not data.get('stylePassport', {}).get('tone_tags')):
+            raise ValueError("Не удалось извлечь ДНК. Убедитесь, что видео содержат четкий контент для анализа.")
+        
+        return {
+            'transcript': data.get('transcript', []),
+            'stylePassport': data.get('stylePassport', {}),
+            'patterns': data.get('patterns', []),
+            'sources': self._extract_sources(resp),
+        }
+    
+    @instrumented('gemini', 'analyze_content', model='ANALYSIS_MODEL')
+    def analyze_content(self, inputs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Анализ контента для выявления ДНК успеха
+        
+        Args:
+            inputs: Список источников [{'type': 'url', 'value': '...', 'label': '...'}, ...]
+                Для файлов value - {'fileUri': ссылка Files API, 'mimeType': ...}, {'data': base64, 'mimeType': ...}
+                или {'path': путь на диске, 'mimeType': ...}. Файлы по пути больше GEMINI_INLINE_MAX_BYTES
+                загружаются через Files API.
+                Для предобработанных видео - {'type': 'preprocessed', 'value': результат scene_detection.preprocess_video}.
+                Необязательный ключ 'transcript' - готовый транскрипт из субтитров: он передается модели текстом,
+                а если он есть у всех источников, модель не расшифровывает речь.
+        
+        Returns:
+            {
+                'transcript': [...],
+                'stylePassport': {...},
+                'patterns': [...],
+                'sources': [...]
+            }
+        """
+        request = self._build_analysis_request(inputs)
+        
+        # Большие файлы загружаются через Files API один раз до запроса (повторные попытки их не пересылают)
+        content_parts = [
+            self._uploaded_part(self.upload_file(part["upload_path"]["path"], part["upload_path"]["mime_type"]))
+            if "upload_path" in part else part
+            for part in request['content_parts']
+        ]
+        
+        def _analyze(timeout):
+            resp = self.client.models.generate_content(**self._with_timeout({
+                'model': self.ANALYSIS_MODEL,
+                'contents': self._to_genai_parts(content_parts),
+                'config': request['config'],
+            }, timeout))
+            note_usage(resp)
+            return self._parse_analysis_response(resp, request['ready_transcript'])
+        
+        return self._with_retries('analyze_content', _analyze)
+    
+    def _build_reduce_request(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Запрос сведения анализов отдельных видео в ДНК группы: только паспорта стиля и паттерны, без видео
+        
+        Returns:
+            Аргументы generate_content (model, contents, config)
+        """
+        contents = []
+        for index, result in enumerate(results):
+            contents.append(
+                f"ВИДЕО {index + 1} «{result.get('label') or 'без названия'}»\n"
+                f"Паспорт стиля: {json.dumps(result['stylePassport'], ensure_ascii=False)}\n"
+                f"Паттерны: {json.dumps(result['patterns'], ensure_ascii=False)}"
             )
+        contents.append("Сведи анализы в групповую ДНК. Выяви общие паттерны успеха.")
+        
+        system_instruction = f"""
+            Ты — высококлассный AI-продюсер. Тебе предоставлены результаты анализа {len(results)} видео,
+            каждое видео проанализировано отдельно: паспорт стиля и паттерны успеха.
+            Твоя задача — свести их в единую "ДНК Успеха" всей группы.
             
-            # Получаем текст из ответа
-            text = ""
-            if hasattr(resp, 'text'):
-                text = resp.text
-            elif hasattr(resp, 'candidates') and resp.candidates:
-                for candidate in resp.candidates:
-                    if hasattr(candidate, 'content') and candidate.content:
-                        for part in candidate.content.parts:
-                            if hasattr(part, 'text'):
-                                text += part.text
-            
-            data = self._safe_json_parse(text, None)
-            
-            if not data or (not data.get('transcript') and not data.get('stylePassport', {}).get('tone_tags')):
-                raise ValueError("Не удалось извлечь ДНК. Убедитесь, что видео содержат четкий контент для анализа.")
+            ПРАВИЛА:
+            1. Паттерны группы — приемы, которые повторяются в нескольких видео. Похожие паттерны разных видео
+               объединяй в один, в evidence_segments указывай, в каких видео и сегментах он встречается.
+               Прием одного видео включай, только если он явно определяет успех ролика.
+            2. Влияние (impact) паттерна выше, если он встречается в большинстве видео.
+            3. StylePassport — среднее арифметическое стиля всех видео: speech_rate_wpm — среднее значение,
+               structure — типичная структура ролика группы, фразы и теги — общие или самые характерные.
+            4. Не придумывай ничего, чего нет в переданных анализах.
             
-            return {
-                'transcript': data.get('transcript', []),
-                'stylePassport': data.get('stylePassport', {}),
-                'patterns': data.get('patterns', []),
-                'sources': self._extract_sources(resp),
-            }
+            Ответ должен быть СТРОГО в формате JSON на РУССКОМ языке.
+        """
         
-        return self._with_retries(_analyze)
+        return {
+            'model': self.REDUCE_MODEL,
+            'contents': contents,
+            'config': genai_types.GenerateContentConfig(
+                system_instruction=system_instruction,
+                temperature=0.1,
+                response_mime_type="application/json",
+                response_schema=DNA_SCHEMA,
+            ),
+        }
     
-    def generate_script(self, topic: str, style_passport: Dict, patterns: List[Dict]) -> List[Dict[str, str]]:
+    def _parse_reduce_response(self, resp, results: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
-        Генерация сценария на основе ДНК
+        ДНК группы из ответа модели: транскрипт и источники собираются из анализов видео
+        """
+        data = self._safe_json_parse(self._response_text(resp), None)
+        if not data or not data.get('stylePassport', {}).get('tone_tags'):
+            raise ValueError("Не удалось свести анализы видео в ДНК группы")
+        
+        transcripts = [result for result in results if result.get('transcript')]
+        sources = []
+        for result in results:
+            for source in result.get('sources') or []:
+                if source not in sources:
+                    sources.append(source)
+        
+        return {
+            'transcript': self._combine_transcripts(transcripts) or [],
+            'stylePassport': data.get('stylePassport', {}),
+            'patterns': data.get('patterns', []),
+            'sources': sources,
+        }
+    
+    @instrumented('gemini', 'reduce_analysis', model='REDUCE_MODEL')
+    def reduce_analyses(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Сведение анализов отдельных видео (analyze_content по одному видео) в ДНК группы
+        
+        Дешевый текстовый запрос: модель получает только паспорта стиля и паттерны,
+        транскрипт группы собирается из транскриптов видео без участия модели.
         
         Args:
-            topic: Тема сценария
-            style_passport: Паспорт стиля
-            patterns: Паттерны успеха
+            results: Результаты analyze_content с подписью видео: [{'label': ..., 'transcript': ..., 'stylePassport': ..., 'patterns': ..., 'sources': ...}, ...]
         
         Returns:
-            Список сегментов сценария
+            Результат в формате analyze_content
+        """
+        request = self._build_reduce_request(results)
+        
+        def _reduce(timeout):
+            resp = self.client.models.generate_content(**self._with_timeout(request, timeout))
+            note_usage(resp)
+            return self._parse_reduce_response(resp, results)
+        
+        return self._with_retries('reduce_analysis', _reduce)
+    
+    def _build_dna_context(
+        self,
+        style_passport: Dict,
+        patterns: List[Dict],
+        transcript: Optional[List[Dict[str, str]]] = None
+    ) -> str:
+        """
+        ДНК анализа для генерации сценариев: паспорт стиля, паттерны и транскрипт
+        
+        Текст одинаков для всех сценариев анализа, поэтому его можно хранить
+        в кеше контекста Gemini (create_script_context_cache).
+        """
+        context = (
+            "ДНК группы видео, выявленное анализом. Используй его для всех сценариев.\n\n"
+            f"Паспорт стиля: {json.dumps(style_passport, ensure_ascii=False)}\n\n"
+            f"Паттерны успеха: {json.dumps(patterns, ensure_ascii=False)}"
+        )
+        if transcript:
+            context += f"\n\nТранскрипт исходных видео:\n{transcript_to_text(transcript)}"
+        return context
+    
+    def _build_script_request(
+        self,
+        topic: str,
+        style_passport: Dict,
+        patterns: List[Dict],
+        transcript: Optional[List[Dict[str, str]]] = None,
+        cached_content: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Запрос генерации сценария: аргументы generate_content (model, contents, config)
+        
+        С cached_content ДНК берется из кеша контекста Gemini и в запросе передается только тема,
+        без него ДНК передается в запросе перед темой.
         """
         SCRIPT_SCHEMA = {
             "type": "array",
@@ -272,46 +628,220 @@ class GeminiService:
             },
         }
         
-        prompt = f"""Создай сценарий для видео: "{topic}". Используй выявленное ДНК группы видео. Стиль: {json.dumps(style_passport, ensure_ascii=False)}. Паттерны: {json.dumps([p.get('name', '') for p in patterns], ensure_ascii=False)}. Только JSON."""
-        
-        def _generate():
-            resp = self.client.models.generate_content(
-                model="gemini-3-flash-preview",
-                contents=[genai_types.Part(text=prompt)],
-                config=genai_types.GenerateContentConfig(
-                    temperature=0.7,
-                    response_mime_type="application/json",
-                    response_schema=SCRIPT_SCHEMA,
-                ),
-            )
-            
-            text = ""
-            if hasattr(resp, 'text'):
-                text = resp.text
-            elif hasattr(resp, 'candidates') and resp.candidates:
-                for candidate in resp.candidates:
-                    if hasattr(candidate, 'content') and candidate.content:
-                        for part in candidate.content.parts:
-                            if hasattr(part, 'text'):
-                                text += part.text
+        prompt = f"""Создай сценарий для видео: "{topic}". Используй выявленное ДНК группы видео. Только JSON."""
+        
+        contents = [genai_types.Part(text=prompt)]
+        if not cached_content:
+            contents.insert(0, genai_types.Part(text=self._build_dna_context(style_passport, patterns, transcript)))
+        
+        return {
+            'model': self.SCRIPT_MODEL,
+            'contents': contents,
+            'config': genai_types.GenerateContentConfig(
+                temperature=self.SCRIPT_TEMPERATURE,
+                response_mime_type="application/json",
+                response_schema=SCRIPT_SCHEMA,
+                cached_content=cached_content,
+            ),
+        }
+    
+    def _is_context_cache_error(self, error: Exception) -> bool:
+        """Кеш контекста удален или истек раньше, чем ожидалось"""
+        err_msg = str(error).lower()
+        return 'cachedcontent' in err_msg or 'cached content' in err_msg or 'cached_content' in err_msg
+    
+    def _script_requests(self, topic: str, style_passport: Dict, patterns: List[Dict], transcript, cached_content) -> List[Dict[str, Any]]:
+        """Запросы генерации сценария по порядку: через кеш контекста, затем (если кеш пропал) без него"""
+        script_requests = [self._build_script_request(topic, style_passport, patterns, transcript)]
+        if cached_content:
+            script_requests.insert(0, self._build_script_request(topic, style_passport, patterns, transcript, cached_content))
+        return script_requests
+    
+    @instrumented('gemini', 'create_context_cache', model='SCRIPT_MODEL')
+    def create_script_context_cache(
+        self,
+        style_passport: Dict,
+        patterns: List[Dict],
+        transcript: Optional[List[Dict[str, str]]] = None,
+        ttl: int = 3600,
+        display_name: str = ''
+    ) -> Dict[str, Any]:
+        """
+        Создание кеша контекста Gemini с ДНК анализа
+        
+        Модель кеша должна совпадать с моделью запроса, поэтому кеш создается для SCRIPT_MODEL.
+        Слишком маленький контекст Gemini не кеширует - в этом случае API возвращает ошибку.
+        
+        Args:
+            style_passport: Паспорт стиля
+            patterns: Паттерны успеха
+            transcript: Транскрипт анализа
+            ttl: Время жизни кеша в секундах
+            display_name: Понятное имя кеша (например, analysis-<id>)
+        
+        Returns:
+            {'name': имя кеша для cached_content, 'expiresAt': datetime окончания}
+        """
+        contents = [genai_types.Content(
+            role='user',
+            parts=[genai_types.Part(text=self._build_dna_context(style_passport, patterns, transcript))]
+        )]
+        cache = self._with_retries('create_context_cache', lambda timeout: self.client.caches.create(
+            model=self.SCRIPT_MODEL,
+            config=genai_types.CreateCachedContentConfig(
+                contents=contents,
+                ttl=f"{int(ttl)}s",
+                display_name=display_name or None,
+                http_options=self._http_options(timeout),
+            ),
+        ))
+        return {'name': cache.name, 'expiresAt': cache.expire_time}
+    
+    @instrumented('gemini', 'delete_context_cache')
+    def delete_script_context_cache(self, name: str) -> None:
+        """Удаление кеша контекста (ошибки игнорируются: кеш все равно истечет по TTL)"""
+        try:
+            self.client.caches.delete(name=name)
+        except Exception as e:
+            print(f"Не удалось удалить кеш контекста {name}: {str(e)}")
+    
+    @instrumented('gemini', 'generate_script', model='SCRIPT_MODEL')
+    def generate_script(
+        self,
+        topic: str,
+        style_passport: Dict,
+        patterns: List[Dict],
+        transcript: Optional[List[Dict[str, str]]] = None,
+        cached_content: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Генерация сценария на основе ДНК
+        
+        Args:
+            topic: Тема сценария
+            style_passport: Паспорт стиля
+            patterns: Паттерны успеха
+            transcript: Транскрипт анализа (необязательно)
+            cached_content: Имя кеша контекста с ДНК (см. context_cache.get_script_context);
+                если кеш уже удален, ДНК передается в запросе
+        
+        Returns:
+            Список сегментов сценария
+        """
+        script_requests = self._script_requests(topic, style_passport, patterns, transcript, cached_content)
+        
+        for index, request in enumerate(script_requests):
+            def _generate(timeout):
+                resp = self.client.models.generate_content(**self._with_timeout(request, timeout))
+                note_usage(resp)
+                return self._safe_json_parse(self._response_text(resp), [])
             
-            return self._safe_json_parse(text, [])
+            try:
+                return self._with_retries('generate_script', _generate)
+            except Exception as e:
+                if index == len(script_requests) - 1 or not self._is_context_cache_error(e):
+                    raise
+                note_retry()
+                print(f"Кеш контекста {cached_content} недоступен, ДНК передается в запросе: {str(e)}")
+    
+    @instrumented('gemini', 'generate_script_stream', model='SCRIPT_MODEL')
+    def generate_script_stream(
+        self,
+        topic: str,
+        style_passport: Dict,
+        patterns: List[Dict],
+        transcript: Optional[List[Dict[str, str]]] = None,
+        cached_content: Optional[str] = None
+    ) -> Iterator[Dict[str, str]]:
+        """
+        Потоковая генерация сценария: сегменты отдаются по мере того, как модель их дописывает
+        
+        Ответ модели разбирается инкрементально (JsonArrayStream), сегмент возвращается,
+        как только закрывается его объект. Повторная попытка выполняется, только если
+        ошибка произошла до первого сегмента - иначе сегменты задублировались бы.
+        
+        Args:
+            topic: Тема сценария
+            style_passport: Паспорт стиля
+            patterns: Паттерны успеха
+            transcript: Транскрипт анализа (необязательно)
+            cached_content: Имя кеша контекста с ДНК (см. generate_script)
+        
+        Yields:
+            Сегменты сценария в порядке следования
+        """
+        script_requests = self._script_requests(topic, style_passport, patterns, transcript, cached_content)
+        guard = RetryGuard('gemini', 'generate_script_stream')
         
-        return self._with_retries(_generate)
+        while True:
+            guard.before_attempt()
+            parser = JsonArrayStream()
+            text = ''
+            emitted = 0
+            try:
+                for chunk in self.client.models.generate_content_stream(**self._with_timeout(script_requests[0], guard.timeout())):
+                    note_usage(chunk)
+                    chunk_text = self._response_text(chunk) or ''
+                    text += chunk_text
+                    for segment in parser.feed(chunk_text):
+                        emitted += 1
+                        yield segment
+            except BaseException as e:
+                if isinstance(e, Exception) and not emitted and len(script_requests) > 1 and self._is_context_cache_error(e):
+                    # Кеш контекста пропал - повторяем сразу с ДНК в запросе
+                    guard.failed(e, retry=False)
+                    script_requests.pop(0)
+                    note_retry()
+                    continue
+                delay = guard.failed(e, retry=not emitted)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            
+            guard.succeeded()
+            if not emitted:
+                # Потоково не разобралось ни одного сегмента - разбираем ответ целиком, как generate_script
+                segments = self._safe_json_parse(text, [])
+                yield from (segments if isinstance(segments, list) else [])
+            return
+    
+    def _build_image_request(self, prompt: str) -> Dict[str, Any]:
+        """Запрос генерации изображения"""
+        return {
+            'model': settings.GEMINI_IMAGE_MODEL,
+            'contents': [genai_types.Part(text=prompt)],
+            'config': genai_types.GenerateContentConfig(
+                response_modalities=[genai_types.Modality.IMAGE],
+            ),
+        }
     
+    @instrumented('gemini', 'generate_image', model=lambda service: settings.GEMINI_IMAGE_MODEL)
+    def generate_image(self, prompt: str) -> bytes:
         """
-        Генерация речи из текста
+        Генерация изображения по описанию кадра
         
         Args:
-            text: Текст для озвучки
+            prompt: Описание визуального ряда сегмента
         
         Returns:
-            WAV файл в виде bytes
+            Изображение в виде bytes (PNG)
         """
-        response = self.client.models.generate_content(
-            model="gemini-2.5-flash-preview-tts",
-            contents=[genai_types.Part(text=f"Say naturally: {text}")],
-            config=genai_types.GenerateContentConfig(
+        request = self._build_image_request(prompt)
+        response = self._with_retries('generate_image', lambda timeout: self.client.models.generate_content(**self._with_timeout(request, timeout)))
+        note_usage(response)
+        
+        image_data = self._response_inline_data(response)
+        if not image_data:
+            raise ValueError("Image generation failed")
+        return image_data
+    
+    def _build_speech_request(self, text: str) -> Dict[str, Any]:
+        """Запрос генерации речи"""
+        return {
+            'model': self.SPEECH_MODEL,
+            'contents': [genai_types.Part(text=f"Say naturally: {text}")],
+            'config': genai_types.GenerateContentConfig(
                 response_modalities=[genai_types.Modality.AUDIO],
                 speech_config=genai_types.SpeechConfig(
                     voice_config=genai_types.VoiceConfig(
@@ -321,33 +851,46 @@ class GeminiService:
                     )
                 )
             ),
-        )
-        
-        base64_audio = None
-        if hasattr(response, 'candidates') and response.candidates:
-            for candidate in response.candidates:
-                if hasattr(candidate, 'content') and candidate.content:
-                    for part in candidate.content.parts:
-                        if hasattr(part, 'inline_data') and part.inline_data:
-                            base64_audio = part.inline_data.data
-                            break
-                if base64_audio:
-                    break
-        
-        if not base64_audio:
+        }
+    
+    def _speech_pcm(self, response) -> bytes:
+        """PCM-данные речи из ответа модели"""
+        pcm_data = self._response_inline_data(response)
+        if not pcm_data:
             raise ValueError("Audio generation failed")
+        return pcm_data
+    
+    def pcm_to_wav(self, pcm_data: bytes) -> bytes:
+        """WAV-файл из PCM-данных речи (части речи можно склеивать до добавления заголовка)"""
+        return self._create_wav_header(len(pcm_data), self.SPEECH_SAMPLE_RATE) + pcm_data
+    
+    @instrumented('gemini', 'generate_speech', model='SPEECH_MODEL')
+    def generate_speech_pcm(self, text: str) -> bytes:
+        """
+        Генерация речи из текста без WAV-заголовка
         
-        # Декодируем PCM данные
-        pcm_data = base64.b64decode(base64_audio)
+        Args:
+            text: Текст для озвучки
         
-        # Создаем WAV заголовок
-        sample_rate = 24000
-        wav_header = self._create_wav_header(len(pcm_data), sample_rate)
+        Returns:
+            PCM 16 бит, моно, SPEECH_SAMPLE_RATE Гц
+        """
+        request = self._build_speech_request(text)
+        response = self._with_retries('generate_speech', lambda timeout: self.client.models.generate_content(**self._with_timeout(request, timeout)))
+        note_usage(response)
+        return self._speech_pcm(response)
+    
+    def generate_speech(self, text: str) -> bytes:
+        """
+        Генерация речи из текста
         
-        # Объединяем заголовок и данные
-        wav_file = wav_header + pcm_data
+        Args:
+            text: Текст для озвучки
         
-        return wav_file
+        Returns:
+            WAV файл в виде bytes
+        """
+        return self.pcm_to_wav(self.generate_speech_pcm(text))
     
     def _create_wav_header(self, pcm_length: int, sample_rate: int) -> bytes:
         """Создание WAV заголовка"""
@@ -366,3 +909,185 @@ class GeminiService:
         header[36:40] = b'data'
         header[40:44] = pcm_length.to_bytes(4, 'little')
         return bytes(header)
+
+
+class AsyncGeminiService(GeminiService):
+    """
+    Асинхронный вариант GeminiService для ASGI (асинхронный клиент SDK, client.aio)
+    
+    Запросы и разбор ответов общие с GeminiService, ожидание ответа не занимает поток,
+    поэтому один процесс может держать сотни одновременных запросов к Gemini.
+    """
+    
+    def __init__(self):
+        # Асинхронный клиент привязан к циклу событий, в котором создан
+        self.aio = get_async_gemini_client()
+    
+    async def _with_retries_async(self, operation: str, fn):
+        """Повторные попытки при сбоях API (fn - корутинная функция, получает таймаут попытки)"""
+        return await acall_with_retries('gemini', operation, fn)
+    
+    @instrumented('gemini', 'upload_file')
+    async def upload_file(self, path: str, mime_type: str) -> Dict[str, Any]:
+        """Загрузка файла через Files API (см. GeminiService.upload_file)"""
+        uploaded_file = await self._with_retries_async('upload_file', lambda timeout: self.aio.files.upload(
+            file=path,
+            config=genai_types.UploadFileConfig(mime_type=mime_type, http_options=self._http_options(timeout)),
+        ))
+        deadline = time.monotonic() + 300
+        while uploaded_file.state == genai_types.FileState.PROCESSING:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Файл {uploaded_file.name} не обработан за 300 секунд")
+            await asyncio.sleep(2)
+            uploaded_file = await self.aio.files.get(name=uploaded_file.name)
+        
+        if uploaded_file.state == genai_types.FileState.FAILED:
+            raise ValueError(f"Gemini не смог обработать файл {uploaded_file.name}")
+        
+        return {
+            'name': uploaded_file.name,
+            'uri': uploaded_file.uri,
+            'mimeType': uploaded_file.mime_type or mime_type,
+            'expiresAt': uploaded_file.expiration_time,
+        }
+    
+    @instrumented('gemini', 'get_file')
+    async def is_file_active(self, name: str) -> bool:
+        """Проверка, что загруженный файл все еще доступен в Files API"""
+        try:
+            return (await self.aio.files.get(name=name)).state == genai_types.FileState.ACTIVE
+        except Exception:
+            return False
+    
+    @instrumented('gemini', 'analyze_content', model='ANALYSIS_MODEL')
+    async def analyze_content(self, inputs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Анализ контента для выявления ДНК успеха (см. GeminiService.analyze_content)"""
+        request = self._build_analysis_request(inputs)
+        
+        # Большие файлы загружаются параллельно и один раз до запроса
+        async def _resolve(part):
+            if "upload_path" not in part:
+                return part
+            return self._uploaded_part(await self.upload_file(part["upload_path"]["path"], part["upload_path"]["mime_type"]))
+        
+        content_parts = await asyncio.gather(*[_resolve(part) for part in request['content_parts']])
+        
+        async def _analyze(timeout):
+            # Чтение небольших файлов с диска - в потоке, чтобы не блокировать цикл событий
+            contents = await asyncio.to_thread(self._to_genai_parts, content_parts)
+            resp = await self.aio.models.generate_content(**self._with_timeout({
+                'model': self.ANALYSIS_MODEL,
+                'contents': contents,
+                'config': request['config'],
+            }, timeout))
+            note_usage(resp)
+            return self._parse_analysis_response(resp, request['ready_transcript'])
+        
+        return await self._with_retries_async('analyze_content', _analyze)
+    
+    @instrumented('gemini', 'reduce_analysis', model='REDUCE_MODEL')
+    async def reduce_analyses(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Сведение анализов отдельных видео в ДНК группы (см. GeminiService.reduce_analyses)"""
+        request = self._build_reduce_request(results)
+        
+        async def _reduce(timeout):
+            resp = await self.aio.models.generate_content(**self._with_timeout(request, timeout))
+            note_usage(resp)
+            return self._parse_reduce_response(resp, results)
+        
+        return await self._with_retries_async('reduce_analysis', _reduce)
+    
+    @instrumented('gemini', 'generate_script', model='SCRIPT_MODEL')
+    async def generate_script(
+        self,
+        topic: str,
+        style_passport: Dict,
+        patterns: List[Dict],
+        transcript: Optional[List[Dict[str, str]]] = None,
+        cached_content: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """Генерация сценария на основе ДНК (см. GeminiService.generate_script)"""
+        script_requests = self._script_requests(topic, style_passport, patterns, transcript, cached_content)
+        
+        for index, request in enumerate(script_requests):
+            async def _generate(timeout):
+                resp = await self.aio.models.generate_content(**self._with_timeout(request, timeout))
+                note_usage(resp)
+                return self._safe_json_parse(self._response_text(resp), [])
+            
+            try:
+                return await self._with_retries_async('generate_script', _generate)
+            except Exception as e:
+                if index == len(script_requests) - 1 or not self._is_context_cache_error(e):
+                    raise
+                note_retry()
+                print(f"Кеш контекста {cached_content} недоступен, ДНК передается в запросе: {str(e)}")
+    
+    @instrumented('gemini', 'generate_script_stream', model='SCRIPT_MODEL')
+    async def generate_script_stream(
+        self,
+        topic: str,
+        style_passport: Dict,
+        patterns: List[Dict],
+        transcript: Optional[List[Dict[str, str]]] = None,
+        cached_content: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, str]]:
+        """Потоковая генерация сценария (см. GeminiService.generate_script_stream)"""
+        script_requests = self._script_requests(topic, style_passport, patterns, transcript, cached_content)
+        guard = RetryGuard('gemini', 'generate_script_stream')
+        
+        while True:
+            guard.before_attempt()
+            parser = JsonArrayStream()
+            text = ''
+            emitted = 0
+            try:
+                async for chunk in await self.aio.models.generate_content_stream(**self._with_timeout(script_requests[0], guard.timeout())):
+                    note_usage(chunk)
+                    chunk_text = self._response_text(chunk) or ''
+                    text += chunk_text
+                    for segment in parser.feed(chunk_text):
+                        emitted += 1
+                        yield segment
+            except BaseException as e:
+                if isinstance(e, Exception) and not emitted and len(script_requests) > 1 and self._is_context_cache_error(e):
+                    guard.failed(e, retry=False)
+                    script_requests.pop(0)
+                    note_retry()
+                    continue
+                delay = guard.failed(e, retry=not emitted)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            
+            guard.succeeded()
+            if not emitted:
+                segments = self._safe_json_parse(text, [])
+                for segment in (segments if isinstance(segments, list) else []):
+                    yield segment
+            return
+    
+    @instrumented('gemini', 'generate_image', model=lambda service: settings.GEMINI_IMAGE_MODEL)
+    async def generate_image(self, prompt: str) -> bytes:
+        """Генерация изображения по описанию кадра"""
+        request = self._build_image_request(prompt)
+        response = await self._with_retries_async('generate_image', lambda timeout: self.aio.models.generate_content(**self._with_timeout(request, timeout)))
+        note_usage(response)
+        
+        image_data = self._response_inline_data(response)
+        if not image_data:
+            raise ValueError("Image generation failed")
+        return image_data
+    
+    @instrumented('gemini', 'generate_speech', model='SPEECH_MODEL')
+    async def generate_speech_pcm(self, text: str) -> bytes:
+        """Генерация речи из текста без WAV-заголовка (см. GeminiService.generate_speech_pcm)"""
+        request = self._build_speech_request(text)
+        response = await self._with_retries_async('generate_speech', lambda timeout: self.aio.models.generate_content(**self._with_timeout(request, timeout)))
+        note_usage(response)
+        return self._speech_pcm(response)
+    
+    async def generate_speech(self, text: str) -> bytes:
+        """Генерация речи из текста (WAV)"""
+        return self.pcm_to_wav(await self.generate_speech_pcm(text))
@@ -0,0 +1,336 @@
+import asyncio
+import atexit
+import contextvars
+import functools
+import inspect
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+
+# Анализ и сценарий, к которым относятся вызовы внешних API в текущем контексте
+_attribution: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar('upstream_attribution', default={})
+# Текущий (самый вложенный) вызов внешнего API
+_current_call: contextvars.ContextVar[Optional['CallRecord']] = contextvars.ContextVar('upstream_call', default=None)
+
+
+class CallRecord:
+    """Измерения одного вызова внешнего API (сохраняется как UpstreamCall)"""
+    
+    def __init__(self, service: str, operation: str, model: str = ''):
+        self.service = service
+        self.operation = operation
+        self.model = model or ''
+        self.started_at = timezone.now()
+        self.retries = 0
+        self.input_tokens: Optional[int] = None
+        self.output_tokens: Optional[int] = None
+        self.cached_tokens: Optional[int] = None
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.outcome = 'success'
+        self.error = ''
+        self.duration_ms = 0.0
+        self.attribution = dict(_attribution.get())
+    
+    def note_usage(self, response: Any) -> None:
+        """Токены из usage_metadata ответа Gemini (в потоке - из последнего фрагмента, где они есть)"""
+        usage = getattr(response, 'usage_metadata', None)
+        if not usage:
+            return
+        if usage.prompt_token_count is not None:
+            self.input_tokens = usage.prompt_token_count
+        if usage.candidates_token_count is not None:
+            # Токены рассуждений модель тоже тарифицирует как выходные
+            self.output_tokens = usage.candidates_token_count + (getattr(usage, 'thoughts_token_count', None) or 0)
+        if usage.cached_content_token_count is not None:
+            self.cached_tokens = usage.cached_content_token_count
+    
+    def cost_usd(self) -> Optional[float]:
+        """Оценка стоимости по UPSTREAM_PRICING (None, если тариф модели не задан)"""
+        pricing = settings.UPSTREAM_PRICING.get(self.model)
+        if not pricing:
+            return None
+        
+        cost = pricing.get('per_call', 0.0)
+        if self.input_tokens:
+            # Токены из кеша контекста тарифицируются по своей цене
+            cached = self.cached_tokens or 0
+            cost += (self.input_tokens - cached) * pricing.get('input', 0.0) / 1_000_000
+            cost += cached * pricing.get('cached_input', pricing.get('input', 0.0)) / 1_000_000
+        if self.output_tokens:
+            cost += self.output_tokens * pricing.get('output', 0.0) / 1_000_000
+        return round(cost, 6)
+    
+    def to_model_kwargs(self) -> Dict[str, Any]:
+        """Поля UpstreamCall"""
+        return {
+            'service': self.service,
+            'operation': self.operation,
+            'model': self.model[:100],
+            'analysis_id': self.attribution.get('analysis_id'),
+            'script_id': self.attribution.get('script_id'),
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration_ms, 1),
+            'retries': self.retries,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'cached_tokens': self.cached_tokens,
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            'cost_usd': self.cost_usd(),
+            'outcome': self.outcome,
+            'error': self.error[:500],
+        }
+
+
+class _Recorder:
+    """
+    Фоновая запись измерений в БД
+    
+    Вызовы не ждут записи: измерения складываются в очередь, фоновый поток сохраняет их
+    пачками (bulk_create) раз в UPSTREAM_CALLS_FLUSH_INTERVAL секунд. Так же измерения
+    асинхронных вызовов сохраняются без обращения к БД из цикла событий.
+    """
+    
+    def __init__(self):
+        self._queue: 'queue.Queue[CallRecord]' = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+    
+    def submit(self, record: CallRecord) -> None:
+        """Постановка измерения в очередь записи"""
+        self._queue.put(record)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='upstream-calls', daemon=True)
+                self._thread.start()
+    
+    def flush(self) -> int:
+        """
+        Сохранение накопленных измерений
+        
+        Returns:
+            Количество сохраненных записей
+        """
+        from .models import UpstreamCall
+        
+        with self._flush_lock:
+            records: List[CallRecord] = []
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            if records:
+                try:
+                    UpstreamCall.objects.bulk_create([UpstreamCall(**record.to_model_kwargs()) for record in records])
+                except Exception as e:
+                    # Телеметрия не должна ломать работу сервиса
+                    print(f"Не удалось сохранить измерения вызовов внешних API: {str(e)}")
+                    return 0
+            return len(records)
+    
+    def _run(self) -> None:
+        """Периодическое сохранение в фоновом потоке"""
+        while True:
+            time.sleep(settings.UPSTREAM_CALLS_FLUSH_INTERVAL)
+            close_old_connections()
+            self.flush()
+
+
+_recorder = _Recorder()
+atexit.register(_recorder.flush)
+
+
+def flush_upstream_calls() -> int:
+    """Немедленное сохранение накопленных измерений (например, при остановке воркера)"""
+    return _recorder.flush()
+
+
+@contextmanager
+def call_context(analysis_id=None, script_id=None) -> Iterator[None]:
+    """
+    Привязка вызовов внешних API в блоке к анализу и/или сценарию
+    
+    Потоки не наследуют контекст: задачи ThreadPoolExecutor нужно запускать через
+    contextvars.copy_context().run. Блок можно использовать и внутри генератора
+    потокового ответа: предыдущее значение восстанавливается явно, а не через token.
+    """
+    previous = _attribution.get()
+    attribution = dict(previous)
+    if analysis_id:
+        attribution['analysis_id'] = analysis_id
+    if script_id:
+        attribution['script_id'] = script_id
+    _attribution.set(attribution)
+    try:
+        yield
+    finally:
+        _attribution.set(previous)
+
+
+def current_call() -> Optional[CallRecord]:
+    """Текущий вызов внешнего API (для учета повторов, токенов и объема данных)"""
+    return _current_call.get()
+
+
+def note_retry() -> None:
+    """Учет повторной попытки текущего вызова"""
+    record = _current_call.get()
+    if record:
+        record.retries += 1
+
+
+def note_usage(response: Any) -> None:
+    """Учет токенов из ответа Gemini в текущем вызове"""
+    record = _current_call.get()
+    if record:
+        record.note_usage(response)
+
+
+def note_http(response: Any) -> None:
+    """Учет объема запроса и ответа (requests.Response или httpx.Response) в текущем вызове"""
+    record = _current_call.get()
+    if not record:
+        return
+    request = getattr(response, 'request', None)
+    body = getattr(request, 'body', None)
+    if body is None:
+        # httpx: тело запроса в request.content
+        body = getattr(request, 'content', None) or b''
+    record.request_bytes += len(body)
+    record.response_bytes += len(response.content)
+
+
+def _start(service: str, operation: str, model: str) -> CallRecord:
+    """Начало замера вызова"""
+    return CallRecord(service, operation, model)
+
+
+def _finish(record: CallRecord, started: float, error: Optional[BaseException]) -> None:
+    """Завершение замера и постановка в очередь записи"""
+    record.duration_ms = (time.monotonic() - started) * 1000
+    if isinstance(error, (GeneratorExit, asyncio.CancelledError)):
+        # Клиент отключился или задачу отменили - это не ошибка API
+        record.outcome = 'cancelled'
+    elif error is not None:
+        record.outcome = 'error'
+        record.error = f"{type(error).__name__}: {str(error)}"
+    if settings.UPSTREAM_CALLS_ENABLED:
+        _recorder.submit(record)
+
+
+def instrumented(service: str, operation: str, model: Union[str, Callable, None] = None, model_arg: Optional[str] = None):
+    """
+    Декоратор метода сервиса: замер вызова внешнего API
+    
+    Записываются модель, время, число повторов, токены, объем данных и результат.
+    Поддерживаются обычные и асинхронные методы, а также генераторы (потоковые
+    ответы - время считается до конца потока).
+    
+    Args:
+        service: 'gemini' или 'kie'
+        operation: Название операции (например, 'generate_script')
+        model: Имя атрибута сервиса с моделью или функция (self) -> модель
+        model_arg: Имя аргумента метода с моделью (если модель передается в вызов)
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        
+        def _model(args, kwargs) -> str:
+            if model_arg:
+                bound = signature.bind_partial(*args, **kwargs)
+                return str(bound.arguments.get(model_arg) or '')
+            if callable(model):
+                return model(args[0])
+            if model:
+                return str(getattr(args[0], model, model))
+            return ''
+        
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def async_gen_wrapper(*args, **kwargs):
+                record = _start(service, operation, _model(args, kwargs))
+                started = time.monotonic()
+                error = None
+                # Между элементами поток может продолжаться в другом контексте,
+                # поэтому текущий вызов восстанавливается явно, а не через token
+                previous = _current_call.get()
+                _current_call.set(record)
+                try:
+                    async for item in fn(*args, **kwargs):
+                        _current_call.set(previous)
+                        yield item
+                        _current_call.set(record)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _current_call.set(previous)
+                    _finish(record, started, error)
+            return async_gen_wrapper
+        
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                record = _start(service, operation, _model(args, kwargs))
+                started = time.monotonic()
+                error = None
+                previous = _current_call.get()
+                _current_call.set(record)
+                try:
+                    for item in fn(*args, **kwargs):
+                        # Пока потребитель обрабатывает элемент, его вызовы к этому замеру не относятся
+                        _current_call.set(previous)
+                        yield item
+                        _current_call.set(record)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _current_call.set(previous)
+                    _finish(record, started, error)
+            return gen_wrapper
+        
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                record = _start(service, operation, _model(args, kwargs))
+                started = time.monotonic()
+                error = None
+                token = _current_call.set(record)
+                try:
+                    return await fn(*args, **kwargs)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _current_call.reset(token)
+                    _finish(record, started, error)
+            return async_wrapper
+        
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            record = _start(service, operation, _model(args, kwargs))
+            started = time.monotonic()
+            error = None
+            token = _current_call.set(record)
+            try:
+                return fn(*args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                _current_call.reset(token)
+                _finish(record, started, error)
+        return wrapper
+    
+    return decorator
@@ -0,0 +1,273 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+from typing import Optional, List, Dict, Any
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Analysis, AnalysisJob
+from .analysis_pipeline import run_analysis
+from .resilience import CircuitOpenError
+from .scratch_space import sweep as sweep_scratch
+
+
+def enqueue_analysis(
+    analysis: Analysis,
+    force_refresh: bool = False,
+    keep_original: bool = False,
+    incremental: bool = False
+) -> AnalysisJob:
+    """
+    Постановка анализа в очередь
+    
+    Args:
+        analysis: Анализ с уже созданными источниками
+        force_refresh: Выполнить анализ заново, даже если есть готовый результат для тех же источников
+        keep_original: Скачивать и хранить видео в исходном качестве
+        incremental: Пересчет ДНК после изменения источников (см. run_analysis)
+    """
+    return AnalysisJob.objects.create(
+        analysis=analysis,
+        options={'force_refresh': force_refresh, 'keep_original': keep_original, 'incremental': incremental}
+    )
+
+
+def enqueue_analyses(analyses: List[Analysis], options: List[Dict[str, Any]]) -> List[AnalysisJob]:
+    """
+    Постановка нескольких анализов в очередь одним запросом к БД
+    
+    Args:
+        analyses: Анализы с уже созданными источниками
+        options: Параметры запуска каждого анализа ({'force_refresh': ..., 'keep_original': ...})
+    """
+    return AnalysisJob.objects.bulk_create([
+        AnalysisJob(analysis=analysis, options=analysis_options)
+        for analysis, analysis_options in zip(analyses, options)
+    ])
+
+
+def claim_next_job(worker_id: str) -> Optional[AnalysisJob]:
+    """
+    Захват следующей задачи из очереди
+    
+    Захват выполняется условным UPDATE по статусу, поэтому одну задачу не могут
+    взять два воркера одновременно (работает и на SQLite, и на PostgreSQL).
+    
+    Args:
+        worker_id: Идентификатор воркера
+    
+    Returns:
+        Захваченная задача или None, если очередь пуста
+    """
+    now = timezone.now()
+    candidate_ids = list(
+        AnalysisJob.objects
+        .filter(status='queued', available_at__lte=now)
+        .order_by('created_at')
+        .values_list('id', flat=True)[:10]
+    )
+    
+    for job_id in candidate_ids:
+        claimed = AnalysisJob.objects.filter(id=job_id, status='queued').update(
+            status='running',
+            worker_id=worker_id,
+            attempts=F('attempts') + 1,
+            started_at=now,
+            heartbeat_at=now,
+            updated_at=now,
+        )
+        if claimed:
+            return AnalysisJob.objects.select_related('analysis').get(id=job_id)
+    
+    return None
+
+
+def complete_job(job: AnalysisJob) -> None:
+    """Отметка задачи как выполненной"""
+    job.status = 'done'
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+
+
+def fail_job(job: AnalysisJob, error: str) -> None:
+    """Отметка задачи как проваленной"""
+    job.status = 'failed'
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+
+
+def defer_job(job: AnalysisJob, delay: float, error: str) -> None:
+    """
+    Возврат задачи в очередь с задержкой (внешний API временно недоступен)
+    
+    Попытка не засчитывается: ANALYSIS_JOB_MAX_ATTEMPTS ограничивает повторы после падения
+    воркеров, а пока внешний API недоступен, задача ждет в очереди, не занимая воркер.
+    """
+    job.status = 'queued'
+    job.worker_id = ''
+    job.attempts = max(job.attempts - 1, 0)
+    job.error = error
+    job.available_at = timezone.now() + timedelta(seconds=delay)
+    job.save(update_fields=['status', 'worker_id', 'attempts', 'error', 'available_at', 'updated_at'])
+    Analysis.objects.filter(id=job.analysis_id).update(
+        status='processing',
+        error_message='',
+        updated_at=timezone.now(),
+    )
+
+
+def requeue_stale_jobs() -> int:
+    """
+    Возврат в очередь задач, воркер которых перестал отправлять heartbeat
+    
+    Задачи, исчерпавшие лимит попыток, помечаются как проваленные, а их анализ
+    переводится в статус error.
+    
+    Returns:
+        Количество обработанных зависших задач
+    """
+    stale_before = timezone.now() - timedelta(seconds=settings.ANALYSIS_JOB_STALE_TIMEOUT)
+    stale_jobs = AnalysisJob.objects.filter(status='running', heartbeat_at__lt=stale_before)
+    count = 0
+    
+    for job in stale_jobs.select_related('analysis'):
+        if job.attempts >= settings.ANALYSIS_JOB_MAX_ATTEMPTS:
+            updated = AnalysisJob.objects.filter(id=job.id, status='running').update(
+                status='failed',
+                error='Воркер перестал отвечать, лимит попыток исчерпан',
+                finished_at=timezone.now(),
+                updated_at=timezone.now(),
+            )
+            if updated:
+                Analysis.objects.filter(id=job.analysis_id).update(
+                    status='error',
+                    error_message='Воркер перестал отвечать, лимит попыток исчерпан',
+                    updated_at=timezone.now(),
+                )
+        else:
+            updated = AnalysisJob.objects.filter(id=job.id, status='running').update(
+                status='queued',
+                worker_id='',
+                available_at=timezone.now(),
+                updated_at=timezone.now(),
+            )
+        count += updated
+    
+    return count
+
+
+class AnalysisWorker:
+    """Воркер очереди анализов с настраиваемым числом параллельных задач"""
+    
+    def __init__(self, concurrency: Optional[int] = None, poll_interval: Optional[float] = None):
+        """
+        Инициализация воркера
+        
+        Args:
+            concurrency: Количество анализов, выполняемых одновременно
+            poll_interval: Интервал опроса очереди в секундах
+        """
+        self.concurrency = concurrency or settings.ANALYSIS_WORKER_CONCURRENCY
+        self.poll_interval = poll_interval or settings.ANALYSIS_WORKER_POLL_INTERVAL
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop_event = threading.Event()
+    
+    def stop(self) -> None:
+        """Запрос на остановку воркера (текущие задачи будут доведены до конца)"""
+        self._stop_event.set()
+    
+    def process_job(self, job: AnalysisJob) -> None:
+        """Выполнение одной задачи"""
+        try:
+            run_analysis(
+                job.analysis,
+                force_refresh=job.options.get('force_refresh', False),
+                keep_original=job.options.get('keep_original', False),
+                incremental=job.options.get('incremental', False)
+            )
+        except CircuitOpenError as e:
+            # Gemini недоступен - задача не занимает воркер, а повторяется после паузы
+            defer_job(job, e.retry_after, str(e))
+        except Exception as e:
+            fail_job(job, str(e))
+        else:
+            complete_job(job)
+    
+    def _heartbeat(self) -> None:
+        """Обновление heartbeat для всех задач этого воркера"""
+        now = timezone.now()
+        AnalysisJob.objects.filter(worker_id=self.worker_id, status='running').update(
+            heartbeat_at=now,
+            updated_at=now,
+        )
+    
+    def _sweep_scratch(self) -> None:
+        """Удаление брошенных временных файлов (остались после падения процессов)"""
+        try:
+            result = sweep_scratch()
+        except OSError as e:
+            print(f"Не удалось очистить рабочее пространство: {str(e)}")
+            return
+        if result['removed']:
+            print(f"Рабочее пространство: удалено {result['removed']} записей, освобождено {result['freed_bytes']} байт")
+    
+    def _worker_loop(self, burst: bool) -> None:
+        """Цикл одного потока: захват задачи → выполнение → следующая задача"""
+        while not self._stop_event.is_set():
+            close_old_connections()
+            job = claim_next_job(self.worker_id)
+            
+            if job is None:
+                if burst:
+                    break
+                self._stop_event.wait(self.poll_interval)
+                continue
+            
+            try:
+                self.process_job(job)
+            finally:
+                close_old_connections()
+    
+    def run(self, burst: bool = False) -> None:
+        """
+        Запуск воркера
+        
+        Args:
+            burst: Если True, воркер завершится, когда очередь опустеет
+        """
+        requeue_stale_jobs()
+        self._sweep_scratch()
+        
+        threads = [
+            threading.Thread(target=self._worker_loop, args=(burst,), name=f"analysis-worker-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        
+        heartbeat_interval = max(settings.ANALYSIS_JOB_STALE_TIMEOUT / 4, 1)
+        last_heartbeat = time.monotonic()
+        last_sweep = time.monotonic()
+        
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(min(self.poll_interval, heartbeat_interval))
+                if time.monotonic() - last_heartbeat >= heartbeat_interval:
+                    self._heartbeat()
+                    requeue_stale_jobs()
+                    close_old_connections()
+                    last_heartbeat = time.monotonic()
+                if time.monotonic() - last_sweep >= settings.SCRATCH_SWEEP_INTERVAL:
+                    self._sweep_scratch()
+                    last_sweep = time.monotonic()
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
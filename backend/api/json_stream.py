@@ -0,0 +1,80 @@
+import json
+from typing import Any, List
+
+
+class JsonArrayStream:
+    """
+    Инкрементальный разбор JSON-массива объектов, приходящего частями
+    
+    Текст подается по мере получения (feed), элементы массива возвращаются, как только
+    закрывается их объект. Все, что стоит до первой '[' (например, ```json от модели),
+    пропускается. Разбирается только верхний уровень: вложенные объекты и массивы
+    элемента разбирает json.loads целиком.
+    """
+    
+    def __init__(self):
+        self._buffer = ''
+        # Позиция в буфере, с которой продолжается сканирование
+        self._pos = 0
+        self._started = False
+        self._finished = False
+        # Глубина вложенности внутри массива (0 - между элементами)
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # Начало текущего элемента в буфере
+        self._item_start = None
+    
+    @property
+    def finished(self) -> bool:
+        """Массив закрыт"""
+        return self._finished
+    
+    def feed(self, text: str) -> List[Any]:
+        """
+        Добавление очередной части текста
+        
+        Returns:
+            Элементы массива, закрывшиеся в этой части (в порядке следования)
+        """
+        if self._finished or not text:
+            return []
+        
+        self._buffer += text
+        items = []
+        
+        while self._pos < len(self._buffer):
+            char = self._buffer[self._pos]
+            
+            if not self._started:
+                if char == '[':
+                    self._started = True
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                if self._depth == 0:
+                    self._item_start = self._pos
+                self._depth += 1
+            elif char in '}]':
+                if self._depth == 0:
+                    # Закрылся сам массив
+                    self._finished = True
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    items.append(json.loads(self._buffer[self._item_start:self._pos + 1]))
+                    # Разобранный текст больше не нужен
+                    self._buffer = self._buffer[self._pos + 1:]
+                    self._pos = -1
+                    self._item_start = None
+            
+            self._pos += 1
+        
+        return items
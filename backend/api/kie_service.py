@@ -1,9 +1,130 @@
+import asyncio
 import os
+import threading
+import weakref
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 import json
 from typing import Dict, Any, Optional
 from django.conf import settings
 
+from .instrumentation import instrumented, note_http
+from .loop_resources import close_on_loop_shutdown
+from .resilience import CircuitOpenError, UpstreamHTTPError, call_with_retries, acall_with_retries, parse_retry_after
+
+
+# Общая сессия процесса: соединения с Kie.ai и CDN результатов переиспользуются между запросами
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """HTTP-сессия с пулом соединений размера KIE_HTTP_POOL_SIZE (создается при первом обращении)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=settings.KIE_HTTP_POOL_SIZE,
+                pool_maxsize=settings.KIE_HTTP_POOL_SIZE
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+# Асинхронные клиенты по циклам событий: соединения asyncio нельзя использовать из другого цикла,
+# клиент цикла закрывается при его завершении
+_async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]' = weakref.WeakKeyDictionary()
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Асинхронный HTTP-клиент текущего цикла событий с пулом размера KIE_HTTP_POOL_SIZE"""
+    loop = asyncio.get_running_loop()
+    with _session_lock:
+        if loop not in _async_clients:
+            _async_clients[loop] = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.KIE_HTTP_POOL_SIZE,
+                    max_keepalive_connections=settings.KIE_HTTP_POOL_SIZE
+                )
+            )
+            close_on_loop_shutdown(_close_async_http_client)
+        return _async_clients[loop]
+
+
+async def _close_async_http_client() -> None:
+    """Закрытие асинхронного клиента текущего цикла событий (при его завершении)"""
+    with _session_lock:
+        client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _error_message(response) -> str:
+    """Сообщение об ошибке из ответа Kie.ai (requests.Response или httpx.Response)"""
+    try:
+        error_data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
+        return error_data.get('msg', f'HTTP {response.status_code}')
+    except ValueError:
+        return f'HTTP {response.status_code}: {response.text[:200]}'
+
+
+def _raise_for_status(response, prefix: str) -> None:
+    """
+    Ошибка по HTTP-статусу ответа Kie.ai
+    
+    Raises:
+        UpstreamHTTPError: Ответ 4xx/5xx (статус и Retry-After сохраняются для повторов)
+    """
+    if response.status_code >= 400:
+        raise UpstreamHTTPError(
+            f"{prefix}: {_error_message(response)}",
+            response.status_code,
+            parse_retry_after(response.headers.get('retry-after'))
+        )
+
+
+def _raise_for_body(result: Dict[str, Any], prefix: str) -> None:
+    """
+    Ошибка по коду в теле ответа: Kie.ai может ответить HTTP 200 с {"code": 429, "msg": ...}
+    
+    Raises:
+        UpstreamHTTPError: Код ошибки в теле (455 - сервис на обслуживании - считается как 503)
+    """
+    code = result.get('code') if isinstance(result, dict) else None
+    if isinstance(code, int) and code >= 400:
+        raise UpstreamHTTPError(f"{prefix}: {result.get('msg') or code}", 503 if code == 455 else code)
+
+
+def format_task_status(status_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Краткий статус задачи для клиента
+    
+    Returns:
+        {'state': ...} и 'resultUrls' для успешной задачи или 'failMsg' для неудачной
+    """
+    data = status_data.get('data', {})
+    state = data.get('state', 'waiting')
+    
+    result = {
+        'state': state,
+    }
+    
+    if state == 'success':
+        result_json = data.get('resultJson', '{}')
+        try:
+            result_data = json.loads(result_json) if isinstance(result_json, str) else result_json
+            result['resultUrls'] = result_data.get('resultUrls', [])
+        except json.JSONDecodeError:
+            result['resultUrls'] = []
+    elif state == 'fail':
+        result['failMsg'] = data.get('failMsg', 'Неизвестная ошибка')
+    
+    return result
+
 
 class KieService:
     """Сервис для работы с Kie.ai API"""
@@ -14,6 +135,7 @@ class KieService:
         self.api_key = os.environ.get('KIE_API_KEY')
         if not self.api_key:
             raise ValueError("KIE_API_KEY environment variable is not set")
+        self.session = get_http_session()
     
     def _get_headers(self) -> Dict[str, str]:
         """Получение заголовков для запросов"""
@@ -22,7 +144,7 @@ class KieService:
             'Content-Type': 'application/json'
         }
     
-    def create_video_task(
+    def _build_video_payload(
         self,
         model: str,
         prompt: str,
@@ -31,20 +153,7 @@ class KieService:
         mode: str = "normal",
         callback_url: Optional[str] = None
     ) -> Dict[str, Any]:
-        """
-        Создание задачи на генерацию видео
-        
-        Args:
-            model: Модель для генерации ('sora-2-text-to-video' или 'grok-imagine/text-to-video')
-            prompt: Промпт для генерации видео
-            additional_notes: Дополнительные пожелания пользователя
-            aspect_ratio: Соотношение сторон (для grok-imagine: "2:3" - portrait, "3:2" - landscape, "1:1" - square)
-            mode: Режим генерации (для grok-imagine: "fun", "normal", "spicy")
-            callback_url: URL для callback уведомлений
-        
-        Returns:
-            Dict с информацией о задаче (taskId и т.д.)
-        """
+        """Тело запроса создания задачи на генерацию видео (параметры - см. create_video_task)"""
         # Формируем финальный промпт
         final_prompt = prompt
         if additional_notes:
@@ -90,29 +199,63 @@ class KieService:
         if callback_url:
             payload['callBackUrl'] = callback_url
         
-        response = requests.post(
-            f"{self.BASE_URL}/jobs/createTask",
-            headers=self._get_headers(),
-            json=payload,
-            timeout=30
-        )
+        return payload
+    
+    @instrumented('kie', 'create_video_task', model_arg='model')
+    def create_video_task(
+        self,
+        model: str,
+        prompt: str,
+        additional_notes: Optional[str] = None,
+        aspect_ratio: Optional[str] = None,
+        mode: str = "normal",
+        callback_url: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Создание задачи на генерацию видео
         
-        if not response.ok:
-            try:
-                error_data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
-                error_msg = error_data.get('msg', f'HTTP {response.status_code}')
-            except:
-                error_msg = f'HTTP {response.status_code}: {response.text[:200]}'
-            raise Exception(f"Ошибка создания задачи: {error_msg}")
+        Args:
+            model: Модель для генерации ('sora-2-text-to-video' или 'grok-imagine/text-to-video')
+            prompt: Промпт для генерации видео
+            additional_notes: Дополнительные пожелания пользователя
+            aspect_ratio: Соотношение сторон (для grok-imagine: "2:3" - portrait, "3:2" - landscape, "1:1" - square)
+            mode: Режим генерации (для grok-imagine: "fun", "normal", "spicy")
+            callback_url: URL для callback уведомлений
+        
+        Returns:
+            Dict с информацией о задаче (taskId и т.д.)
+        """
+        payload = self._build_video_payload(model, prompt, additional_notes, aspect_ratio, mode, callback_url)
+        
+        def _create(timeout):
+            response = self.session.post(
+                f"{self.BASE_URL}/jobs/createTask",
+                headers=self._get_headers(),
+                json=payload,
+                timeout=min(timeout, 30)
+            )
+            note_http(response)
+            return self._parse_task_response(response)
+        
+        # Повтор создания задачи мог бы запустить генерацию дважды, поэтому повторяются
+        # только запросы, которые Kie.ai точно не принял (нет соединения, 429, 503)
+        return call_with_retries('kie', 'create_video_task', _create, idempotent=False)
+    
+    def _parse_task_response(self, response) -> Dict[str, Any]:
+        """Разбор ответа на создание задачи на генерацию видео"""
+        _raise_for_status(response, "Ошибка создания задачи")
         
         try:
             result = response.json()
-            if not result:
-                raise Exception("Пустой ответ от API Kie.ai")
-            return result
-        except Exception as e:
+        except ValueError as e:
             raise Exception(f"Ошибка парсинга ответа от Kie.ai: {str(e)}")
+        if not result:
+            raise Exception("Ошибка парсинга ответа от Kie.ai: Пустой ответ от API Kie.ai")
+        
+        _raise_for_body(result, "Ошибка создания задачи")
+        return result
     
+    @instrumented('kie', 'get_task_status')
     def get_task_status(self, task_id: str) -> Dict[str, Any]:
         """
         Получение статуса задачи
@@ -123,20 +266,20 @@ class KieService:
         Returns:
             Dict с информацией о статусе задачи
         """
-        response = requests.get(
-            f"{self.BASE_URL}/jobs/recordInfo",
-            headers=self._get_headers(),
-            params={'taskId': task_id},
-            timeout=30
-        )
-        
-        if not response.ok:
-            error_data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
-            error_msg = error_data.get('msg', f'HTTP {response.status_code}')
-            raise Exception(f"Ошибка получения статуса задачи: {error_msg}")
+        def _get(timeout):
+            response = self.session.get(
+                f"{self.BASE_URL}/jobs/recordInfo",
+                headers=self._get_headers(),
+                params={'taskId': task_id},
+                timeout=min(timeout, 30)
+            )
+            note_http(response)
+            _raise_for_status(response, "Ошибка получения статуса задачи")
+            return response.json()
         
-        return response.json()
+        return call_with_retries('kie', 'get_task_status', _get)
     
+    @instrumented('kie', 'poll_task')
     def poll_task_until_complete(
         self,
         task_id: str,
@@ -157,7 +300,13 @@ class KieService:
         import time
         
         for attempt in range(max_attempts):
-            status_data = self.get_task_status(task_id)
+            try:
+                status_data = self.get_task_status(task_id)
+            except CircuitOpenError:
+                # Kie.ai временно недоступен - задача продолжает выполняться, опрашиваем дальше
+                if attempt < max_attempts - 1:
+                    time.sleep(interval)
+                continue
             data = status_data.get('data', {})
             state = data.get('state', 'waiting')
             
@@ -188,6 +337,21 @@ class KieService:
         
         raise Exception(f"Задача не завершилась за {max_attempts * interval} секунд")
     
+    def _build_image_payload(self, model: str, prompt: str, callback_url: Optional[str] = None) -> Dict[str, Any]:
+        """Тело запроса создания задачи на генерацию изображения"""
+        payload = {
+            'model': model,
+            'input': {
+                'prompt': prompt
+            }
+        }
+        
+        if callback_url:
+            payload['callBackUrl'] = callback_url
+        
+        return payload
+    
+    @instrumented('kie', 'create_image_task', model_arg='model')
     def create_image_task(
         self,
         model: str,
@@ -205,30 +369,24 @@ class KieService:
         Returns:
             Dict с информацией о задаче (taskId и т.д.)
         """
-        payload = {
-            'model': model,
-            'input': {
-                'prompt': prompt
-            }
-        }
+        payload = self._build_image_payload(model, prompt, callback_url)
         
-        if callback_url:
-            payload['callBackUrl'] = callback_url
-        
-        response = requests.post(
-            f"{self.BASE_URL}/jobs/createTask",
-            headers=self._get_headers(),
-            json=payload,
-            timeout=30
-        )
-        
-        if not response.ok:
-            error_data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
-            error_msg = error_data.get('msg', f'HTTP {response.status_code}')
-            raise Exception(f"Ошибка создания задачи на генерацию изображения: {error_msg}")
+        def _create(timeout):
+            response = self.session.post(
+                f"{self.BASE_URL}/jobs/createTask",
+                headers=self._get_headers(),
+                json=payload,
+                timeout=min(timeout, 30)
+            )
+            note_http(response)
+            _raise_for_status(response, "Ошибка создания задачи на генерацию изображения")
+            result = response.json()
+            _raise_for_body(result, "Ошибка создания задачи на генерацию изображения")
+            return result
         
-        return response.json()
+        return call_with_retries('kie', 'create_image_task', _create, idempotent=False)
     
+    @instrumented('kie', 'download_file')
     def download_file_from_url(self, url: str) -> bytes:
         """
         Скачивание файла по URL
@@ -239,8 +397,132 @@ class KieService:
         Returns:
             Bytes файла
         """
-        response = requests.get(url, timeout=60)
-        if not response.ok:
-            raise Exception(f"Ошибка скачивания файла: HTTP {response.status_code}")
-        return response.content
+        def _download(timeout):
+            response = self.session.get(url, timeout=min(timeout, 60))
+            note_http(response)
+            _raise_for_status(response, "Ошибка скачивания файла")
+            return response.content
+        
+        return call_with_retries('kie', 'download_file', _download)
 
+
+class AsyncKieService(KieService):
+    """
+    Асинхронный вариант KieService для ASGI (httpx.AsyncClient)
+    
+    Тела запросов и разбор ответов общие с KieService.
+    """
+    
+    def __init__(self):
+        self.api_key = os.environ.get('KIE_API_KEY')
+        if not self.api_key:
+            raise ValueError("KIE_API_KEY environment variable is not set")
+        self.client = get_async_http_client()
+    
+    @instrumented('kie', 'create_video_task', model_arg='model')
+    async def create_video_task(
+        self,
+        model: str,
+        prompt: str,
+        additional_notes: Optional[str] = None,
+        aspect_ratio: Optional[str] = None,
+        mode: str = "normal",
+        callback_url: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Создание задачи на генерацию видео (см. KieService.create_video_task)"""
+        payload = self._build_video_payload(model, prompt, additional_notes, aspect_ratio, mode, callback_url)
+        
+        async def _create(timeout):
+            response = await self.client.post(
+                f"{self.BASE_URL}/jobs/createTask",
+                headers=self._get_headers(),
+                json=payload,
+                timeout=min(timeout, 30)
+            )
+            note_http(response)
+            return self._parse_task_response(response)
+        
+        return await acall_with_retries('kie', 'create_video_task', _create, idempotent=False)
+    
+    @instrumented('kie', 'get_task_status')
+    async def get_task_status(self, task_id: str) -> Dict[str, Any]:
+        """Получение статуса задачи"""
+        async def _get(timeout):
+            response = await self.client.get(
+                f"{self.BASE_URL}/jobs/recordInfo",
+                headers=self._get_headers(),
+                params={'taskId': task_id},
+                timeout=min(timeout, 30)
+            )
+            note_http(response)
+            _raise_for_status(response, "Ошибка получения статуса задачи")
+            return response.json()
+        
+        return await acall_with_retries('kie', 'get_task_status', _get)
+    
+    @instrumented('kie', 'poll_task')
+    async def poll_task_until_complete(
+        self,
+        task_id: str,
+        max_attempts: int = 60,
+        interval: int = 5
+    ) -> Dict[str, Any]:
+        """Ожидание завершения задачи с периодическим опросом (без блокировки потока)"""
+        for attempt in range(max_attempts):
+            try:
+                status = format_task_status(await self.get_task_status(task_id))
+            except CircuitOpenError:
+                if attempt < max_attempts - 1:
+                    await asyncio.sleep(interval)
+                continue
+            
+            if status['state'] == 'success':
+                return {
+                    'status': 'success',
+                    'task_id': task_id,
+                    'result': {'resultUrls': status['resultUrls']}
+                }
+            
+            if status['state'] == 'fail':
+                raise Exception(f"Генерация видео не удалась: {status['failMsg']}")
+            
+            if attempt < max_attempts - 1:
+                await asyncio.sleep(interval)
+        
+        raise Exception(f"Задача не завершилась за {max_attempts * interval} секунд")
+    
+    @instrumented('kie', 'create_image_task', model_arg='model')
+    async def create_image_task(
+        self,
+        model: str,
+        prompt: str,
+        callback_url: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Создание задачи на генерацию изображения"""
+        payload = self._build_image_payload(model, prompt, callback_url)
+        
+        async def _create(timeout):
+            response = await self.client.post(
+                f"{self.BASE_URL}/jobs/createTask",
+                headers=self._get_headers(),
+                json=payload,
+                timeout=min(timeout, 30)
+            )
+            note_http(response)
+            _raise_for_status(response, "Ошибка создания задачи на генерацию изображения")
+            result = response.json()
+            _raise_for_body(result, "Ошибка создания задачи на генерацию изображения")
+            return result
+        
+        return await acall_with_retries('kie', 'create_image_task', _create, idempotent=False)
+    
+    @instrumented('kie', 'download_file')
+    async def download_file_from_url(self, url: str) -> bytes:
+        """Скачивание файла по URL"""
+        async def _download(timeout):
+            response = await self.client.get(url, timeout=min(timeout, 60), follow_redirects=True)
+            note_http(response)
+            _raise_for_status(response, "Ошибка скачивания файла")
+            return response.content
+        
+        return await acall_with_retries('kie', 'download_file', _download)
@@ -0,0 +1,84 @@
+import asyncio
+import threading
+import weakref
+from typing import Awaitable, Callable, Dict
+
+
+# Ресурсы циклов событий: {'closers': функции закрытия, 'watcher': сторож цикла}
+_entries: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]' = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+async def close_loop_resources() -> None:
+    """
+    Закрытие всех ресурсов, зарегистрированных в текущем цикле событий
+    
+    Вызывается явно при остановке цикла: хуком lifespan.shutdown ASGI-приложения (dnk/asgi.py)
+    или сторожем цикла. Ресурсы, созданные после вызова, регистрируются заново.
+    """
+    with _lock:
+        entry = _entries.get(asyncio.get_running_loop())
+        closers = entry['closers'] if entry else []
+        if entry:
+            entry['closers'] = []
+    
+    for closer in reversed(closers):
+        try:
+            await closer()
+        except Exception as e:
+            print(f"Ошибка закрытия ресурса цикла событий: {e}")
+
+
+async def _loop_watcher():
+    """
+    Сторож цикла событий, который завершается без lifespan (asyncio.run, async_to_sync под runserver)
+    
+    Такие циклы перед закрытием закрывают открытые асинхронные генераторы (loop.shutdown_asyncgens),
+    в этот момент ресурсы цикла еще можно закрыть через await.
+    """
+    try:
+        yield
+    finally:
+        await close_loop_resources()
+        # Генератор ссылается на свой цикл, поэтому запись удаляется явно, иначе цикл не освободится
+        with _lock:
+            _entries.pop(asyncio.get_running_loop(), None)
+
+
+async def _start_watcher(watcher) -> None:
+    """Первый шаг сторожа: после него цикл отслеживает генератор и закроет его при завершении"""
+    await watcher.__anext__()
+
+
+def close_on_loop_shutdown(closer: Callable[[], Awaitable[None]]) -> None:
+    """
+    Регистрация ресурса текущего цикла событий для закрытия при его остановке
+    
+    Вызывается из кода, выполняющегося в цикле (например, при создании клиента цикла).
+    
+    Args:
+        closer: Асинхронная функция закрытия (например, AsyncClient.aclose)
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        entry = _entries.get(loop)
+        if entry is None:
+            # Цикл хранит генераторы по слабым ссылкам, поэтому сторож хранится в записи цикла
+            entry = _entries[loop] = {'closers': [], 'watcher': _loop_watcher()}
+            loop.create_task(_start_watcher(entry['watcher']))
+        entry['closers'].append(closer)
+
+
+def close_in_loop(loop: asyncio.AbstractEventLoop, closer: Callable[[], Awaitable[None]]) -> None:
+    """
+    Закрытие ресурса цикла событий из синхронного кода
+    
+    В работающем цикле закрытие планируется без ожидания, закрытый цикл пропускается
+    (его ресурсы уже закрыты при остановке).
+    """
+    if loop.is_closed():
+        return
+    if loop.is_running():
+        asyncio.run_coroutine_threadsafe(closer(), loop)
+    else:
+        loop.run_until_complete(closer())
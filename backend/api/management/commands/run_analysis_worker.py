@@ -0,0 +1,49 @@
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.job_queue import AnalysisWorker
+from api.gemini_client import close_gemini_clients
+from api.instrumentation import flush_upstream_calls
+
+
+class Command(BaseCommand):
+    help = 'Запуск воркера очереди анализов'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.ANALYSIS_WORKER_CONCURRENCY,
+            help='Количество анализов, выполняемых одновременно',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.ANALYSIS_WORKER_POLL_INTERVAL,
+            help='Интервал опроса очереди в секундах',
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Завершить работу, когда очередь опустеет',
+        )
+    
+    def handle(self, *args, **options):
+        worker = AnalysisWorker(
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+        )
+        
+        # Корректное завершение: текущие анализы доводятся до конца
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        
+        self.stdout.write(
+            f"Воркер {worker.worker_id} запущен (concurrency={worker.concurrency})"
+        )
+        try:
+            worker.run(burst=options['burst'])
+        finally:
+            close_gemini_clients()
+            flush_upstream_calls()
+        self.stdout.write("Воркер остановлен")
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.scratch_space import sweep
+
+
+class Command(BaseCommand):
+    help = 'Удаление брошенных временных файлов из рабочего пространства (SCRATCH_ROOT)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age',
+            type=int,
+            default=settings.SCRATCH_ORPHAN_TTL,
+            help='Удалять записи старше указанного числа секунд',
+        )
+    
+    def handle(self, *args, **options):
+        result = sweep(max_age=options['max_age'])
+        self.stdout.write(
+            f"Удалено записей: {result['removed']}, освобождено байт: {result['freed_bytes']}"
+        )
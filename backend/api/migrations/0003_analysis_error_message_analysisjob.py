@@ -0,0 +1,44 @@
+# Generated by Django 6.0 on 2026-10-17 01:54
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_mediafile_kie_model_mediafile_kie_task_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='error_message',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.CreateModel(
+            name='AnalysisJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', 'QUEUED'), ('running', 'RUNNING'), ('done', 'DONE'), ('failed', 'FAILED')], default='queued', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('worker_id', models.CharField(blank=True, default='', max_length=255)),
+                ('error', models.TextField(blank=True, default='')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('analysis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='api.analysis')),
+            ],
+            options={
+                'verbose_name': 'Задача анализа',
+                'verbose_name_plural': 'Задачи анализа',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'available_at'], name='api_analysi_status_d4bda7_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-17 01:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_analysis_error_message_analysisjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissource',
+            name='download_status',
+            field=models.CharField(blank=True, choices=[('pending', 'PENDING'), ('downloading', 'DOWNLOADING'), ('done', 'DONE'), ('error', 'ERROR')], default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='analysissource',
+            name='error_message',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
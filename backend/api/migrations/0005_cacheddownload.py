@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-17 01:58
+
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_analysissource_download_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedDownload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('cache_key', models.CharField(max_length=500, unique=True)),
+                ('extractor', models.CharField(max_length=100)),
+                ('video_id', models.CharField(max_length=255)),
+                ('format_selector', models.CharField(max_length=255)),
+                ('file', models.FileField(max_length=500, upload_to='download_cache/')),
+                ('file_mime_type', models.CharField(blank=True, max_length=100, null=True)),
+                ('file_size', models.BigIntegerField(default=0)),
+                ('title', models.CharField(blank=True, default='', max_length=500)),
+                ('duration', models.FloatField(default=0)),
+                ('hit_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Кеш скачивания',
+                'verbose_name_plural': 'Кеш скачиваний',
+                'ordering': ['-last_accessed_at'],
+            },
+        ),
+    ]
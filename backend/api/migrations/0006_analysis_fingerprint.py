@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-17 01:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_cacheddownload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='cloned_from',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='clones', to='api.analysis'),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='analysisjob',
+            name='options',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='analysissource',
+            name='content_key',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+    ]
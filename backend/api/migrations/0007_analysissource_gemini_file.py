@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-17 02:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_analysis_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissource',
+            name='gemini_file_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysissource',
+            name='gemini_file_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='analysissource',
+            name='gemini_file_uri',
+            field=models.URLField(blank=True, default='', max_length=2000),
+        ),
+    ]
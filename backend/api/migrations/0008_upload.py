@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-17 02:01
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_analysissource_gemini_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=500)),
+                ('mime_type', models.CharField(default='video/mp4', max_length=100)),
+                ('total_size', models.BigIntegerField()),
+                ('received_size', models.BigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('uploading', 'UPLOADING'), ('complete', 'COMPLETE')], default='uploading', max_length=20)),
+                ('checksum', models.CharField(blank=True, default='', max_length=64)),
+                ('file', models.FileField(max_length=500, upload_to='analysis_sources/')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Загрузка',
+                'verbose_name_plural': 'Загрузки',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
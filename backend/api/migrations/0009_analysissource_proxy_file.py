@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissource',
+            name='proxy_file',
+            field=models.FileField(blank=True, max_length=500, null=True, upload_to='analysis_proxies/'),
+        ),
+    ]
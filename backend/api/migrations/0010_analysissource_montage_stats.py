@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_analysissource_proxy_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissource',
+            name='montage_stats',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-17 02:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_analysissource_montage_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissource',
+            name='transcript',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='cacheddownload',
+            name='transcript',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-17 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_source_transcript'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysissource',
+            name='download_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='analysissource',
+            name='download_wait_seconds',
+            field=models.FloatField(default=0),
+        ),
+    ]
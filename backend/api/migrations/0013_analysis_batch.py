@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-17 02:17
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_source_download_wait'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisBatch',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Пакет анализов',
+                'verbose_name_plural': 'Пакеты анализов',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='analyses', to='api.analysisbatch'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-17 02:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_analysis_batch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='script',
+            name='error_message',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='script',
+            name='status',
+            field=models.CharField(choices=[('generating', 'GENERATING'), ('ready', 'READY'), ('error', 'ERROR')], default='ready', max_length=20),
+        ),
+    ]
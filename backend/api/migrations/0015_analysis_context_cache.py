@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-17 02:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_script_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='context_cache_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='context_cache_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='context_cache_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0 on 2026-10-17 02:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_analysis_context_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UpstreamCall',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('service', models.CharField(choices=[('gemini', 'Gemini'), ('kie', 'Kie.ai')], max_length=20)),
+                ('operation', models.CharField(max_length=50)),
+                ('model', models.CharField(blank=True, default='', max_length=100)),
+                ('analysis_id', models.UUIDField(blank=True, db_index=True, null=True)),
+                ('script_id', models.UUIDField(blank=True, db_index=True, null=True)),
+                ('started_at', models.DateTimeField(db_index=True)),
+                ('duration_ms', models.FloatField()),
+                ('retries', models.PositiveSmallIntegerField(default=0)),
+                ('input_tokens', models.IntegerField(blank=True, null=True)),
+                ('output_tokens', models.IntegerField(blank=True, null=True)),
+                ('cached_tokens', models.IntegerField(blank=True, null=True)),
+                ('request_bytes', models.BigIntegerField(default=0)),
+                ('response_bytes', models.BigIntegerField(default=0)),
+                ('cost_usd', models.FloatField(blank=True, null=True)),
+                ('outcome', models.CharField(choices=[('success', 'SUCCESS'), ('error', 'ERROR'), ('cancelled', 'CANCELLED')], default='success', max_length=20)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'verbose_name': 'Вызов внешнего API',
+                'verbose_name_plural': 'Вызовы внешних API',
+                'ordering': ['-started_at'],
+                'indexes': [models.Index(fields=['service', 'operation', 'started_at'], name='api_upstrea_service_fad19b_idx')],
+            },
+        ),
+    ]
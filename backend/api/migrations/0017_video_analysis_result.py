@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-17 02:42
+
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_upstream_call'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoAnalysisResult',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('cache_key', models.CharField(max_length=64, unique=True)),
+                ('content_key', models.CharField(db_index=True, max_length=500)),
+                ('result', models.JSONField(default=dict)),
+                ('montage_stats', models.JSONField(blank=True, default=dict)),
+                ('hit_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Анализ видео',
+                'verbose_name_plural': 'Анализы видео',
+                'ordering': ['-last_accessed_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 6.0 on 2026-10-17 02:44
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+def create_initial_versions(apps, schema_editor):
+    """Версия 1 для готовых анализов, сценарии привязываются к ней"""
+    Analysis = apps.get_model('api', 'Analysis')
+    AnalysisVersion = apps.get_model('api', 'AnalysisVersion')
+    Script = apps.get_model('api', 'Script')
+    
+    for analysis in Analysis.objects.filter(status='ready').iterator():
+        version = AnalysisVersion.objects.create(
+            analysis=analysis,
+            number=1,
+            transcript=analysis.transcript,
+            style_passport=analysis.style_passport,
+            patterns=analysis.patterns,
+            grounding_sources=analysis.grounding_sources,
+            sources=[
+                {'id': str(source.id), 'label': source.label, 'url': source.url, 'content_key': source.content_key}
+                for source in analysis.sources.all()
+            ],
+        )
+        Analysis.objects.filter(id=analysis.id).update(current_version=version)
+        Script.objects.filter(analysis=analysis).update(analysis_version=version)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_video_analysis_result'),
+    ]
+    
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisVersion',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('number', models.PositiveIntegerField()),
+                ('transcript', models.JSONField(blank=True, default=list)),
+                ('style_passport', models.JSONField(blank=True, default=dict)),
+                ('patterns', models.JSONField(blank=True, default=list)),
+                ('grounding_sources', models.JSONField(blank=True, default=list)),
+                ('sources', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('analysis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='api.analysis')),
+            ],
+            options={
+                'verbose_name': 'Версия анализа',
+                'verbose_name_plural': 'Версии анализов',
+                'ordering': ['-number'],
+            },
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='current_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.analysisversion'),
+        ),
+        migrations.AddField(
+            model_name='script',
+            name='analysis_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='scripts', to='api.analysisversion'),
+        ),
+        migrations.AddConstraint(
+            model_name='analysisversion',
+            constraint=models.UniqueConstraint(fields=('analysis', 'number'), name='unique_analysis_version_number'),
+        ),
+        migrations.RunPython(create_initial_versions, migrations.RunPython.noop),
+    ]
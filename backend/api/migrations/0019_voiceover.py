@@ -0,0 +1,51 @@
+# Generated by Django 6.0 on 2026-10-17 02:49
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_analysis_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Voiceover',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('generating', 'GENERATING'), ('done', 'DONE'), ('error', 'ERROR')], default='generating', max_length=20)),
+                ('error_message', models.TextField(blank=True, default='')),
+                ('audio_file', models.FileField(blank=True, max_length=500, null=True, upload_to='media/voiceovers/')),
+                ('duration_ms', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('script', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='voiceovers', to='api.script')),
+            ],
+            options={
+                'verbose_name': 'Озвучка',
+                'verbose_name_plural': 'Озвучки',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='VoiceoverSegment',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('audio_file', models.FileField(max_length=500, upload_to='media/voiceovers/segments/')),
+                ('start_ms', models.IntegerField(default=0)),
+                ('duration_ms', models.IntegerField(default=0)),
+                ('chunk_count', models.PositiveSmallIntegerField(default=1)),
+                ('order', models.IntegerField(default=0)),
+                ('segment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='voiceover_segments', to='api.scriptsegment')),
+                ('voiceover', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='api.voiceover')),
+            ],
+            options={
+                'verbose_name': 'Озвучка сегмента',
+                'verbose_name_plural': 'Озвучки сегментов',
+                'ordering': ['order'],
+            },
+        ),
+    ]
@@ -1,8 +1,23 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.postgres.fields import ArrayField, JSONField
 import uuid
 
 
+class AnalysisBatch(models.Model):
+    """Пакет анализов, отправленных одним запросом (например, по одному на канал конкурента)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Пакет анализов'
+        verbose_name_plural = 'Пакеты анализов'
+    
+    def __str__(self):
+        return f"AnalysisBatch {self.id}"
+
+
 class Analysis(models.Model):
     """Модель для хранения результатов анализа ДНК успеха"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -27,15 +42,68 @@ class Analysis(models.Model):
     patterns = models.JSONField(default=list, blank=True)  # ContentPattern[]
     grounding_sources = models.JSONField(default=list, blank=True)  # GroundingSource[]
     
+    # Текст ошибки, если анализ завершился неудачно
+    error_message = models.TextField(blank=True, default='')
+    
+    # Отпечаток входных данных (источники, версия промпта, модель) для повторного использования результатов
+    fingerprint = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # Анализ, результаты которого были скопированы вместо нового вызова Gemini
+    cloned_from = models.ForeignKey(
+        'self', related_name='clones', on_delete=models.SET_NULL, blank=True, null=True
+    )
+    # Пакет, в составе которого анализ был отправлен
+    batch = models.ForeignKey(
+        AnalysisBatch, related_name='analyses', on_delete=models.SET_NULL, blank=True, null=True
+    )
+    
+    # Кеш контекста Gemini с ДНК анализа, общий для всех сценариев (см. context_cache)
+    context_cache_name = models.CharField(max_length=255, blank=True, default='')
+    # Хеш ДНК, для которого создан кеш: при изменении ДНК кеш создается заново
+    context_cache_key = models.CharField(max_length=64, blank=True, default='')
+    context_cache_expires_at = models.DateTimeField(blank=True, null=True)
+    
+    # Текущая версия ДНК (меняется при каждом завершении анализа, в том числе после изменения источников)
+    current_version = models.ForeignKey(
+        'AnalysisVersion', related_name='+', on_delete=models.SET_NULL, blank=True, null=True
+    )
+    
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Анализ'
         verbose_name_plural = 'Анализы'
-
+    
     def __str__(self):
         return f"Analysis {self.id} - {self.status}"
 
 
+class AnalysisVersion(models.Model):
+    """Версия ДНК анализа: снимок результатов после каждого завершения анализа"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    analysis = models.ForeignKey(Analysis, related_name='versions', on_delete=models.CASCADE)
+    # Номер версии внутри анализа (1, 2, ...)
+    number = models.PositiveIntegerField()
+    
+    transcript = models.JSONField(default=list, blank=True)  # TranscriptSegment[]
+    style_passport = models.JSONField(default=dict, blank=True)  # StylePassport
+    patterns = models.JSONField(default=list, blank=True)  # ContentPattern[]
+    grounding_sources = models.JSONField(default=list, blank=True)  # GroundingSource[]
+    # Источники, по которым получена версия: [{'id': ..., 'label': ..., 'url': ..., 'content_key': ...}, ...]
+    sources = models.JSONField(default=list, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-number']
+        constraints = [
+            models.UniqueConstraint(fields=['analysis', 'number'], name='unique_analysis_version_number'),
+        ]
+        verbose_name = 'Версия анализа'
+        verbose_name_plural = 'Версии анализов'
+    
+    def __str__(self):
+        return f"Analysis {self.analysis_id} v{self.number}"
+
+
 class AnalysisSource(models.Model):
     """Источники для анализа (URL или файлы)"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -54,6 +122,35 @@ class AnalysisSource(models.Model):
     # Для файлов
     file = models.FileField(upload_to='analysis_sources/', blank=True, null=True)
     file_mime_type = models.CharField(max_length=100, blank=True, null=True)
+    # Легкая копия видео для анализа (пониженные разрешение, fps и звук), передается в Gemini вместо file
+    proxy_file = models.FileField(upload_to='analysis_proxies/', max_length=500, blank=True, null=True)
+    
+    # Статус скачивания (пустой для источников, которые не нужно скачивать)
+    DOWNLOAD_STATUS_CHOICES = [
+        ('pending', 'PENDING'),
+        ('downloading', 'DOWNLOADING'),
+        ('done', 'DONE'),
+        ('error', 'ERROR'),
+    ]
+    download_status = models.CharField(max_length=20, choices=DOWNLOAD_STATUS_CHOICES, blank=True, default='')
+    error_message = models.TextField(blank=True, default='')
+    # Ожидание в очереди скачивания (лимиты платформы, повторы) в секундах и число попыток
+    download_wait_seconds = models.FloatField(default=0)
+    download_attempts = models.PositiveSmallIntegerField(default=0)
+    
+    # Ключ содержимого: канонический id видео для ссылок или SHA-256 для файлов
+    content_key = models.CharField(max_length=500, blank=True, default='')
+    
+    # Транскрипт из субтитров видео (TranscriptSegment[]), пустой - субтитров нет
+    transcript = models.JSONField(default=list, blank=True)
+    
+    # Метрики монтажа, измеренные локально (склейки, средняя длина сцены)
+    montage_stats = models.JSONField(default=dict, blank=True)
+    
+    # Файл, загруженный в Gemini Files API (переиспользуется до истечения срока)
+    gemini_file_name = models.CharField(max_length=255, blank=True, default='')
+    gemini_file_uri = models.URLField(max_length=2000, blank=True, default='')
+    gemini_file_expires_at = models.DateTimeField(blank=True, null=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -61,16 +158,122 @@ class AnalysisSource(models.Model):
         ordering = ['created_at']
         verbose_name = 'Источник анализа'
         verbose_name_plural = 'Источники анализа'
-
+    
     def __str__(self):
         return f"{self.source_type}: {self.label}"
 
 
+class Upload(models.Model):
+    """Файл, загружаемый частями (с возможностью продолжить загрузку после обрыва)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    
+    filename = models.CharField(max_length=500)
+    mime_type = models.CharField(max_length=100, default='video/mp4')
+    total_size = models.BigIntegerField()
+    # Сколько байт уже записано (следующая часть должна начинаться с этого смещения)
+    received_size = models.BigIntegerField(default=0)
+    
+    STATUS_CHOICES = [
+        ('uploading', 'UPLOADING'),
+        ('complete', 'COMPLETE'),
+    ]
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    
+    # SHA-256 содержимого, проверяется при завершении загрузки
+    checksum = models.CharField(max_length=64, blank=True, default='')
+    
+    # Части собираются в UPLOAD_PARTIAL_ROOT, в хранилище источников анализа файл
+    # попадает после проверки контрольной суммы
+    file = models.FileField(upload_to='analysis_sources/', max_length=500)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Загрузка'
+        verbose_name_plural = 'Загрузки'
+    
+    def __str__(self):
+        return f"Upload {self.filename} ({self.received_size}/{self.total_size}) - {self.status}"
+
+
+class CachedDownload(models.Model):
+    """Кеш скачанных видео по каноническому id видео и формату yt-dlp"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    
+    # Ключ вида "<экстрактор>:<id видео>:<формат>"
+    cache_key = models.CharField(max_length=500, unique=True)
+    extractor = models.CharField(max_length=100)
+    video_id = models.CharField(max_length=255)
+    format_selector = models.CharField(max_length=255)
+    
+    file = models.FileField(upload_to='download_cache/', max_length=500)
+    file_mime_type = models.CharField(max_length=100, blank=True, null=True)
+    file_size = models.BigIntegerField(default=0)
+    title = models.CharField(max_length=500, blank=True, default='')
+    duration = models.FloatField(default=0)
+    # Транскрипт из субтитров видео (TranscriptSegment[])
+    transcript = models.JSONField(default=list, blank=True)
+    
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        ordering = ['-last_accessed_at']
+        verbose_name = 'Кеш скачивания'
+        verbose_name_plural = 'Кеш скачиваний'
+    
+    def __str__(self):
+        return f"{self.cache_key} ({self.file_size} bytes)"
+
+
+class VideoAnalysisResult(models.Model):
+    """Кеш анализа отдельного видео (ANALYSIS_MODE = 'map_reduce') по ключу содержимого видео"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    
+    # SHA-256 от ключа содержимого, версии промпта, модели, профиля качества и режима входных данных
+    cache_key = models.CharField(max_length=64, unique=True)
+    content_key = models.CharField(max_length=500, db_index=True)
+    
+    # Результат analyze_content по одному видео (transcript, stylePassport, patterns, sources)
+    result = models.JSONField(default=dict)
+    # Метрики монтажа видео, измеренные локально (пустые, если видео передавалось целиком)
+    montage_stats = models.JSONField(default=dict, blank=True)
+    
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        ordering = ['-last_accessed_at']
+        verbose_name = 'Анализ видео'
+        verbose_name_plural = 'Анализы видео'
+    
+    def __str__(self):
+        return f"{self.content_key} ({self.hit_count} hits)"
+
+
 class Script(models.Model):
     """Сценарий, созданный на основе анализа"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     analysis = models.ForeignKey(Analysis, related_name='scripts', on_delete=models.CASCADE)
+    # Версия ДНК, по которой сгенерирован сценарий
+    analysis_version = models.ForeignKey(
+        AnalysisVersion, related_name='scripts', on_delete=models.SET_NULL, blank=True, null=True
+    )
     topic = models.CharField(max_length=500)
+    
+    STATUS_CHOICES = [
+        ('generating', 'GENERATING'),
+        ('ready', 'READY'),
+        ('error', 'ERROR'),
+    ]
+    # При потоковой генерации сценарий создается до первого сегмента и дописывается по мере генерации
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='ready')
+    error_message = models.TextField(blank=True, default='')
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -78,7 +281,7 @@ class Script(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Сценарий'
         verbose_name_plural = 'Сценарии'
-
+    
     def __str__(self):
         return f"Script: {self.topic}"
 
@@ -101,7 +304,7 @@ class ScriptSegment(models.Model):
         ordering = ['order', 'created_at']
         verbose_name = 'Сегмент сценария'
         verbose_name_plural = 'Сегменты сценария'
-
+    
     def __str__(self):
         return f"Segment {self.order}: {self.timeframe}"
 
@@ -147,6 +350,155 @@ class MediaFile(models.Model):
         ordering = ['created_at']
         verbose_name = 'Медиа файл'
         verbose_name_plural = 'Медиа файлы'
-
+    
     def __str__(self):
         return f"{self.media_type} for segment {self.segment.id} - {self.status}"
+
+
+class Voiceover(models.Model):
+    """Озвучка сценария целиком: общая дорожка и файлы сегментов с их смещениями"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    script = models.ForeignKey(Script, related_name='voiceovers', on_delete=models.CASCADE)
+    
+    STATUS_CHOICES = [
+        ('generating', 'GENERATING'),
+        ('done', 'DONE'),
+        ('error', 'ERROR'),
+    ]
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='generating')
+    error_message = models.TextField(blank=True, default='')
+    
+    # Дорожка всего сценария (WAV): сегменты по порядку с паузой VOICEOVER_SEGMENT_PAUSE_MS между ними
+    audio_file = models.FileField(upload_to='media/voiceovers/', max_length=500, blank=True, null=True)
+    duration_ms = models.IntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Озвучка'
+        verbose_name_plural = 'Озвучки'
+    
+    def __str__(self):
+        return f"Voiceover {self.id} for script {self.script_id} - {self.status}"
+
+
+class VoiceoverSegment(models.Model):
+    """Озвучка сегмента сценария и ее положение на общей дорожке"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    voiceover = models.ForeignKey(Voiceover, related_name='segments', on_delete=models.CASCADE)
+    segment = models.ForeignKey(ScriptSegment, related_name='voiceover_segments', on_delete=models.CASCADE)
+    
+    # Файл сегмента (WAV)
+    audio_file = models.FileField(upload_to='media/voiceovers/segments/', max_length=500)
+    # Начало сегмента на общей дорожке и его длительность
+    start_ms = models.IntegerField(default=0)
+    duration_ms = models.IntegerField(default=0)
+    # На сколько частей текст сегмента был разбит для синтеза
+    chunk_count = models.PositiveSmallIntegerField(default=1)
+    
+    order = models.IntegerField(default=0)
+    
+    class Meta:
+        ordering = ['order']
+        verbose_name = 'Озвучка сегмента'
+        verbose_name_plural = 'Озвучки сегментов'
+    
+    def __str__(self):
+        return f"Segment {self.segment_id} at {self.start_ms} ms"
+
+
+class AnalysisJob(models.Model):
+    """Задача в очереди на выполнение анализа"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    analysis = models.ForeignKey(Analysis, related_name='jobs', on_delete=models.CASCADE)
+    
+    STATUS_CHOICES = [
+        ('queued', 'QUEUED'),
+        ('running', 'RUNNING'),
+        ('done', 'DONE'),
+        ('failed', 'FAILED'),
+    ]
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    
+    # Количество попыток выполнения (увеличивается при каждом захвате воркером)
+    attempts = models.IntegerField(default=0)
+    
+    # Идентификатор воркера, который выполняет задачу
+    worker_id = models.CharField(max_length=255, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    
+    # Параметры запуска анализа (например, force_refresh)
+    options = models.JSONField(default=dict, blank=True)
+    
+    # Задача не берется в работу раньше этого момента
+    available_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+        verbose_name = 'Задача анализа'
+        verbose_name_plural = 'Задачи анализа'
+    
+    def __str__(self):
+        return f"Job {self.id} for analysis {self.analysis_id} - {self.status}"
+
+
+class UpstreamCall(models.Model):
+    """Замер одного вызова внешнего API (Gemini, Kie.ai)"""
+    id = models.BigAutoField(primary_key=True)
+    
+    SERVICE_CHOICES = [
+        ('gemini', 'Gemini'),
+        ('kie', 'Kie.ai'),
+    ]
+    service = models.CharField(max_length=20, choices=SERVICE_CHOICES)
+    operation = models.CharField(max_length=50)
+    model = models.CharField(max_length=100, blank=True, default='')
+    
+    # Не внешние ключи: записи сохраняются фоновым потоком, а сценарий может быть
+    # сохранен уже после вызова (или не сохранен вовсе при ошибке генерации)
+    analysis_id = models.UUIDField(blank=True, null=True, db_index=True)
+    script_id = models.UUIDField(blank=True, null=True, db_index=True)
+    
+    started_at = models.DateTimeField(db_index=True)
+    duration_ms = models.FloatField()
+    # Повторные попытки внутри вызова (сбои API, недоступный кеш контекста)
+    retries = models.PositiveSmallIntegerField(default=0)
+    
+    # Токены из usage_metadata Gemini (для Kie.ai не заполняются)
+    input_tokens = models.IntegerField(blank=True, null=True)
+    output_tokens = models.IntegerField(blank=True, null=True)
+    cached_tokens = models.IntegerField(blank=True, null=True)
+    request_bytes = models.BigIntegerField(default=0)
+    response_bytes = models.BigIntegerField(default=0)
+    # Оценка по UPSTREAM_PRICING (пусто, если тариф модели не задан)
+    cost_usd = models.FloatField(blank=True, null=True)
+    
+    OUTCOME_CHOICES = [
+        ('success', 'SUCCESS'),
+        ('error', 'ERROR'),
+        ('cancelled', 'CANCELLED'),
+    ]
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES, default='success')
+    error = models.TextField(blank=True, default='')
+    
+    class Meta:
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['service', 'operation', 'started_at']),
+        ]
+        verbose_name = 'Вызов внешнего API'
+        verbose_name_plural = 'Вызовы внешних API'
+    
+    def __str__(self):
+        return f"{self.service}.{self.operation} ({self.model}) - {self.outcome}, {self.duration_ms:.0f} ms"
@@ -0,0 +1,14 @@
+from rest_framework.parsers import BaseParser
+
+
+class ChunkParser(BaseParser):
+    """
+    Парсер для частей загружаемого файла
+    
+    Тело запроса не читается в память: парсер возвращает поток,
+    который view копирует в файл блоками.
+    """
+    media_type = 'application/octet-stream'
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream
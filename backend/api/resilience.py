@@ -0,0 +1,383 @@
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+import httpx
+import requests
+from google.genai import errors as genai_errors
+from django.conf import settings
+
+from .instrumentation import note_retry
+
+
+T = TypeVar('T')
+
+# Статусы, после которых запрос можно повторить
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+# Статусы, при которых запрос точно не выполнен - их можно повторять и для неидемпотентных
+# запросов (создание задачи Kie.ai): повтор не создаст задачу второй раз
+REJECTED_STATUSES = {429, 503}
+
+
+class UpstreamHTTPError(Exception):
+    """Ответ внешнего API с ошибкой (HTTP-статус и Retry-After сохраняются для повторов)"""
+    
+    def __init__(self, message: str, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """Внешний API недоступен: предохранитель разомкнут, запрос не выполнялся"""
+    
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(f"Сервис {service} временно недоступен, повторите через {int(retry_after) + 1} с")
+        self.service = service
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    """Время на операцию (вместе с повторами) истекло"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Значение заголовка Retry-After в секундах
+    
+    Args:
+        value: Число секунд или HTTP-дата
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=dt_timezone.utc)
+    return max((retry_at - datetime.now(dt_timezone.utc)).total_seconds(), 0.0)
+
+
+def _gemini_retry_delay(error: genai_errors.APIError) -> Optional[float]:
+    """Задержка из RetryInfo в ответе Gemini (например, "retryDelay": "13s") или из заголовка Retry-After"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers is not None and headers.get('retry-after'):
+        return parse_retry_after(headers.get('retry-after'))
+    
+    details = error.details.get('error', {}).get('details', []) if isinstance(error.details, dict) else []
+    for detail in details if isinstance(details, list) else []:
+        if isinstance(detail, dict) and str(detail.get('@type', '')).endswith('RetryInfo'):
+            delay = str(detail.get('retryDelay', '')).rstrip('s')
+            try:
+                return float(delay)
+            except ValueError:
+                return None
+    return None
+
+
+class ErrorInfo:
+    """
+    Классификация ошибки внешнего API
+    
+    Attributes:
+        retryable: Запрос можно повторить
+        rejected: Запрос точно не выполнен (соединение не установлено, 429, 503)
+        upstream_failure: Сбой на стороне API - учитывается предохранителем
+        status: HTTP-статус (если есть)
+        retry_after: Сколько секунд API просит подождать (если указал)
+    """
+    
+    def __init__(
+        self,
+        retryable: bool,
+        rejected: bool = False,
+        upstream_failure: bool = False,
+        status: Optional[int] = None,
+        retry_after: Optional[float] = None
+    ):
+        self.retryable = retryable
+        self.rejected = rejected
+        self.upstream_failure = upstream_failure
+        self.status = status
+        self.retry_after = retry_after
+
+
+def classify_error(error: BaseException) -> ErrorInfo:
+    """
+    Классификация ошибки по типу исключения и HTTP-статусу
+    
+    Повторяются 408, 429, 5xx, таймауты и сетевые ошибки. Остальные ответы 4xx
+    (неверный запрос, ключ, квота модели) не повторяются и не размыкают предохранитель.
+    """
+    status = None
+    retry_after = None
+    if isinstance(error, UpstreamHTTPError):
+        status, retry_after = error.status_code, error.retry_after
+    elif isinstance(error, genai_errors.APIError):
+        status, retry_after = error.code, _gemini_retry_delay(error)
+    elif isinstance(error, (httpx.HTTPStatusError, requests.HTTPError)) and error.response is not None:
+        status = error.response.status_code
+        retry_after = parse_retry_after(error.response.headers.get('retry-after'))
+    
+    if isinstance(status, int):
+        return ErrorInfo(
+            retryable=status in RETRYABLE_STATUSES,
+            rejected=status in REJECTED_STATUSES,
+            upstream_failure=status >= 500 or status == 408,
+            status=status,
+            retry_after=retry_after,
+        )
+    
+    # Соединение не установлено - запрос до API не дошел
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, requests.ConnectTimeout)):
+        return ErrorInfo(retryable=True, rejected=True, upstream_failure=True)
+    # Таймаут или обрыв после отправки - запрос мог выполниться
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError, requests.Timeout, requests.ConnectionError)):
+        return ErrorInfo(retryable=True, upstream_failure=True)
+    
+    return ErrorInfo(retryable=False)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель внешнего API (один на сервис в процессе)
+    
+    После UPSTREAM_BREAKER_FAILURE_THRESHOLD сбоев подряд (5xx, таймауты, сетевые ошибки)
+    предохранитель размыкается: запросы сразу завершаются CircuitOpenError, а не ждут
+    таймаутов, занимая потоки воркеров. Через UPSTREAM_BREAKER_RESET_TIMEOUT секунд
+    пропускается один пробный запрос: успех замыкает предохранитель, сбой снова размыкает.
+    """
+    
+    def __init__(self, service: str):
+        self.service = service
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_total = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+    
+    def allow(self) -> None:
+        """
+        Проверка перед запросом
+        
+        Raises:
+            CircuitOpenError: Предохранитель разомкнут (или пробный запрос уже выполняется)
+        """
+        with self._lock:
+            if self.state == 'closed':
+                return
+            
+            wait = self.opened_at + settings.UPSTREAM_BREAKER_RESET_TIMEOUT - time.monotonic()
+            if self.state == 'open' and wait <= 0:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            raise CircuitOpenError(self.service, max(wait, 1.0))
+    
+    def record_success(self) -> None:
+        """API ответил (в том числе ошибкой клиента 4xx) - сервис работает"""
+        with self._lock:
+            if self.state != 'closed':
+                print(f"Предохранитель {self.service} замкнут: сервис снова отвечает")
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_in_flight = False
+    
+    def record_failure(self) -> None:
+        """Сбой на стороне API"""
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or self.failures >= settings.UPSTREAM_BREAKER_FAILURE_THRESHOLD:
+                if self.state != 'open':
+                    self.opened_total += 1
+                    print(f"Предохранитель {self.service} разомкнут после {self.failures} сбоев подряд")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+    
+    def release(self) -> None:
+        """Запрос прерван без ответа (отмена) - пробный запрос можно выполнить снова"""
+        with self._lock:
+            self._trial_in_flight = False
+    
+    def record(self, error: BaseException) -> None:
+        """Учет результата запроса, завершившегося исключением"""
+        if isinstance(error, CircuitOpenError):
+            return
+        if not isinstance(error, Exception):
+            self.release()
+        elif classify_error(error).upstream_failure:
+            self.record_failure()
+        else:
+            self.record_success()
+    
+    def as_dict(self) -> Dict[str, Any]:
+        """Состояние для /api/health/"""
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'opened_total': self.opened_total,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(service: str) -> CircuitBreaker:
+    """Предохранитель сервиса (создается при первом обращении)"""
+    with _breakers_lock:
+        if service not in _breakers:
+            _breakers[service] = CircuitBreaker(service)
+        return _breakers[service]
+
+
+def get_circuit_breaker_states() -> Dict[str, Dict[str, Any]]:
+    """Состояние предохранителей всех сервисов"""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {service: breaker.as_dict() for service, breaker in breakers.items()}
+
+
+class RetryGuard:
+    """
+    Повторы одной операции внешнего API с ограничением по времени и предохранителем
+    
+    Время на операцию (UPSTREAM_DEADLINES) общее для всех попыток: задержка, которая
+    выходит за него, не выполняется - ошибка пробрасывается сразу. Для обычных вызовов
+    используются call/acall (функция получает таймаут попытки); потоковые ответы вызывают before_attempt/succeeded/failed сами,
+    чтобы не повторять запрос после того, как часть ответа уже отдана.
+    """
+    
+    def __init__(self, service: str, operation: str, idempotent: bool = True):
+        """
+        Args:
+            service: 'gemini' или 'kie'
+            operation: Название операции (ключ в UPSTREAM_DEADLINES - '<service>.<operation>')
+            idempotent: Повтор не создает побочных эффектов. Неидемпотентные запросы повторяются,
+                только если точно не были выполнены (нет соединения, 429, 503)
+        """
+        self.service = service
+        self.operation = operation
+        self.idempotent = idempotent
+        self.breaker = get_circuit_breaker(service)
+        self.deadline = time.monotonic() + settings.UPSTREAM_DEADLINES.get(
+            f"{service}.{operation}", settings.UPSTREAM_DEADLINES['default']
+        )
+        self.attempt = 0
+    
+    def remaining(self) -> float:
+        """Сколько секунд осталось до конца отведенного времени"""
+        return self.deadline - time.monotonic()
+    
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """Таймаут очередной попытки: остаток времени операции (не больше cap)"""
+        remaining = max(self.remaining(), 1.0)
+        return min(remaining, cap) if cap else remaining
+    
+    def before_attempt(self) -> None:
+        """
+        Проверка перед попыткой
+        
+        Raises:
+            DeadlineExceeded: Время операции истекло
+            CircuitOpenError: Предохранитель сервиса разомкнут
+        """
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(f"Операция {self.service}.{self.operation} не уложилась в отведенное время")
+        self.breaker.allow()
+    
+    def succeeded(self) -> None:
+        """Попытка завершилась успешно"""
+        self.breaker.record_success()
+    
+    def failed(self, error: BaseException, retry: bool = True) -> Optional[float]:
+        """
+        Учет неудачной попытки
+        
+        Args:
+            error: Исключение попытки
+            retry: Повтор в принципе допустим (например, потоковый ответ еще не начат)
+        
+        Returns:
+            Задержка перед следующей попыткой в секундах или None, если повторять нельзя
+        """
+        self.breaker.record(error)
+        if not retry or not isinstance(error, Exception):
+            return None
+        
+        info = classify_error(error)
+        if not info.retryable or (not self.idempotent and not info.rejected):
+            return None
+        if self.attempt >= settings.UPSTREAM_RETRY_ATTEMPTS:
+            return None
+        
+        # Экспоненциальная задержка с разбросом, чтобы повторы воркеров не совпадали,
+        # но не меньше, чем просит API
+        delay = min(settings.UPSTREAM_RETRY_BASE_DELAY * 2 ** self.attempt, settings.UPSTREAM_RETRY_MAX_DELAY)
+        delay = delay * random.uniform(0.5, 1.0)
+        if info.retry_after is not None:
+            if info.retry_after > settings.UPSTREAM_RETRY_AFTER_MAX:
+                return None
+            delay = max(delay, info.retry_after + random.uniform(0, 0.1 * info.retry_after + 0.1))
+        if delay >= self.remaining():
+            return None
+        
+        self.attempt += 1
+        note_retry()
+        return delay
+    
+    def call(self, fn: Callable[[float], T]) -> T:
+        """Вызов с повторами (fn получает таймаут попытки в секундах - остаток времени операции)"""
+        while True:
+            self.before_attempt()
+            try:
+                result = fn(self.timeout())
+            except BaseException as e:
+                delay = self.failed(e)
+                if delay is None:
+                    raise
+                print(f"{self.service}.{self.operation}: повтор через {delay:.1f} с после ошибки: {str(e)}")
+                time.sleep(delay)
+                continue
+            self.succeeded()
+            return result
+    
+    async def acall(self, fn: Callable[[float], Awaitable[T]]) -> T:
+        """Асинхронный вызов с повторами (fn - корутинная функция, получает таймаут попытки)"""
+        while True:
+            self.before_attempt()
+            try:
+                result = await fn(self.timeout())
+            except BaseException as e:
+                delay = self.failed(e)
+                if delay is None:
+                    raise
+                print(f"{self.service}.{self.operation}: повтор через {delay:.1f} с после ошибки: {str(e)}")
+                await asyncio.sleep(delay)
+                continue
+            self.succeeded()
+            return result
+
+
+def call_with_retries(service: str, operation: str, fn: Callable[[float], T], idempotent: bool = True) -> T:
+    """Вызов внешнего API с повторами, ограничением по времени и предохранителем (см. RetryGuard)"""
+    return RetryGuard(service, operation, idempotent).call(fn)
+
+
+async def acall_with_retries(service: str, operation: str, fn: Callable[[float], Awaitable[T]], idempotent: bool = True) -> T:
+    """Асинхронный вариант call_with_retries"""
+    return await RetryGuard(service, operation, idempotent).acall(fn)
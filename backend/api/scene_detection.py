@@ -0,0 +1,201 @@
+import os
+from typing import List, Dict, Any, Optional
+import numpy as np
+from django.conf import settings
+
+from .transcode import TranscodeError, run_ffmpeg
+
+
+def decode_gray_frames(path: str, fps: float, width: int, height: int) -> np.ndarray:
+    """
+    Декодирование видео в маленькие кадры в оттенках серого
+    
+    Args:
+        path: Путь к видео
+        fps: Частота выборки кадров
+        width: Ширина кадра
+        height: Высота кадра
+    
+    Returns:
+        Массив формы (кадры, height, width) типа uint8
+    """
+    raw = run_ffmpeg([
+        '-v', 'error', '-i', path,
+        '-vf', f'fps={fps},scale={width}:{height},format=gray',
+        '-f', 'rawvideo', '-',
+    ])
+    frame_size = width * height
+    frame_count = len(raw) // frame_size
+    return np.frombuffer(raw[:frame_count * frame_size], dtype=np.uint8).reshape(frame_count, height, width)
+
+
+def frame_differences(frames: np.ndarray) -> np.ndarray:
+    """Средняя абсолютная разница соседних кадров (0..1), длина - кадры - 1"""
+    if len(frames) < 2:
+        return np.zeros(0, dtype=np.float32)
+    diffs = np.abs(np.diff(frames.astype(np.int16), axis=0))
+    return diffs.mean(axis=(1, 2), dtype=np.float32) / 255.0
+
+
+def detect_cuts(diffs: np.ndarray, threshold: float, min_scene_frames: int) -> np.ndarray:
+    """
+    Поиск склеек по разнице соседних кадров
+    
+    Склейка - кадр, разница с предыдущим больше threshold и заметно больше
+    фонового движения вокруг (чтобы быстрая камера не давала серию ложных склеек).
+    Склейки ближе min_scene_frames друг к другу отбрасываются.
+    
+    Returns:
+        Индексы кадров, с которых начинаются новые сцены
+    """
+    if len(diffs) == 0:
+        return np.zeros(0, dtype=np.int64)
+    
+    # Фон - медиана разниц в окне вокруг кадра
+    window = 9
+    padded = np.pad(diffs, window // 2, mode='edge')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window)
+    background = np.median(windows, axis=1)
+    
+    candidates = np.flatnonzero((diffs > threshold) & (diffs > background * 2)) + 1
+    
+    cuts = []
+    for index in candidates:
+        if not cuts or index - cuts[-1] >= min_scene_frames:
+            cuts.append(index)
+    return np.asarray(cuts, dtype=np.int64)
+
+
+def compute_montage_stats(cut_frames: np.ndarray, frame_count: int, fps: float) -> Dict[str, Any]:
+    """
+    Метрики монтажа по найденным склейкам
+    
+    Returns:
+        {'duration', 'cut_count', 'shot_count', 'avg_shot_length', 'median_shot_length',
+         'min_shot_length', 'max_shot_length', 'cuts_per_minute', 'cut_times'}
+    """
+    duration = frame_count / fps
+    boundaries = np.concatenate(([0], cut_frames, [frame_count])) / fps
+    shot_lengths = np.diff(boundaries)
+    
+    return {
+        'duration': round(float(duration), 2),
+        'cut_count': int(len(cut_frames)),
+        'shot_count': int(len(shot_lengths)),
+        'avg_shot_length': round(float(shot_lengths.mean()), 2) if len(shot_lengths) else 0.0,
+        'median_shot_length': round(float(np.median(shot_lengths)), 2) if len(shot_lengths) else 0.0,
+        'min_shot_length': round(float(shot_lengths.min()), 2) if len(shot_lengths) else 0.0,
+        'max_shot_length': round(float(shot_lengths.max()), 2) if len(shot_lengths) else 0.0,
+        'cuts_per_minute': round(len(cut_frames) / duration * 60, 2) if duration else 0.0,
+        'cut_times': [round(float(t), 2) for t in boundaries[1:-1]],
+    }
+
+
+def select_keyframe_times(cut_frames: np.ndarray, frame_count: int, fps: float, max_keyframes: int) -> List[float]:
+    """
+    Моменты ключевых кадров: середина каждой сцены
+    
+    Если сцен больше max_keyframes, сцены выбираются равномерно по ролику.
+    """
+    boundaries = np.concatenate(([0], cut_frames, [frame_count])) / fps
+    middles = (boundaries[:-1] + boundaries[1:]) / 2
+    
+    if len(middles) > max_keyframes:
+        indexes = np.unique(np.linspace(0, len(middles) - 1, max_keyframes).round().astype(int))
+        middles = middles[indexes]
+    
+    return [round(float(t), 2) for t in middles]
+
+
+def extract_keyframe(path: str, time_sec: float, output_path: str, height: int) -> str:
+    """Сохранение одного кадра в JPEG"""
+    run_ffmpeg([
+        '-y', '-v', 'error', '-ss', f'{time_sec:.2f}', '-i', path,
+        '-frames:v', '1', '-vf', f"scale=-2:'min({height},ih)'", '-q:v', '4',
+        output_path,
+    ])
+    return output_path
+
+
+def extract_audio(path: str, output_path: str) -> Optional[str]:
+    """
+    Извлечение звуковой дорожки (моно, 16 кГц)
+    
+    Returns:
+        Путь к файлу или None, если в видео нет звука
+    """
+    try:
+        run_ffmpeg([
+            '-y', '-v', 'error', '-i', path,
+            '-vn', '-ac', '1', '-ar', '16000', '-c:a', 'aac', '-b:a', '48k',
+            output_path,
+        ])
+    except TranscodeError:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return None
+    
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return None
+    return output_path
+
+
+def preprocess_video(path: str, output_dir: str) -> Dict[str, Any]:
+    """
+    Предобработка видео для анализа: склейки, метрики монтажа, ключевые кадры и звук
+    
+    Args:
+        path: Путь к видео
+        output_dir: Директория для ключевых кадров и звука
+    
+    Returns:
+        {
+            'stats': метрики монтажа (compute_montage_stats),
+            'keyframes': [{'path': ..., 'time': секунды, 'mimeType': 'image/jpeg'}, ...],
+            'audio': {'path': ..., 'mimeType': 'audio/mp4'} или None
+        }
+    """
+    fps = settings.SCENE_DETECTION_FPS
+    frames = decode_gray_frames(path, fps, settings.SCENE_DETECTION_FRAME_WIDTH, settings.SCENE_DETECTION_FRAME_HEIGHT)
+    if len(frames) == 0:
+        raise TranscodeError(f"Не удалось декодировать кадры видео: {path}")
+    
+    min_scene_frames = max(int(round(settings.SCENE_DETECTION_MIN_SCENE_SECONDS * fps)), 1)
+    cut_frames = detect_cuts(frame_differences(frames), settings.SCENE_DETECTION_THRESHOLD, min_scene_frames)
+    stats = compute_montage_stats(cut_frames, len(frames), fps)
+    
+    os.makedirs(output_dir, exist_ok=True)
+    keyframes = []
+    for index, time_sec in enumerate(select_keyframe_times(cut_frames, len(frames), fps, settings.SCENE_DETECTION_MAX_KEYFRAMES)):
+        frame_path = extract_keyframe(
+            path, time_sec, os.path.join(output_dir, f'keyframe_{index:03d}.jpg'), settings.SCENE_DETECTION_KEYFRAME_HEIGHT
+        )
+        keyframes.append({'path': frame_path, 'time': time_sec, 'mimeType': 'image/jpeg'})
+    
+    audio_path = extract_audio(path, os.path.join(output_dir, 'audio.m4a'))
+    
+    return {
+        'stats': stats,
+        'keyframes': keyframes,
+        'audio': {'path': audio_path, 'mimeType': 'audio/mp4'} if audio_path else None,
+    }
+
+
+def aggregate_montage_stats(stats_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Средние метрики монтажа по нескольким видео (для паспорта стиля)"""
+    stats_list = [stats for stats in stats_list if stats]
+    if not stats_list:
+        return {}
+    
+    total_duration = sum(stats['duration'] for stats in stats_list)
+    total_shots = sum(stats['shot_count'] for stats in stats_list)
+    total_cuts = sum(stats['cut_count'] for stats in stats_list)
+    
+    return {
+        'videos': len(stats_list),
+        'avg_cut_count': round(total_cuts / len(stats_list), 2),
+        'avg_shot_length': round(total_duration / total_shots, 2) if total_shots else 0.0,
+        'cuts_per_minute': round(total_cuts / total_duration * 60, 2) if total_duration else 0.0,
+        'min_shot_length': min(stats['min_shot_length'] for stats in stats_list),
+        'max_shot_length': max(stats['max_shot_length'] for stats in stats_list),
+    }
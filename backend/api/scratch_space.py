@@ -0,0 +1,204 @@
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from django.conf import settings
+
+
+# Файл-метка в рабочей директории: какой процесс ее создал и когда
+OWNER_MARKER = '.owner'
+
+
+class ScratchSpaceFull(Exception):
+    """В рабочем пространстве не освободилось место за SCRATCH_WAIT_TIMEOUT"""
+    pass
+
+
+# Место, зарезервированное скачиваниями этого процесса, которые еще не записали файлы на диск
+_reserved_bytes = 0
+_reserved_condition = threading.Condition()
+
+# Обход дерева рабочего пространства дорогой, поэтому занятое место переиспользуется столько секунд
+USAGE_CACHE_TTL = 2.0
+_usage_cache = (None, 0.0, 0)
+
+
+def get_scratch_root() -> str:
+    """Корневая директория рабочего пространства (создается при первом обращении)"""
+    root = str(settings.SCRATCH_ROOT)
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+def _path_size(path: str) -> int:
+    """Размер файла или директории на диске"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            if filename == OWNER_MARKER:
+                # Метки владельцев - служебные файлы, место под скачивания они не занимают
+                continue
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                # Файл удален, пока мы считали размер
+                pass
+    return total
+
+
+def get_usage(max_age: float = 0) -> int:
+    """
+    Занятое место в рабочем пространстве (все процессы на этом томе)
+    
+    Args:
+        max_age: Сколько секунд можно использовать прошлый результат вместо обхода дерева
+    """
+    global _usage_cache
+    root = get_scratch_root()
+    cached_root, checked_at, usage = _usage_cache
+    now = time.monotonic()
+    if max_age and cached_root == root and now - checked_at < max_age:
+        return usage
+    
+    usage = _path_size(root)
+    _usage_cache = (root, now, usage)
+    return usage
+
+
+@contextmanager
+def job_directory(name: str) -> Iterator[str]:
+    """
+    Рабочая директория задачи, удаляется вместе со всем содержимым при выходе
+    (в том числе при ошибке - с недокачанными фрагментами yt-dlp)
+    
+    Args:
+        name: Понятная часть имени директории (например, analysis-<id>)
+    """
+    path = os.path.join(get_scratch_root(), f"{name}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(path)
+    with open(os.path.join(path, OWNER_MARKER), 'w') as f:
+        json.dump({'host': socket.gethostname(), 'pid': os.getpid(), 'created_at': time.time()}, f)
+    
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def reserve(nbytes: Optional[int] = None) -> Iterator[None]:
+    """
+    Резервирование места перед скачиванием (обратное давление)
+    
+    Если занятое место вместе с резервами этого процесса и новым скачиванием превышает
+    SCRATCH_QUOTA_BYTES, скачивание ждет, пока другие задачи освободят место. Скачивание
+    больше квоты пропускается, только когда рабочее пространство пустое, чтобы такое видео
+    не блокировало очередь навсегда. Занятое место пересчитывается не чаще раза в USAGE_CACHE_TTL.
+    
+    Args:
+        nbytes: Ожидаемый размер (по умолчанию SCRATCH_DOWNLOAD_RESERVE_BYTES)
+    
+    Raises:
+        ScratchSpaceFull: Место не освободилось за SCRATCH_WAIT_TIMEOUT секунд
+    """
+    global _reserved_bytes
+    nbytes = nbytes or settings.SCRATCH_DOWNLOAD_RESERVE_BYTES
+    deadline = time.monotonic() + settings.SCRATCH_WAIT_TIMEOUT
+    
+    with _reserved_condition:
+        while True:
+            used = get_usage(max_age=USAGE_CACHE_TTL) + _reserved_bytes
+            if used + nbytes <= settings.SCRATCH_QUOTA_BYTES or used == 0:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ScratchSpaceFull(
+                    f"Нет места для скачивания: занято {used} из {settings.SCRATCH_QUOTA_BYTES} байт"
+                )
+            # Место освобождается и другими процессами, поэтому проверяем периодически
+            _reserved_condition.wait(timeout=min(remaining, 5))
+        _reserved_bytes += nbytes
+    
+    try:
+        yield
+    finally:
+        with _reserved_condition:
+            _reserved_bytes -= nbytes
+            _reserved_condition.notify_all()
+
+
+def _read_owner(path: str) -> Optional[Dict]:
+    """Метка владельца рабочей директории"""
+    try:
+        with open(os.path.join(path, OWNER_MARKER)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_process_alive(pid: int) -> bool:
+    """Проверка, что процесс с таким pid еще работает (на этом хосте)"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep(max_age: Optional[int] = None) -> Dict[str, int]:
+    """
+    Удаление брошенных рабочих директорий и временных файлов
+    
+    Удаляется то, что старше max_age секунд и чей владелец не работает: процесс
+    этого хоста завершился или метки владельца нет. Директории живых процессов
+    (и процессов других хостов) удаляются, только если они старше max_age
+    в четыре раза (зависшие задачи).
+    
+    Returns:
+        {'removed': количество удаленных записей, 'freed_bytes': освобождено байт}
+    """
+    max_age = settings.SCRATCH_ORPHAN_TTL if max_age is None else max_age
+    root = get_scratch_root()
+    hostname = socket.gethostname()
+    now = time.time()
+    removed = 0
+    freed = 0
+    
+    for entry in os.scandir(root):
+        try:
+            age = now - entry.stat().st_mtime
+        except OSError:
+            continue
+        
+        owner = _read_owner(entry.path) if entry.is_dir() else None
+        if owner:
+            age = now - owner.get('created_at', now)
+            # Процессы других хостов на общем томе проверить нельзя - считаем их живыми
+            owner_alive = owner.get('host') != hostname or _is_process_alive(owner.get('pid', 0))
+            if age < max_age or (owner_alive and age < max_age * 4):
+                continue
+        elif age < max_age:
+            continue
+        
+        size = _path_size(entry.path)
+        if entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+        removed += 1
+        freed += size
+    
+    return {'removed': removed, 'freed_bytes': freed}
@@ -0,0 +1,189 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from .gemini_service import GeminiService
+
+
+def normalize_topic(topic: str) -> str:
+    """Тема без различий в регистре, пробелах и знаках препинания по краям"""
+    return re.sub(r'\s+', ' ', topic).strip().strip('.,!?;:"\'«»').strip().casefold()
+
+
+def script_cache_key(
+    topic: str,
+    style_passport: Dict,
+    patterns: List[Dict],
+    transcript: Optional[List[Dict[str, str]]] = None
+) -> str:
+    """
+    Ключ кеша сценария: нормализованная тема, отпечаток ДНК анализа (паспорт стиля, паттерны
+    и транскрипт), модель, температура и версия промпта
+    """
+    dna = hashlib.sha256(
+        json.dumps(
+            {'style_passport': style_passport, 'patterns': patterns, 'transcript': transcript or []},
+            sort_keys=True,
+            ensure_ascii=False
+        ).encode('utf-8')
+    ).hexdigest()
+    payload = {
+        'topic': normalize_topic(topic),
+        'dna': dna,
+        'model': GeminiService.SCRIPT_MODEL,
+        'temperature': GeminiService.SCRIPT_TEMPERATURE,
+        'prompt_version': GeminiService.SCRIPT_PROMPT_VERSION,
+    }
+    return 'script:' + hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def lookup(key: str, regenerate: bool = False) -> Optional[List[Dict[str, str]]]:
+    """
+    Сценарий из кеша
+    
+    Запись хранит текущий вариант ('current') и заранее сгенерированные альтернативы ('pending').
+    Обычный запрос получает текущий вариант, перегенерация - следующую альтернативу,
+    которая становится текущей.
+    
+    Returns:
+        Сегменты сценария или None (нужна генерация)
+    """
+    cache = caches[settings.SCRIPT_CACHE_ALIAS]
+    entry = cache.get(key)
+    if not entry:
+        return None
+    
+    if not regenerate:
+        return entry['current']
+    
+    if not entry['pending']:
+        return None
+    
+    entry = {'current': entry['pending'][0], 'pending': entry['pending'][1:]}
+    cache.set(key, entry)
+    return entry['current']
+
+
+def store(key: str, variants: List[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    """
+    Сохранение сгенерированных вариантов: первый становится текущим, остальные ждут перегенерации
+    
+    Returns:
+        Текущий вариант
+    """
+    caches[settings.SCRIPT_CACHE_ALIAS].set(key, {'current': variants[0], 'pending': variants[1:]})
+    return variants[0]
+
+
+def collect_variants(results: List[Any]) -> List[List[Dict[str, str]]]:
+    """
+    Успешные варианты из результатов параллельной генерации (результат или исключение)
+    
+    Raises:
+        Исключение первого варианта, если ни один вариант не сгенерирован
+    """
+    variants = [result for result in results if isinstance(result, list) and result]
+    if not variants:
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+        # Модель вернула пустой сценарий - не кешируем, но и не считаем ошибкой
+        return [[]]
+    return variants
+
+
+def generate_script_cached(
+    gemini_service: GeminiService,
+    topic: str,
+    style_passport: Dict,
+    patterns: List[Dict],
+    transcript: Optional[List[Dict[str, str]]] = None,
+    cached_content: Optional[str] = None,
+    variants: int = 1,
+    regenerate: bool = False
+) -> Tuple[List[Dict[str, str]], bool]:
+    """
+    Генерация сценария через кеш
+    
+    При промахе генерируется сразу variants вариантов (параллельно): первый возвращается,
+    остальные сохраняются, и следующие перегенерации отдаются из кеша без запроса к модели.
+    
+    Args:
+        gemini_service: Сервис Gemini
+        topic: Тема сценария
+        style_passport: Паспорт стиля анализа
+        patterns: Паттерны анализа
+        transcript: Транскрипт анализа
+        cached_content: Имя кеша контекста Gemini с ДНК (context_cache.get_script_context)
+        variants: Сколько вариантов сгенерировать при промахе
+        regenerate: Нужен другой вариант, а не тот, что уже выдавался
+    
+    Returns:
+        (сегменты сценария, взят ли результат из кеша)
+    """
+    key = script_cache_key(topic, style_passport, patterns, transcript)
+    cached = lookup(key, regenerate)
+    if cached is not None:
+        return cached, True
+    
+    def _generate(_):
+        try:
+            return gemini_service.generate_script(
+                topic=topic,
+                style_passport=style_passport,
+                patterns=patterns,
+                transcript=transcript,
+                cached_content=cached_content
+            )
+        except Exception as e:
+            return e
+    
+    # Контекст копируется в каждый поток, чтобы замеры вызовов были привязаны к сценарию
+    with ThreadPoolExecutor(max_workers=variants) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, _generate, index) for index in range(variants)]
+        results = [future.result() for future in futures]
+    
+    generated = collect_variants(results)
+    if not generated[0]:
+        return generated[0], False
+    return store(key, generated), False
+
+
+async def agenerate_script_cached(
+    gemini_service,
+    topic: str,
+    style_passport: Dict,
+    patterns: List[Dict],
+    transcript: Optional[List[Dict[str, str]]] = None,
+    cached_content: Optional[str] = None,
+    variants: int = 1,
+    regenerate: bool = False
+) -> Tuple[List[Dict[str, str]], bool]:
+    """Генерация сценария через кеш с AsyncGeminiService (см. generate_script_cached)"""
+    key = script_cache_key(topic, style_passport, patterns, transcript)
+    cached = await sync_to_async(lookup)(key, regenerate)
+    if cached is not None:
+        return cached, True
+    
+    results = await asyncio.gather(*[
+        gemini_service.generate_script(
+            topic=topic,
+            style_passport=style_passport,
+            patterns=patterns,
+            transcript=transcript,
+            cached_content=cached_content
+        )
+        for _ in range(variants)
+    ], return_exceptions=True)
+    
+    generated = collect_variants(results)
+    if not generated[0]:
+        return generated[0], False
+    return await sync_to_async(store)(key, generated), False
@@ -0,0 +1,111 @@
+import json
+from typing import Any, Dict, Iterable, Iterator, Optional
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from .models import Analysis, Script, ScriptSegment
+from .serializers import ScriptSerializer, ScriptSegmentSerializer
+from .instrumentation import call_context
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Событие Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)}\n\n"
+
+
+def sse_response(events) -> StreamingHttpResponse:
+    """
+    Потоковый ответ text/event-stream
+    
+    Args:
+        events: Итератор или асинхронный итератор строк событий (sse_event)
+    """
+    response = StreamingHttpResponse(events, content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    # nginx не должен буферизовать ответ, иначе сегменты придут одним куском в конце
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class ScriptStreamWriter:
+    """
+    Сохранение сценария по мере потоковой генерации
+    
+    Сценарий создается со статусом generating до первого сегмента, каждый сегмент
+    сохраняется сразу после получения. Методы синхронные (работа с БД), асинхронные
+    эндпоинты вызывают их через sync_to_async.
+    """
+    
+    def __init__(self, analysis: Analysis, topic: str, request=None):
+        self.analysis = analysis
+        self.topic = topic
+        self.context = {'request': request}
+        self.script: Optional[Script] = None
+        self.count = 0
+    
+    def start(self) -> Dict[str, Any]:
+        """Создание сценария, возвращает данные события script"""
+        self.script = Script.objects.create(
+            analysis=self.analysis,
+            analysis_version_id=self.analysis.current_version_id,
+            topic=self.topic,
+            status='generating'
+        )
+        return {'id': self.script.id, 'topic': self.script.topic, 'status': self.script.status}
+    
+    def append(self, segment_data: Dict[str, str]) -> Dict[str, Any]:
+        """Сохранение очередного сегмента, возвращает данные события segment"""
+        segment = ScriptSegment.objects.create(
+            script=self.script,
+            timeframe=segment_data.get('timeframe', ''),
+            visual=segment_data.get('visual', ''),
+            audio=segment_data.get('audio', ''),
+            order=self.count
+        )
+        self.count += 1
+        return ScriptSegmentSerializer(segment, context=self.context).data
+    
+    def finish(self, error: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Завершение генерации
+        
+        Уже сохраненные сегменты остаются и при ошибке: сценарий получает статус error
+        с текстом ошибки, клиент может показать частичный результат или повторить генерацию.
+        
+        Returns:
+            Данные события done (сценарий целиком) или error
+        """
+        self.script.status = 'error' if error else 'ready'
+        self.script.error_message = error or ''
+        self.script.save(update_fields=['status', 'error_message', 'updated_at'])
+        
+        if error:
+            return {'id': self.script.id, 'error': error, 'segments_saved': self.count}
+        return ScriptSerializer(self.script, context=self.context).data
+
+
+def stream_script_events(writer: ScriptStreamWriter, segments: Iterable[Dict[str, str]]) -> Iterator[str]:
+    """
+    События потоковой генерации: script, затем segment на каждый сегмент, в конце done или error
+    
+    Args:
+        writer: Сохранение сценария
+        segments: Итератор сегментов (GeminiService.generate_script_stream)
+    """
+    yield sse_event('script', writer.start())
+    
+    finished = False
+    # Генерация начинается при первом чтении сегментов, к этому моменту сценарий уже создан
+    with call_context(analysis_id=writer.analysis.id, script_id=writer.script.id):
+        try:
+            for segment_data in segments:
+                yield sse_event('segment', writer.append(segment_data))
+            finished = True
+            yield sse_event('done', writer.finish())
+        except Exception as e:
+            finished = True
+            yield sse_event('error', writer.finish(f'Ошибка генерации сценария: {str(e)}'))
+        finally:
+            if not finished:
+                # Клиент отключился - генерация прервана, сценарий не должен остаться в generating
+                writer.finish('Генерация прервана: клиент отключился')
@@ -1,12 +1,17 @@
+import uuid
 from rest_framework import serializers
-from .models import Analysis, AnalysisSource, Script, ScriptSegment, MediaFile
+from django.conf import settings
+from .models import Analysis, AnalysisBatch, AnalysisSource, AnalysisVersion, Upload, Script, ScriptSegment, MediaFile, UpstreamCall, Voiceover, VoiceoverSegment
 
 
 class AnalysisSourceSerializer(serializers.ModelSerializer):
     """Сериализатор для источников анализа"""
     class Meta:
         model = AnalysisSource
-        fields = ['id', 'source_type', 'label', 'url', 'file', 'file_mime_type', 'created_at']
+        fields = [
+            'id', 'source_type', 'label', 'url', 'file', 'file_mime_type', 'proxy_file', 'transcript',
+            'download_status', 'error_message', 'download_wait_seconds', 'download_attempts', 'created_at'
+        ]
         read_only_fields = ['id', 'created_at']
 
 
@@ -53,6 +58,42 @@ class MediaFileSerializer(serializers.ModelSerializer):
         return None
 
 
+class VoiceoverSegmentSerializer(serializers.ModelSerializer):
+    """Сериализатор для озвучки сегмента"""
+    audio_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = VoiceoverSegment
+        fields = ['id', 'segment', 'order', 'start_ms', 'duration_ms', 'chunk_count', 'audio_url']
+    
+    def get_audio_url(self, obj):
+        request = self.context.get('request')
+        if request:
+            return request.build_absolute_uri(obj.audio_file.url)
+        return obj.audio_file.url
+
+
+class VoiceoverSerializer(serializers.ModelSerializer):
+    """Сериализатор для озвучки сценария"""
+    audio_url = serializers.SerializerMethodField()
+    segments = VoiceoverSegmentSerializer(many=True, read_only=True)
+    
+    class Meta:
+        model = Voiceover
+        fields = [
+            'id', 'script', 'status', 'error_message', 'audio_url', 'duration_ms',
+            'segments', 'created_at', 'updated_at'
+        ]
+    
+    def get_audio_url(self, obj):
+        if obj.audio_file:
+            request = self.context.get('request')
+            if request:
+                return request.build_absolute_uri(obj.audio_file.url)
+            return obj.audio_file.url
+        return None
+
+
 class ScriptSegmentSerializer(serializers.ModelSerializer):
     """Сериализатор для сегментов сценария"""
     media = serializers.SerializerMethodField()
@@ -115,10 +156,12 @@ class ScriptSegmentSerializer(serializers.ModelSerializer):
 class ScriptSerializer(serializers.ModelSerializer):
     """Сериализатор для сценария"""
     segments = ScriptSegmentSerializer(many=True, read_only=True)
+    # Номер версии ДНК анализа, по которой сгенерирован сценарий
+    analysis_version = serializers.IntegerField(source='analysis_version.number', read_only=True, default=None)
     
     class Meta:
         model = Script
-        fields = ['id', 'topic', 'segments', 'created_at', 'updated_at']
+        fields = ['id', 'topic', 'status', 'error_message', 'analysis_version', 'segments', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 
@@ -126,12 +169,14 @@ class AnalysisSerializer(serializers.ModelSerializer):
     """Сериализатор для анализа"""
     sources = AnalysisSourceSerializer(many=True, read_only=True)
     scripts = ScriptSerializer(many=True, read_only=True)
+    # Номер текущей версии ДНК
+    version = serializers.IntegerField(source='current_version.number', read_only=True, default=None)
     
     class Meta:
         model = Analysis
         fields = [
-            'id', 'status', 'transcript', 'style_passport', 'patterns', 
-            'grounding_sources', 'sources', 'scripts', 'created_at', 'updated_at'
+            'id', 'status', 'error_message', 'transcript', 'style_passport', 'patterns', 
+            'grounding_sources', 'cloned_from', 'version', 'sources', 'scripts', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
 
@@ -140,16 +185,191 @@ class AnalysisCreateSerializer(serializers.Serializer):
     """Сериализатор для создания анализа"""
     sources = serializers.ListField(
         child=serializers.DictField(),
-        help_text="Список источников: [{'type': 'url', 'value': '...', 'label': '...'}, ...]"
+        help_text="Список источников: [{'type': 'url', 'value': '...', 'label': '...'}, ...]. "
+                  "Завершенная загрузка: {'type': 'upload', 'value': '<upload_id>', 'label': '...'}"
+    )
+    force_refresh = serializers.BooleanField(
+        default=False,
+        help_text="Выполнить анализ заново, даже если такой же набор видео уже анализировался"
     )
+    keep_original = serializers.BooleanField(
+        default=settings.ANALYSIS_KEEP_ORIGINAL,
+        help_text="Скачать и сохранить видео в исходном качестве (в Gemini передается легкая копия)"
+    )
+    
+    def validate_sources(self, sources):
+        """Проверка, что все упомянутые загрузки существуют и завершены"""
+        for source in sources:
+            if source.get('type') != 'upload':
+                continue
+            upload = Upload.objects.filter(id=source.get('value')).first() if _is_uuid(source.get('value')) else None
+            if upload is None:
+                raise serializers.ValidationError(f"Загрузка {source.get('value')} не найдена")
+            if upload.status != 'complete':
+                raise serializers.ValidationError(f"Загрузка {upload.id} еще не завершена")
+        return sources
 
 
-class ScriptCreateSerializer(serializers.Serializer):
-    """Сериализатор для создания сценария"""
+class AnalysisSourcesAddSerializer(AnalysisCreateSerializer):
+    """Сериализатор для добавления источников в существующий анализ"""
+    sources = serializers.ListField(
+        child=serializers.DictField(),
+        min_length=1,
+        help_text="Новые источники в формате POST /api/analyses/"
+    )
+    force_refresh = serializers.BooleanField(
+        default=False,
+        help_text="Проанализировать заново все видео, а не только новые"
+    )
+
+
+class AnalysisVersionSerializer(serializers.ModelSerializer):
+    """Сериализатор для версии ДНК анализа"""
+    scripts = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    
+    class Meta:
+        model = AnalysisVersion
+        fields = [
+            'id', 'number', 'transcript', 'style_passport', 'patterns', 'grounding_sources',
+            'sources', 'scripts', 'created_at'
+        ]
+        read_only_fields = fields
+
+
+class AnalysisBatchCreateSerializer(serializers.Serializer):
+    """Сериализатор для отправки пакета анализов"""
+    analyses = AnalysisCreateSerializer(
+        many=True,
+        help_text="Список анализов, каждый в формате POST /api/analyses/: [{'sources': [...], 'force_refresh': false}, ...]"
+    )
+    
+    def validate_analyses(self, analyses):
+        if not analyses:
+            raise serializers.ValidationError("Пакет не может быть пустым")
+        if len(analyses) > settings.ANALYSIS_BATCH_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"В пакете не больше {settings.ANALYSIS_BATCH_MAX_SIZE} анализов"
+            )
+        return analyses
+
+
+class AnalysisSourceProgressSerializer(serializers.ModelSerializer):
+    """Состояние источника в статусе пакета"""
+    class Meta:
+        model = AnalysisSource
+        fields = ['id', 'label', 'url', 'download_status', 'error_message']
+        read_only_fields = fields
+
+
+class AnalysisProgressSerializer(serializers.ModelSerializer):
+    """Состояние анализа в статусе пакета (без результатов анализа)"""
+    sources = AnalysisSourceProgressSerializer(many=True, read_only=True)
+    
+    class Meta:
+        model = Analysis
+        fields = ['id', 'status', 'error_message', 'cloned_from', 'sources', 'created_at', 'updated_at']
+        read_only_fields = fields
+
+
+class AnalysisBatchSerializer(serializers.ModelSerializer):
+    """Статус пакета анализов: сводка и состояние каждого анализа"""
+    analyses = AnalysisProgressSerializer(many=True, read_only=True)
+    summary = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = AnalysisBatch
+        fields = ['id', 'summary', 'analyses', 'created_at']
+        read_only_fields = fields
+    
+    def get_summary(self, obj):
+        """Количество анализов по статусам и доля завершенных (ready или error)"""
+        analyses = list(obj.analyses.all())
+        counts = {}
+        for analysis in analyses:
+            counts[analysis.status] = counts.get(analysis.status, 0) + 1
+        finished = counts.get('ready', 0) + counts.get('error', 0)
+        
+        return {
+            'total': len(analyses),
+            'counts': counts,
+            'finished': finished,
+            'progress': round(finished / len(analyses), 3) if analyses else 1.0,
+            'is_finished': finished == len(analyses),
+        }
+
+
+def _is_uuid(value) -> bool:
+    """Проверка, что значение - UUID"""
+    try:
+        uuid.UUID(str(value))
+    except ValueError:
+        return False
+    return True
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    """Сериализатор для загрузки файла частями"""
+    class Meta:
+        model = Upload
+        fields = [
+            'id', 'filename', 'mime_type', 'total_size', 'received_size',
+            'status', 'checksum', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+
+class UploadCreateSerializer(serializers.Serializer):
+    """Сериализатор для начала загрузки"""
+    filename = serializers.CharField(max_length=500)
+    mime_type = serializers.CharField(max_length=100, default='video/mp4')
+    total_size = serializers.IntegerField(min_value=1)
+    
+    def validate_total_size(self, value):
+        if value > settings.UPLOAD_MAX_FILE_BYTES:
+            raise serializers.ValidationError(
+                f"Файл больше допустимого размера ({settings.UPLOAD_MAX_FILE_BYTES} байт)"
+            )
+        return value
+
+
+class UploadCompleteSerializer(serializers.Serializer):
+    """Сериализатор для завершения загрузки"""
+    checksum = serializers.RegexField(
+        regex=r'^[0-9a-fA-F]{64}$',
+        help_text="SHA-256 содержимого файла в hex"
+    )
+
+
+class ScriptStreamCreateSerializer(serializers.Serializer):
+    """Сериализатор для потокового создания сценария (без кеша сценариев)"""
     analysis_id = serializers.UUIDField()
     topic = serializers.CharField(max_length=500)
 
 
+class ScriptCreateSerializer(ScriptStreamCreateSerializer):
+    """Сериализатор для создания сценария"""
+    use_cache = serializers.BooleanField(
+        default=False,
+        help_text="Взять сценарий из кеша, если по этой теме и ДНК анализа он уже генерировался"
+    )
+    variants = serializers.IntegerField(
+        default=1,
+        min_value=1,
+        help_text="Сколько вариантов сгенерировать при промахе кеша (остальные отдаются при перегенерации)"
+    )
+    regenerate = serializers.BooleanField(
+        default=False,
+        help_text="Нужен другой вариант сценария, а не тот, что уже выдавался из кеша"
+    )
+    
+    def validate_variants(self, variants):
+        if variants > settings.SCRIPT_CACHE_MAX_VARIANTS:
+            raise serializers.ValidationError(
+                f"Не больше {settings.SCRIPT_CACHE_MAX_VARIANTS} вариантов"
+            )
+        return variants
+
+
 class ScriptSegmentCreateSerializer(serializers.Serializer):
     """Сериализатор для создания сегментов сценария"""
     script_id = serializers.UUIDField()
@@ -157,3 +377,15 @@ class ScriptSegmentCreateSerializer(serializers.Serializer):
         child=serializers.DictField(),
         help_text="Список сегментов: [{'timeframe': '...', 'visual': '...', 'audio': '...'}, ...]"
     )
+
+
+class UpstreamCallSerializer(serializers.ModelSerializer):
+    """Сериализатор для замеров вызовов внешних API"""
+    class Meta:
+        model = UpstreamCall
+        fields = [
+            'id', 'service', 'operation', 'model', 'analysis_id', 'script_id', 'started_at', 'duration_ms',
+            'retries', 'input_tokens', 'output_tokens', 'cached_tokens', 'request_bytes', 'response_bytes',
+            'cost_usd', 'outcome', 'error'
+        ]
+        read_only_fields = fields
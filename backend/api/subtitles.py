@@ -0,0 +1,116 @@
+import html
+import re
+from typing import List, Dict, Any, Optional
+
+
+# 00:01:02.345 --> 00:01:04.000 (в SRT миллисекунды отделяются запятой, часы могут отсутствовать)
+TIMING_RE = re.compile(
+    r'(?P<start>(?:\d+:)?\d{1,2}:\d{2}[.,]\d{1,3})\s*-->\s*(?P<end>(?:\d+:)?\d{1,2}:\d{2}[.,]\d{1,3})'
+)
+TAG_RE = re.compile(r'<[^>]+>')
+
+# Форматы субтитров, которые умеет разбирать parse_subtitles, в порядке предпочтения
+SUPPORTED_FORMATS = ['vtt', 'srt']
+
+
+def parse_timestamp(value: str) -> float:
+    """Таймкод субтитров в секунды"""
+    parts = value.replace(',', '.').split(':')
+    seconds = float(parts[-1])
+    minutes = int(parts[-2])
+    hours = int(parts[-3]) if len(parts) > 2 else 0
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def format_timestamp(seconds: float) -> str:
+    """Секунды в таймкод транскрипта (MM:SS.ss или H:MM:SS.ss)"""
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{int(hours)}:{int(minutes):02d}:{secs:05.2f}"
+    return f"{int(minutes):02d}:{secs:05.2f}"
+
+
+def parse_subtitles(text: str) -> List[Dict[str, str]]:
+    """
+    Разбор субтитров WebVTT или SRT в сегменты транскрипта
+    
+    Автоматические субтитры YouTube повторяют предыдущую строку в каждой реплике
+    ("накатывающиеся" субтитры), поэтому строки, уже бывшие в предыдущей реплике,
+    отбрасываются, а реплики без нового текста пропускаются.
+    
+    Returns:
+        [{'start': ..., 'end': ..., 'text': ...}, ...] (формат TranscriptSegment)
+    """
+    # Реплики разбираются по строкам с таймкодами: в автоматических субтитрах YouTube
+    # внутри реплики бывают строки из пробелов, поэтому делить по пустым строкам нельзя
+    cues = []
+    for line in text.splitlines():
+        timing = TIMING_RE.search(line)
+        if timing:
+            # Номер реплики SRT стоит строкой выше таймкода
+            if cues and cues[-1][1] and cues[-1][1][-1].strip().isdigit():
+                cues[-1][1].pop()
+            cues.append((timing, []))
+        elif cues:
+            cues[-1][1].append(line)
+    
+    segments = []
+    previous_lines = []
+    
+    for timing, lines in cues:
+        cue_lines = [html.unescape(TAG_RE.sub('', line)).strip() for line in lines]
+        cue_lines = [line for line in cue_lines if line]
+        
+        new_lines = [line for line in cue_lines if line not in previous_lines]
+        if cue_lines:
+            previous_lines = cue_lines
+        if not new_lines:
+            continue
+        
+        segments.append({
+            'start': format_timestamp(parse_timestamp(timing.group('start'))),
+            'end': format_timestamp(parse_timestamp(timing.group('end'))),
+            'text': ' '.join(new_lines),
+        })
+    
+    return segments
+
+
+def select_subtitle_track(info: Dict[str, Any], languages: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Выбор дорожки субтитров из результата yt-dlp extract_info
+    
+    Порядок: ручные субтитры на одном из языков languages, автоматические субтитры
+    на языке оригинала (YouTube помечает их суффиксом -orig), автоматические
+    субтитры на одном из языков languages. Автоматические переводы на другие языки
+    не используются.
+    
+    Returns:
+        Формат дорожки yt-dlp ({'url': ..., 'ext': ...} или с готовым 'data') или None
+    """
+    manual = info.get('subtitles') or {}
+    automatic = info.get('automatic_captions') or {}
+    
+    def _matching(tracks: Dict[str, Any], language: str) -> List[str]:
+        return [key for key in tracks if key == language or key.startswith(f"{language}-")]
+    
+    candidates = []
+    for language in languages:
+        candidates += [manual[key] for key in _matching(manual, language)]
+    candidates += [formats for key, formats in automatic.items() if key.endswith('-orig')]
+    for language in languages:
+        candidates += [automatic[key] for key in automatic if key == language]
+    
+    for formats in candidates:
+        for ext in SUPPORTED_FORMATS:
+            for subtitle_format in formats or []:
+                if subtitle_format.get('ext') == ext and (subtitle_format.get('url') or subtitle_format.get('data')):
+                    return subtitle_format
+    
+    return None
+
+
+def transcript_to_text(transcript: List[Dict[str, str]]) -> str:
+    """Транскрипт в текст для промпта: по строке на сегмент с таймкодами"""
+    return '\n'.join(f"[{segment['start']} - {segment['end']}] {segment['text']}" for segment in transcript)
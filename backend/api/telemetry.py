@@ -0,0 +1,120 @@
+import math
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+from django.db.models import QuerySet
+
+from .models import UpstreamCall
+
+
+# Поля замера, которые читаются для агрегации
+_FIELDS = [
+    'service', 'operation', 'model', 'duration_ms', 'retries', 'input_tokens', 'output_tokens',
+    'cached_tokens', 'request_bytes', 'response_bytes', 'cost_usd', 'outcome',
+]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """
+    Перцентиль с линейной интерполяцией между соседними значениями
+    
+    Args:
+        values: Отсортированные значения
+        p: Перцентиль от 0 до 100
+    """
+    if not values:
+        return None
+    position = (len(values) - 1) * p / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    value = values[lower] + (values[upper] - values[lower]) * (position - lower)
+    return round(value, 1)
+
+
+def _distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p90/p99 и максимум"""
+    values = sorted(values)
+    return {
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': values[-1] if values else None,
+    }
+
+
+def _summarize(calls: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Сводка по группе замеров"""
+    count = len(calls)
+    errors = sum(1 for call in calls if call['outcome'] == 'error')
+    costs = [call['cost_usd'] for call in calls if call['cost_usd'] is not None]
+    
+    def _sum(field: str) -> int:
+        return sum(call[field] or 0 for call in calls)
+    
+    return {
+        'count': count,
+        'errors': errors,
+        'error_rate': round(errors / count, 4) if count else 0.0,
+        'cancelled': sum(1 for call in calls if call['outcome'] == 'cancelled'),
+        'duration_ms': _distribution([call['duration_ms'] for call in calls]),
+        'retries_total': _sum('retries'),
+        'retries_avg': round(_sum('retries') / count, 3) if count else 0.0,
+        'input_tokens': {
+            'total': _sum('input_tokens'),
+            **_distribution([call['input_tokens'] for call in calls if call['input_tokens'] is not None]),
+        },
+        'output_tokens': {
+            'total': _sum('output_tokens'),
+            **_distribution([call['output_tokens'] for call in calls if call['output_tokens'] is not None]),
+        },
+        'cached_tokens': _sum('cached_tokens'),
+        'request_bytes': _sum('request_bytes'),
+        'response_bytes': _sum('response_bytes'),
+        # Стоимость считается только по моделям с тарифом в UPSTREAM_PRICING
+        'cost_usd': round(sum(costs), 6) if costs else None,
+    }
+
+
+def summarize_calls(calls: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Сводка замеров по группам (сервис, операция, модель)
+    
+    Перцентили считаются в Python: выборка за окно небольшая, а SQLite
+    и PostgreSQL считают их по-разному.
+    
+    Returns:
+        Список групп, самые медленные (по p90) первыми
+    """
+    groups: Dict[tuple, List[Dict[str, Any]]] = defaultdict(list)
+    for call in calls:
+        groups[(call['service'], call['operation'], call['model'])].append(call)
+    
+    summary = [
+        {'service': service, 'operation': operation, 'model': model, **_summarize(group)}
+        for (service, operation, model), group in groups.items()
+    ]
+    summary.sort(key=lambda item: item['duration_ms']['p90'] or 0, reverse=True)
+    return summary
+
+
+def summarize_queryset(queryset: QuerySet) -> Dict[str, Any]:
+    """
+    Итоги и сводка по группам для набора замеров (например, всех вызовов одного анализа)
+    
+    Returns:
+        {'totals': сводка по всем вызовам, 'groups': сводка по операциям}
+    """
+    calls = list(queryset.values(*_FIELDS))
+    return {
+        'totals': _summarize(calls),
+        'groups': summarize_calls(calls),
+    }
+
+
+def calls_for(analysis_id=None, script_id=None) -> QuerySet:
+    """Замеры вызовов анализа (включая его сценарии) или сценария"""
+    queryset = UpstreamCall.objects.all()
+    if analysis_id:
+        queryset = queryset.filter(analysis_id=analysis_id)
+    if script_id:
+        queryset = queryset.filter(script_id=script_id)
+    return queryset
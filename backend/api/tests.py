@@ -1,3 +1,1291 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import hashlib
+import itertools
+from datetime import datetime, timedelta, timezone as dt_timezone
+from email.utils import format_datetime
+import json
+import os
+import re
+import shutil
+import tempfile
+from unittest import mock
+import httpx
+import numpy as np
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from google.genai import errors as genai_errors
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from .analysis_cache import compute_fingerprint
+from .analysis_pipeline import download_sources
+from .download_scheduler import DownloadScheduler, TokenBucket
+from .download_cache import DownloadCache
+from .instrumentation import flush_upstream_calls
+from .json_stream import JsonArrayStream
+from .job_queue import AnalysisWorker, claim_next_job, enqueue_analysis, requeue_stale_jobs
+from .kie_service import get_async_http_client
+from .models import Analysis, AnalysisJob, AnalysisSource, CachedDownload, Script, Upload
+from .async_views import _unavailable
+from .context_cache import ensure_context_cache, get_script_context
+from .resilience import (
+    CircuitBreaker, CircuitOpenError, DeadlineExceeded, RetryGuard, UpstreamHTTPError,
+    _gemini_retry_delay, call_with_retries, classify_error, parse_retry_after
+)
+from .gemini_service import GeminiService
+from .scratch_space import OWNER_MARKER, ScratchSpaceFull, get_scratch_root, get_usage, reserve
+from .script_cache import generate_script_cached, normalize_topic, script_cache_key
+from .script_stream import ScriptStreamWriter, stream_script_events
+from .scene_detection import compute_montage_stats, detect_cuts
+from .subtitles import parse_subtitles
+from .telemetry import percentile
+from .views import upstream_unavailable_response
+from .voiceover import split_text
+from .youtube_service import DownloadError, DownloadThrottled, DownloadTransientError, YouTubeService
+
+
+class TempStorageMixin:
+    """Временные MEDIA_ROOT, SCRATCH_ROOT и UPLOAD_PARTIAL_ROOT на время теста"""
+    
+    def setUp(self):
+        super().setUp()
+        self.temp_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_root, ignore_errors=True)
+        override = override_settings(
+            MEDIA_ROOT=os.path.join(self.temp_root, 'media'),
+            SCRATCH_ROOT=os.path.join(self.temp_root, 'scratch'),
+            UPLOAD_PARTIAL_ROOT=os.path.join(self.temp_root, 'uploads_partial'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+    
+    def make_file(self, name: str, data: bytes = b'video') -> str:
+        """Файл во временной директории теста"""
+        directory = tempfile.mkdtemp(dir=self.temp_root)
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+
+class FakeGeminiMixin:
+    """
+    Gemini без сети: анализ возвращает паспорт стиля с подписями источников,
+    упомянутых в запросе (URL вида https://example.com/<подпись>)
+    """
+    
+    def setUp(self):
+        super().setUp()
+        self.gemini_calls = []
+        client = mock.Mock()
+        client.models.generate_content.side_effect = self.generate_content
+        patcher = mock.patch.object(GeminiService, '__init__', lambda service: setattr(service, 'client', client))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Замеры вызовов сохраняются в базу теста, а не после ее удаления
+        self.addCleanup(flush_upstream_calls)
+    
+    def generate_content(self, model, contents, config):
+        labels = sorted(set(re.findall(r'example\.com/(\w+)', str(contents))))
+        self.gemini_calls.append(labels)
+        passport = {
+            'structure': [], 'speech_rate_wpm': 150, 'catchphrases': [], 'fillers': [],
+            'sentiment': '', 'tone_tags': labels, 'visual_context': []
+        }
+        text = json.dumps({'transcript': [], 'stylePassport': passport, 'patterns': []})
+        return mock.Mock(text=text, candidates=[], usage_metadata=None)
+    
+    def url_sources(self, *labels):
+        return [{'type': 'url', 'value': f'https://example.com/{label}', 'label': label} for label in labels]
+    
+    def run_queue(self):
+        """Выполнение всех задач очереди в текущем потоке"""
+        worker = AnalysisWorker(concurrency=1)
+        while True:
+            job = claim_next_job(worker.worker_id)
+            if job is None:
+                break
+            worker.process_job(job)
+
+
+class SceneDetectionTests(SimpleTestCase):
+    """Поиск склеек и метрики монтажа"""
+    
+    def test_detect_cuts_finds_sharp_changes(self):
+        diffs = np.full(40, 0.01, dtype=np.float32)
+        diffs[9] = 0.5
+        diffs[24] = 0.6
+        
+        cuts = detect_cuts(diffs, threshold=0.3, min_scene_frames=5)
+        
+        # Склейка - кадр после скачка разницы
+        self.assertEqual(cuts.tolist(), [10, 25])
+    
+    def test_detect_cuts_drops_cuts_closer_than_min_scene(self):
+        diffs = np.full(40, 0.01, dtype=np.float32)
+        diffs[9] = 0.5
+        diffs[11] = 0.5
+        
+        self.assertEqual(detect_cuts(diffs, threshold=0.3, min_scene_frames=5).tolist(), [10])
+    
+    def test_detect_cuts_ignores_constant_motion(self):
+        # Быстрая камера: разница большая, но не выделяется на фоне соседних кадров
+        diffs = np.full(40, 0.5, dtype=np.float32)
+        
+        self.assertEqual(detect_cuts(diffs, threshold=0.3, min_scene_frames=5).tolist(), [])
+    
+    def test_compute_montage_stats(self):
+        stats = compute_montage_stats(np.array([10, 25]), frame_count=40, fps=2)
+        
+        self.assertEqual(stats['duration'], 20.0)
+        self.assertEqual(stats['cut_count'], 2)
+        self.assertEqual(stats['shot_count'], 3)
+        self.assertEqual(stats['avg_shot_length'], 6.67)
+        self.assertEqual(stats['median_shot_length'], 7.5)
+        self.assertEqual(stats['min_shot_length'], 5.0)
+        self.assertEqual(stats['max_shot_length'], 7.5)
+        self.assertEqual(stats['cuts_per_minute'], 6.0)
+        self.assertEqual(stats['cut_times'], [5.0, 12.5])
+    
+    def test_compute_montage_stats_without_cuts(self):
+        stats = compute_montage_stats(np.zeros(0, dtype=np.int64), frame_count=10, fps=2)
+        
+        self.assertEqual(stats['shot_count'], 1)
+        self.assertEqual(stats['avg_shot_length'], 5.0)
+        self.assertEqual(stats['cuts_per_minute'], 0.0)
+        self.assertEqual(stats['cut_times'], [])
+
+
+class ParseSubtitlesTests(SimpleTestCase):
+    """Разбор субтитров в сегменты транскрипта"""
+    
+    def test_vtt_rolling_captions_keep_only_new_lines(self):
+        text = (
+            "WEBVTT\n"
+            "\n"
+            "00:00:00.000 --> 00:00:02.000\n"
+            "привет <c>всем</c>\n"
+            "\n"
+            "00:00:02.000 --> 00:00:04.000\n"
+            "привет всем\n"
+            "как дела\n"
+            "\n"
+            "00:00:04.000 --> 00:00:05.000\n"
+            "как дела\n"
+        )
+        
+        self.assertEqual(parse_subtitles(text), [
+            {'start': '00:00.00', 'end': '00:02.00', 'text': 'привет всем'},
+            {'start': '00:02.00', 'end': '00:04.00', 'text': 'как дела'},
+        ])
+    
+    def test_srt_with_cue_numbers_and_hours(self):
+        text = (
+            "1\n"
+            "00:00:01,500 --> 00:00:03,000\n"
+            "Первая &amp; строка\n"
+            "\n"
+            "2\n"
+            "01:00:03,000 --> 01:00:05,250\n"
+            "Вторая\n"
+        )
+        
+        self.assertEqual(parse_subtitles(text), [
+            {'start': '00:01.50', 'end': '00:03.00', 'text': 'Первая & строка'},
+            {'start': '1:00:03.00', 'end': '1:00:05.25', 'text': 'Вторая'},
+        ])
+    
+    def test_text_without_cues(self):
+        self.assertEqual(parse_subtitles('WEBVTT\n\n'), [])
+
+
+class PercentileTests(SimpleTestCase):
+    """Перцентили длительности вызовов"""
+    
+    def test_empty(self):
+        self.assertIsNone(percentile([], 50))
+    
+    def test_single_value(self):
+        self.assertEqual(percentile([120.0], 99), 120.0)
+    
+    def test_interpolates_between_neighbours(self):
+        values = [10.0, 20.0, 30.0, 40.0]
+        
+        self.assertEqual(percentile(values, 0), 10.0)
+        self.assertEqual(percentile(values, 50), 25.0)
+        self.assertEqual(percentile(values, 90), 37.0)
+        self.assertEqual(percentile(values, 100), 40.0)
+
+
+class SplitTextTests(SimpleTestCase):
+    """Разбиение текста сегмента для синтеза речи"""
+    
+    def test_short_text_is_one_chunk(self):
+        self.assertEqual(split_text('  Привет,\n мир!  ', 100), ['Привет, мир!'])
+    
+    def test_empty_text(self):
+        self.assertEqual(split_text(' \n ', 100), [])
+    
+    def test_sentences_are_packed_up_to_limit(self):
+        self.assertEqual(split_text('Раз два. Три четыре! Пять?', 20), ['Раз два. Три четыре!', 'Пять?'])
+    
+    def test_long_sentence_is_split_at_commas_then_words(self):
+        text = (
+            'Это очень длинное предложение, которое нужно разрезать по запятым, '
+            'потому что оно не помещается целиком в одну часть, и даже так.'
+        )
+        
+        chunks = split_text(text, 40)
+        
+        self.assertEqual(chunks[0], 'Это очень длинное предложение,')
+        self.assertTrue(all(len(chunk) <= 40 for chunk in chunks))
+        self.assertEqual(' '.join(chunks), text)
+    
+    def test_word_longer_than_limit_is_kept_whole(self):
+        self.assertEqual(split_text('а ' + 'б' * 30, 10), ['а', 'б' * 30])
+
+
+class ComputeFingerprintTests(SimpleTestCase):
+    """Отпечаток набора источников для кеша результатов анализа"""
+    
+    def test_source_order_does_not_matter(self):
+        self.assertEqual(
+            compute_fingerprint(['a', 'b'], map_reduce=False),
+            compute_fingerprint(['b', 'a'], map_reduce=False)
+        )
+    
+    def test_different_sources(self):
+        self.assertNotEqual(
+            compute_fingerprint(['a', 'b'], map_reduce=False),
+            compute_fingerprint(['a'], map_reduce=False)
+        )
+    
+    def test_mode_changes_fingerprint(self):
+        self.assertNotEqual(
+            compute_fingerprint(['a'], map_reduce=False),
+            compute_fingerprint(['a'], map_reduce=True)
+        )
+    
+    @override_settings(ANALYSIS_MODE='map_reduce')
+    def test_mode_defaults_to_setting(self):
+        self.assertEqual(compute_fingerprint(['a']), compute_fingerprint(['a'], map_reduce=True))
+    
+    def test_prompt_version_changes_fingerprint(self):
+        before = compute_fingerprint(['a'], map_reduce=False)
+        with mock.patch.object(GeminiService, 'ANALYSIS_PROMPT_VERSION', GeminiService.ANALYSIS_PROMPT_VERSION + 1):
+            self.assertNotEqual(compute_fingerprint(['a'], map_reduce=False), before)
+
+
+class DownloadCacheTests(TempStorageMixin, TestCase):
+    """Сохранение скачанных видео в кеш и поиск в нем"""
+    
+    def setUp(self):
+        super().setUp()
+        self.cache = DownloadCache(YouTubeService(cookies_file=os.devnull, instagram_cookies_file=os.devnull))
+    
+    def video_data(self, extractor_key: str, video_id: str) -> dict:
+        path = self.make_file(f'{video_id}.mp4')
+        return {
+            'id': video_id,
+            'extractor_key': extractor_key,
+            'file_path': path,
+            'mime_type': 'video/mp4',
+            'file_size': os.path.getsize(path),
+            'title': 'Видео',
+            'duration': 10,
+        }
+    
+    def test_round_trip_for_canonical_url(self):
+        data = self.video_data('Youtube', 'dQw4w9WgXcQ')
+        
+        entry = self.cache.store('https://www.youtube.com/watch?v=dQw4w9WgXcQ', data)
+        
+        self.assertIsNotNone(entry)
+        self.assertFalse(os.path.exists(data['file_path']))
+        # Другая форма ссылки на то же видео попадает в ту же запись
+        found = self.cache.lookup('https://youtu.be/dQw4w9WgXcQ')
+        self.assertEqual(found.id, entry.id)
+        self.assertTrue(found.file.storage.exists(found.file.name))
+    
+    def test_url_without_canonical_id_is_not_stored(self):
+        url = 'https://example.com/video.mp4'
+        data = self.video_data('Generic', 'video')
+        
+        self.assertIsNone(self.cache.store(url, data))
+        
+        # Запись, которую lookup не нашел бы, не создается, файл остается на месте
+        self.assertIsNone(self.cache.lookup(url))
+        self.assertFalse(CachedDownload.objects.exists())
+        self.assertTrue(os.path.exists(data['file_path']))
+
+
+@override_settings(SCRATCH_QUOTA_BYTES=100, SCRATCH_WAIT_TIMEOUT=0)
+class ScratchReserveTests(TempStorageMixin, SimpleTestCase):
+    """Резервирование места в рабочем пространстве перед скачиванием"""
+    
+    def write(self, nbytes: int) -> None:
+        with open(os.path.join(get_scratch_root(), 'video.mp4'), 'wb') as f:
+            f.write(b'0' * nbytes)
+    
+    def fill(self, nbytes: int) -> None:
+        """Файл в рабочем пространстве, занятое место пересчитывается сразу"""
+        self.write(nbytes)
+        get_usage()
+    
+    def test_quota_is_checked_without_own_reservations(self):
+        self.fill(80)
+        
+        with self.assertRaises(ScratchSpaceFull):
+            with reserve(50):
+                pass
+        with reserve(20):
+            pass
+    
+    def test_own_reservations_count_against_quota(self):
+        with reserve(60):
+            with self.assertRaises(ScratchSpaceFull):
+                with reserve(50):
+                    pass
+    
+    def test_oversized_download_only_into_empty_space(self):
+        with reserve(500):
+            pass
+        
+        self.fill(1)
+        with self.assertRaises(ScratchSpaceFull):
+            with reserve(500):
+                pass
+    
+    def test_usage_is_reused_within_max_age(self):
+        self.assertEqual(get_usage(), 0)
+        self.write(10)
+        
+        self.assertEqual(get_usage(max_age=60), 0)
+        self.assertEqual(get_usage(), 10)
+    
+    def test_owner_markers_are_not_counted(self):
+        with open(os.path.join(get_scratch_root(), OWNER_MARKER), 'w') as f:
+            f.write('{}')
+        
+        self.assertEqual(get_usage(), 0)
+
+
+@override_settings(UPLOAD_MAX_CHUNK_BYTES=8)
+class UploadTests(TempStorageMixin, TestCase):
+    """Загрузка файла частями"""
+    
+    CONTENT = b'0123456789abcdef'
+    
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        response = self.client.post('/api/uploads/', {
+            'filename': 'clip.mp4', 'mime_type': 'video/mp4', 'total_size': len(self.CONTENT)
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.upload_id = response.data['id']
+    
+    def put_chunk(self, offset: int, data: bytes):
+        return self.client.put(
+            f'/api/uploads/{self.upload_id}/chunk/?offset={offset}', data, content_type='application/octet-stream'
+        )
+    
+    def complete(self, content: bytes):
+        return self.client.post(
+            f'/api/uploads/{self.upload_id}/complete/',
+            {'checksum': hashlib.sha256(content).hexdigest()},
+            format='json'
+        )
+    
+    def test_wrong_offset_returns_received_size_to_resume_from(self):
+        self.assertEqual(self.put_chunk(0, self.CONTENT[:8]).status_code, 200)
+        
+        # Повтор уже записанной части (клиент не получил ответ) и пропуск части
+        for offset in (0, 12):
+            response = self.put_chunk(offset, self.CONTENT[:4])
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.data['received_size'], 8)
+        
+        response = self.put_chunk(8, self.CONTENT[8:])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['received_size'], len(self.CONTENT))
+    
+    def test_chunk_over_limit(self):
+        response = self.put_chunk(0, self.CONTENT[:9])
+        
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(Upload.objects.get(id=self.upload_id).received_size, 0)
+    
+    def test_complete_moves_file_to_storage(self):
+        self.put_chunk(0, self.CONTENT[:8])
+        self.put_chunk(8, self.CONTENT[8:])
+        
+        response = self.complete(self.CONTENT)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'complete')
+        upload = Upload.objects.get(id=self.upload_id)
+        with upload.file.open('rb') as f:
+            self.assertEqual(f.read(), self.CONTENT)
+        self.assertFalse(os.listdir(os.path.join(self.temp_root, 'uploads_partial')))
+    
+    def test_checksum_mismatch_restarts_upload(self):
+        self.put_chunk(0, self.CONTENT[:8])
+        self.put_chunk(8, self.CONTENT[8:])
+        
+        response = self.complete(b'other content')
+        
+        self.assertEqual(response.status_code, 400)
+        upload = Upload.objects.get(id=self.upload_id)
+        self.assertEqual((upload.status, upload.received_size), ('uploading', 0))
+        self.assertEqual(self.put_chunk(0, self.CONTENT[:8]).status_code, 200)
+    
+    def test_complete_before_all_chunks(self):
+        self.put_chunk(0, self.CONTENT[:8])
+        
+        response = self.complete(self.CONTENT)
+        
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['received_size'], 8)
+
+
+@override_settings(ANALYSIS_MODE='single')
+class AnalysisSourcesEditTests(FakeGeminiMixin, TempStorageMixin, TestCase):
+    """Добавление и удаление источников анализа с пересчетом ДНК"""
+    
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        response = self.client.post('/api/analyses/', {'sources': self.url_sources('a', 'b')}, format='json')
+        self.analysis_id = response.data['id']
+        self.run_queue()
+    
+    def get_analysis(self):
+        return self.client.get(f'/api/analyses/{self.analysis_id}/').data
+    
+    def source_id(self, label: str) -> str:
+        return next(source['id'] for source in self.get_analysis()['sources'] if source['label'] == label)
+    
+    def test_add_recomputes_into_new_version(self):
+        self.assertEqual(self.get_analysis()['version'], 1)
+        
+        response = self.client.post(
+            f'/api/analyses/{self.analysis_id}/sources/', {'sources': self.url_sources('c')}, format='json'
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['recompute'], 'full')
+        self.run_queue()
+        
+        analysis = self.get_analysis()
+        self.assertEqual((analysis['status'], analysis['version']), ('ready', 2))
+        self.assertEqual(analysis['style_passport']['tone_tags'], ['a', 'b', 'c'])
+        versions = self.client.get(f'/api/analyses/{self.analysis_id}/versions/').data
+        self.assertEqual([version['number'] for version in versions], [2, 1])
+        self.assertEqual([source['label'] for source in versions[1]['sources']], ['a', 'b'])
+    
+    def test_remove_down_to_one_source(self):
+        response = self.client.delete(f'/api/analyses/{self.analysis_id}/sources/{self.source_id("a")}/')
+        self.assertEqual(response.status_code, 202)
+        self.run_queue()
+        
+        analysis = self.get_analysis()
+        self.assertEqual(analysis['version'], 2)
+        self.assertEqual(analysis['style_passport']['tone_tags'], ['b'])
+        
+        response = self.client.delete(f'/api/analyses/{self.analysis_id}/sources/{self.source_id("b")}/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(self.get_analysis()['sources']), 1)
+    
+    def test_sources_with_download_error_do_not_count(self):
+        Analysis.objects.get(id=self.analysis_id).sources.filter(label='b').update(download_status='error')
+        
+        response = self.client.delete(f'/api/analyses/{self.analysis_id}/sources/{self.source_id("a")}/')
+        self.assertEqual(response.status_code, 400)
+        
+        # Источник с ошибкой удалить можно, пока остается рабочий
+        response = self.client.delete(f'/api/analyses/{self.analysis_id}/sources/{self.source_id("b")}/')
+        self.assertEqual(response.status_code, 202)
+
+
+class LoopResourcesTests(SimpleTestCase):
+    """Закрытие асинхронных клиентов вместе с циклом событий"""
+    
+    def test_each_loop_closes_its_own_client(self):
+        clients = []
+        
+        async def request():
+            clients.append(get_async_http_client())
+            await asyncio.sleep(0)
+        
+        asyncio.run(request())
+        asyncio.run(request())
+        
+        self.assertIsNot(clients[0], clients[1])
+        self.assertTrue(clients[0].is_closed)
+        self.assertTrue(clients[1].is_closed)
+    
+    def test_lifespan_shutdown_closes_server_loop_clients(self):
+        from dnk.asgi import application
+        
+        async def serve():
+            client = get_async_http_client()
+            messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+            sent = []
+            
+            async def receive():
+                return messages.pop(0)
+            
+            async def send(message):
+                sent.append(message['type'])
+            
+            await application({'type': 'lifespan'}, receive, send)
+            # Клиент закрыт хуком, а не при завершении цикла
+            return client.is_closed, sent
+        
+        closed, sent = asyncio.run(serve())
+        
+        self.assertTrue(closed)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+
+@override_settings(ANALYSIS_JOB_MAX_ATTEMPTS=2, ANALYSIS_JOB_STALE_TIMEOUT=60)
+class JobQueueTests(TestCase):
+    """Очередь задач анализа"""
+    
+    def setUp(self):
+        self.analysis = Analysis.objects.create(status='processing')
+        self.job = enqueue_analysis(self.analysis)
+    
+    def test_claim_is_exclusive(self):
+        real_list = list
+        
+        def candidates_then_claimed_elsewhere(queryset):
+            job_ids = real_list(queryset)
+            # Другой воркер успевает захватить задачу между выборкой кандидатов и UPDATE
+            AnalysisJob.objects.filter(id=self.job.id).update(status='running', worker_id='w1')
+            return job_ids
+        
+        with mock.patch('api.job_queue.list', candidates_then_claimed_elsewhere, create=True):
+            self.assertIsNone(claim_next_job('w2'))
+        
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.worker_id, self.job.attempts), ('w1', 0))
+    
+    def test_claim_takes_each_job_once(self):
+        second = enqueue_analysis(Analysis.objects.create(status='processing'))
+        
+        first_claim = claim_next_job('w1')
+        second_claim = claim_next_job('w2')
+        
+        self.assertEqual((first_claim.id, first_claim.worker_id, first_claim.attempts), (self.job.id, 'w1', 1))
+        self.assertEqual((second_claim.id, second_claim.worker_id), (second.id, 'w2'))
+        self.assertIsNone(claim_next_job('w3'))
+    
+    def test_stale_heartbeat_requeues_job(self):
+        claim_next_job('w1')
+        AnalysisJob.objects.filter(id=self.job.id).update(heartbeat_at=timezone.now() - timedelta(seconds=61))
+        
+        self.assertEqual(requeue_stale_jobs(), 1)
+        
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.worker_id), ('queued', ''))
+        self.assertEqual(claim_next_job('w2').attempts, 2)
+    
+    def test_stale_job_fails_after_max_attempts(self):
+        AnalysisJob.objects.filter(id=self.job.id).update(
+            status='running', attempts=2, heartbeat_at=timezone.now() - timedelta(seconds=61)
+        )
+        
+        requeue_stale_jobs()
+        
+        self.job.refresh_from_db()
+        self.analysis.refresh_from_db()
+        self.assertEqual(self.job.status, 'failed')
+        self.assertEqual(self.analysis.status, 'error')
+    
+    def test_circuit_open_defers_without_using_attempt(self):
+        job = claim_next_job('w1')
+        
+        with mock.patch('api.job_queue.run_analysis', side_effect=CircuitOpenError('gemini', 30)):
+            AnalysisWorker(concurrency=1).process_job(job)
+        
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.worker_id), ('queued', 0, ''))
+        self.assertGreater(job.available_at, timezone.now() + timedelta(seconds=25))
+        # До available_at задачу никто не берет
+        self.assertIsNone(claim_next_job('w2'))
+
+
+class AnalysisCreateTests(TempStorageMixin, TestCase):
+    """Создание анализа ставит задачу в очередь"""
+    
+    def test_create_returns_202_with_queued_job(self):
+        response = APIClient().post('/api/analyses/', {
+            'sources': [{'type': 'url', 'value': 'https://example.com/a', 'label': 'a'}]
+        }, format='json')
+        
+        self.assertEqual(response.status_code, 202)
+        job = AnalysisJob.objects.get(analysis_id=response.data['id'])
+        self.assertEqual((job.status, job.attempts), ('queued', 0))
+
+
+class FakeClock:
+    """Часы для time.monotonic/time.sleep: sleep только сдвигает время"""
+    
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+    
+    def monotonic(self) -> float:
+        return self.now
+    
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeClockMixin:
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        patcher = mock.patch('api.download_scheduler.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TokenBucketTests(FakeClockMixin, SimpleTestCase):
+    """Ограничение частоты скачиваний"""
+    
+    def test_burst_then_refill(self):
+        bucket = TokenBucket(rate=0.5, capacity=2)
+        
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0)
+        # Следующий токен появится через 1 / rate секунд
+        self.assertAlmostEqual(bucket.acquire(), 2.0)
+    
+    def test_refill_is_capped_by_capacity(self):
+        bucket = TokenBucket(rate=0.5, capacity=2)
+        bucket.acquire()
+        self.clock.now += 100
+        
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertAlmostEqual(bucket.acquire(), 2.0)
+    
+    def test_pause_blocks_tokens_until_it_ends(self):
+        bucket = TokenBucket(rate=10, capacity=5)
+        
+        bucket.pause(12)
+        
+        self.assertAlmostEqual(bucket.acquire(), 12.0)
+        self.assertLessEqual(max(self.clock.sleeps), 5)
+
+
+@override_settings(
+    DOWNLOAD_RATE_LIMITS={'youtube': {'per_minute': 60, 'burst': 1}},
+    DOWNLOAD_MAX_RETRIES=2,
+    DOWNLOAD_RETRY_BASE_DELAY=5,
+    DOWNLOAD_RETRY_MAX_DELAY=120,
+)
+class DownloadSchedulerTests(FakeClockMixin, SimpleTestCase):
+    """Повторы скачиваний и лимиты по платформам и cookies"""
+    
+    def setUp(self):
+        super().setUp()
+        for target, value in (
+            ('api.download_scheduler.reserve_scratch_space', contextlib.nullcontext),
+            # Без разброса задержка повтора - ровно base * 2^(attempt-1)
+            ('api.download_scheduler.random.uniform', lambda low, high: high),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.scheduler = DownloadScheduler()
+    
+    def youtube_service(self, cookie_file: str, results: list) -> mock.Mock:
+        service = mock.Mock()
+        service.get_platform.return_value = 'youtube'
+        service.get_cookie_file.return_value = cookie_file
+        service.download_video.side_effect = results
+        return service
+    
+    def test_transient_errors_retry_with_exponential_backoff(self):
+        service = self.youtube_service('/cookies/a.txt', [
+            DownloadTransientError('503'), DownloadTransientError('503'), {'id': 'v'}
+        ])
+        
+        result = self.scheduler.download(service, 'https://youtu.be/v')
+        
+        self.assertEqual(result['attempts'], 3)
+        self.assertEqual(self.clock.sleeps, [5, 10])
+        self.assertEqual(result['queue_wait'], 15)
+    
+    def test_retries_are_limited(self):
+        service = self.youtube_service('/cookies/a.txt', [DownloadTransientError('503')] * 3)
+        
+        with self.assertRaises(DownloadTransientError) as raised:
+            self.scheduler.download(service, 'https://youtu.be/v')
+        
+        self.assertEqual(raised.exception.attempts, 3)
+        self.assertEqual(service.download_video.call_count, 3)
+    
+    def test_permanent_error_is_not_retried(self):
+        service = self.youtube_service('/cookies/a.txt', [DownloadError('Video unavailable')])
+        
+        with self.assertRaises(DownloadError) as raised:
+            self.scheduler.download(service, 'https://youtu.be/v')
+        
+        self.assertEqual(raised.exception.attempts, 1)
+        self.assertEqual(self.clock.sleeps, [])
+    
+    def test_throttling_pauses_bucket_of_same_cookies_only(self):
+        service = self.youtube_service('/cookies/a.txt', [DownloadThrottled('429', retry_after=30), {'id': 'v'}])
+        other_account = self.youtube_service('/cookies/b.txt', [{'id': 'w'}])
+        
+        result = self.scheduler.download(service, 'https://youtu.be/v')
+        
+        # Пауза не меньше Retry-After, ожидание идет в бакете, а не в time.sleep повтора
+        self.assertEqual(result['attempts'], 2)
+        self.assertAlmostEqual(result['queue_wait'], 30)
+        self.assertAlmostEqual(sum(self.clock.sleeps), 30)
+        
+        self.scheduler.get_bucket('youtube', 'a.txt').pause(60)
+        self.assertEqual(self.scheduler.download(other_account, 'https://youtu.be/w')['queue_wait'], 0)
+    
+    def test_buckets_are_per_platform_and_cookies(self):
+        bucket = self.scheduler.get_bucket('youtube', 'a.txt')
+        
+        self.assertIs(self.scheduler.get_bucket('youtube', 'a.txt'), bucket)
+        self.assertIsNot(self.scheduler.get_bucket('youtube', 'b.txt'), bucket)
+        self.assertIsNot(self.scheduler.get_bucket('tiktok', 'a.txt'), bucket)
+
+
+class ParseRetryAfterTests(SimpleTestCase):
+    """Разбор заголовка Retry-After и задержки из ответа Gemini"""
+    
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after(' 120 '), 120.0)
+        self.assertEqual(parse_retry_after('-5'), 0.0)
+    
+    def test_http_date(self):
+        retry_at = datetime.now(dt_timezone.utc) + timedelta(seconds=90)
+        
+        self.assertAlmostEqual(parse_retry_after(format_datetime(retry_at, usegmt=True)), 90, delta=2)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+    
+    def test_missing_or_invalid(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after(''))
+        self.assertIsNone(parse_retry_after('soon'))
+    
+    def test_gemini_retry_info(self):
+        error = genai_errors.APIError(429, {'error': {'code': 429, 'details': [
+            {'@type': 'type.googleapis.com/google.rpc.QuotaFailure'},
+            {'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '13s'},
+        ]}})
+        
+        self.assertEqual(_gemini_retry_delay(error), 13.0)
+    
+    def test_gemini_retry_after_header_wins(self):
+        response = httpx.Response(503, headers={'Retry-After': '7'})
+        error = genai_errors.APIError(503, {'error': {'code': 503, 'details': [
+            {'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '13s'},
+        ]}}, response=response)
+        
+        self.assertEqual(_gemini_retry_delay(error), 7.0)
+
+
+class ClassifyErrorTests(SimpleTestCase):
+    """Классификация ошибок внешних API"""
+    
+    def test_rejected_statuses(self):
+        info = classify_error(UpstreamHTTPError('busy', 503, retry_after=5))
+        
+        self.assertEqual((info.retryable, info.rejected, info.upstream_failure), (True, True, True))
+        self.assertEqual((info.status, info.retry_after), (503, 5))
+        throttled = classify_error(UpstreamHTTPError('slow down', 429))
+        self.assertEqual((throttled.retryable, throttled.rejected, throttled.upstream_failure), (True, True, False))
+    
+    def test_server_error_may_have_been_executed(self):
+        info = classify_error(UpstreamHTTPError('oops', 500))
+        
+        self.assertEqual((info.retryable, info.rejected, info.upstream_failure), (True, False, True))
+    
+    def test_client_errors_are_final(self):
+        info = classify_error(genai_errors.APIError(400, {'error': {'code': 400}}))
+        
+        self.assertEqual((info.retryable, info.upstream_failure, info.status), (False, False, 400))
+    
+    def test_network_errors(self):
+        connect = classify_error(httpx.ConnectError('refused'))
+        read_timeout = classify_error(httpx.ReadTimeout('timeout'))
+        
+        self.assertEqual((connect.retryable, connect.rejected), (True, True))
+        self.assertEqual((read_timeout.retryable, read_timeout.rejected), (True, False))
+        self.assertFalse(classify_error(ValueError('bug')).retryable)
+
+
+class ResilienceClockMixin:
+    """Фиктивные часы и свои предохранители на время теста"""
+    
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        for patcher in (
+            mock.patch('api.resilience.time', self.clock),
+            mock.patch('api.resilience.random.uniform', lambda low, high: high),
+            mock.patch.dict('api.resilience._breakers', clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+@override_settings(
+    UPSTREAM_DEADLINES={'default': 10},
+    UPSTREAM_RETRY_ATTEMPTS=3,
+    UPSTREAM_RETRY_BASE_DELAY=1,
+    UPSTREAM_RETRY_MAX_DELAY=20,
+    UPSTREAM_RETRY_AFTER_MAX=60,
+    UPSTREAM_BREAKER_FAILURE_THRESHOLD=100,
+)
+class RetryGuardTests(ResilienceClockMixin, SimpleTestCase):
+    """Повторы вызовов внешних API"""
+    
+    def failing(self, *errors):
+        """Функция попытки: ошибки по очереди, затем 'ok'"""
+        return mock.Mock(side_effect=[*errors, 'ok'])
+    
+    def test_retries_with_exponential_backoff(self):
+        fn = self.failing(UpstreamHTTPError('oops', 500), UpstreamHTTPError('oops', 502))
+        
+        self.assertEqual(call_with_retries('gemini', 'op', fn), 'ok')
+        
+        self.assertEqual(self.clock.sleeps, [1, 2])
+    
+    def test_attempt_gets_remaining_deadline_as_timeout(self):
+        fn = self.failing(UpstreamHTTPError('oops', 500))
+        
+        call_with_retries('gemini', 'op', fn)
+        
+        self.assertEqual([call.args[0] for call in fn.call_args_list], [10, 9])
+    
+    def test_delay_past_deadline_is_not_taken(self):
+        fn = self.failing(UpstreamHTTPError('busy', 503, retry_after=8), UpstreamHTTPError('busy', 503, retry_after=8))
+        
+        with self.assertRaises(UpstreamHTTPError):
+            call_with_retries('gemini', 'op', fn)
+        
+        # Первый повтор через 8 с укладывается в 10 с, второй уже нет
+        self.assertEqual(fn.call_count, 2)
+    
+    def test_expired_deadline(self):
+        guard = RetryGuard('gemini', 'op')
+        self.clock.now += 10
+        
+        with self.assertRaises(DeadlineExceeded):
+            guard.before_attempt()
+    
+    def test_non_idempotent_retries_only_rejected_requests(self):
+        rejected = self.failing(UpstreamHTTPError('busy', 503), UpstreamHTTPError('slow down', 429))
+        self.assertEqual(call_with_retries('kie', 'create_task', rejected, idempotent=False), 'ok')
+        
+        executed = self.failing(UpstreamHTTPError('oops', 500))
+        with self.assertRaises(UpstreamHTTPError):
+            call_with_retries('kie', 'create_task', executed, idempotent=False)
+        self.assertEqual(executed.call_count, 1)
+        
+        timed_out = self.failing(httpx.ReadTimeout('timeout'))
+        with self.assertRaises(httpx.ReadTimeout):
+            call_with_retries('kie', 'create_task', timed_out, idempotent=False)
+        self.assertEqual(timed_out.call_count, 1)
+
+
+@override_settings(UPSTREAM_BREAKER_FAILURE_THRESHOLD=2, UPSTREAM_BREAKER_RESET_TIMEOUT=30)
+class CircuitBreakerTests(ResilienceClockMixin, SimpleTestCase):
+    """Предохранитель внешнего API"""
+    
+    def setUp(self):
+        super().setUp()
+        self.breaker = CircuitBreaker('gemini')
+    
+    def open_breaker(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+    
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'closed')
+        
+        self.breaker.record_failure()
+        
+        self.assertEqual(self.breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.breaker.allow()
+        self.assertEqual(raised.exception.retry_after, 30)
+    
+    def test_half_open_trial_closes_on_success(self):
+        self.open_breaker()
+        self.clock.now += 30
+        
+        self.breaker.allow()
+        self.assertEqual(self.breaker.state, 'half_open')
+        # Пока идет пробный запрос, остальные не пропускаются
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.allow()
+        
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.breaker.allow()
+    
+    def test_half_open_trial_failure_reopens(self):
+        self.open_breaker()
+        self.clock.now += 30
+        self.breaker.allow()
+        
+        self.breaker.record_failure()
+        
+        self.assertEqual((self.breaker.state, self.breaker.opened_total), ('open', 2))
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.allow()
+    
+    def test_client_errors_do_not_count(self):
+        self.breaker.record(UpstreamHTTPError('bad request', 400))
+        self.breaker.record(UpstreamHTTPError('bad request', 400))
+        
+        self.assertEqual(self.breaker.state, 'closed')
+
+
+class UpstreamUnavailableResponseTests(TempStorageMixin, TestCase):
+    """Разомкнутый предохранитель отдается клиенту как 503 с Retry-After"""
+    
+    def test_helpers(self):
+        error = CircuitOpenError('gemini', 12.5)
+        
+        for response in (upstream_unavailable_response(error), _unavailable(error)):
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '13')
+    
+    def test_script_endpoints(self):
+        analysis = Analysis.objects.create(status='ready')
+        error = CircuitOpenError('gemini', 12.5)
+        
+        with mock.patch('api.views.GeminiService', side_effect=error), \
+                mock.patch('api.async_views.AsyncGeminiService', side_effect=error):
+            for path in ('/api/scripts/', '/api/async/scripts/'):
+                response = APIClient().post(path, {'analysis_id': str(analysis.id), 'topic': 'T'}, format='json')
+                self.assertEqual(response.status_code, 503, path)
+                self.assertEqual(response['Retry-After'], '13')
+
+
+@override_settings(DOWNLOAD_CACHE_ENABLED=True, DOWNLOAD_RATE_LIMITS={'youtube': {'per_minute': 6000, 'burst': 10}})
+class DownloadSourcesTests(TempStorageMixin, TestCase):
+    """Этап скачивания источников анализа"""
+    
+    def setUp(self):
+        super().setUp()
+        self.downloads = []
+        patcher = mock.patch.object(YouTubeService, 'download_video', autospec=True, side_effect=self.download_video)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Свой планировщик: лимиты общего планировщика процесса не переходят между тестами
+        patcher = mock.patch('api.analysis_pipeline.get_download_scheduler', return_value=DownloadScheduler())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.analysis = Analysis.objects.create(status='processing')
+    
+    def download_video(self, service, url, output_dir=None, keep_file=False):
+        self.downloads.append(url)
+        extractor, video_id = service.get_canonical_id(url)
+        if video_id == 'unavailabl3':
+            raise DownloadError('Video unavailable')
+        path = self.make_file(f'{video_id}.mp4')
+        return {
+            'id': video_id,
+            'extractor_key': extractor,
+            'title': video_id,
+            'file_path': path,
+            'temp_dir': os.path.dirname(path),
+            'mime_type': 'video/mp4',
+            'file_size': os.path.getsize(path),
+            'duration': 10,
+            'transcript': [],
+        }
+    
+    def add_source(self, url: str) -> AnalysisSource:
+        return AnalysisSource.objects.create(analysis=self.analysis, source_type='url', url=url, label=url)
+    
+    def test_failed_source_does_not_stop_others(self):
+        first = self.add_source('https://www.youtube.com/watch?v=aaaaaaaaaaa')
+        failed = self.add_source('https://www.youtube.com/watch?v=unavailabl3')
+        last = self.add_source('https://www.youtube.com/watch?v=bbbbbbbbbbb')
+        
+        sources_list = download_sources(self.analysis)
+        
+        self.assertEqual([item['source_id'] for item in sources_list], [first.id, last.id])
+        for source in (first, failed, last):
+            source.refresh_from_db()
+        self.assertEqual([first.download_status, last.download_status], ['done', 'done'])
+        self.assertTrue(first.file and last.file)
+        self.assertEqual(failed.download_status, 'error')
+        self.assertIn('Video unavailable', failed.error_message)
+    
+    def test_same_video_is_downloaded_once(self):
+        full = self.add_source('https://www.youtube.com/watch?v=aaaaaaaaaaa')
+        short = self.add_source('https://youtu.be/aaaaaaaaaaa')
+        
+        sources_list = download_sources(self.analysis)
+        
+        self.assertEqual(len(self.downloads), 1)
+        self.assertEqual(len(sources_list), 2)
+        full.refresh_from_db()
+        short.refresh_from_db()
+        self.assertEqual((full.download_status, short.download_status), ('done', 'done'))
+        self.assertEqual(full.file.name, short.file.name)
+        self.assertEqual(CachedDownload.objects.count(), 1)
+
+
+class JsonArrayStreamTests(SimpleTestCase):
+    """Инкрементальный разбор JSON-массива из потока модели"""
+    
+    def feed_by_char(self, text: str) -> list:
+        stream = JsonArrayStream()
+        return [item for char in text for item in stream.feed(char)]
+    
+    def test_strings_with_brackets_and_escaped_quotes(self):
+        items = [
+            {'visual': 'скобки ] } [ { внутри', 'audio': 'кавычки \" и \\ слеш'},
+            {'visual': 'вложенное', 'meta': {'tags': ['a', {'b': ']'}]}},
+        ]
+        text = json.dumps(items, ensure_ascii=False)
+        
+        self.assertEqual(self.feed_by_char(text), items)
+    
+    def test_item_split_across_chunks(self):
+        stream = JsonArrayStream()
+        
+        self.assertEqual(stream.feed('```json\n[{"audio": "раз'), [])
+        # Часть обрывается на экранирующем слеше
+        self.assertEqual(stream.feed(' \\'), [])
+        self.assertEqual(stream.feed('"два\\""}, {"audio"'), [{'audio': 'раз "два"'}])
+        self.assertEqual(stream.feed(': "три"}'), [{'audio': 'три'}])
+        self.assertFalse(stream.finished)
+    
+    def test_trailing_garbage_is_ignored(self):
+        stream = JsonArrayStream()
+        
+        self.assertEqual(stream.feed('[{"a": 1}]\n```\n[{"b": 2}]'), [{'a': 1}])
+        
+        self.assertTrue(stream.finished)
+        self.assertEqual(stream.feed('{"c": 3}'), [])
+    
+    def test_text_before_array(self):
+        stream = JsonArrayStream()
+        
+        self.assertEqual(stream.feed('Вот сценарий: {не json} '), [])
+        self.assertEqual(stream.feed('[]'), [])
+        self.assertTrue(stream.finished)
+
+
+class ScriptStreamEventsTests(TestCase):
+    """События SSE потоковой генерации сценария"""
+    
+    def setUp(self):
+        self.analysis = Analysis.objects.create(status='ready')
+        self.writer = ScriptStreamWriter(self.analysis, 'Тема')
+    
+    @staticmethod
+    def event_name(event: str) -> str:
+        return event.split('\n', 1)[0].removeprefix('event: ')
+    
+    def segments(self, count: int, error: Exception = None):
+        for index in range(count):
+            yield {'timeframe': f'{index}', 'visual': 'v', 'audio': 'a'}
+        if error:
+            raise error
+    
+    def test_done(self):
+        events = list(stream_script_events(self.writer, self.segments(2)))
+        
+        self.assertEqual([self.event_name(event) for event in events], ['script', 'segment', 'segment', 'done'])
+        script = Script.objects.get()
+        self.assertEqual((script.status, script.segments.count()), ('ready', 2))
+    
+    def test_generation_error_keeps_saved_segments(self):
+        events = list(stream_script_events(self.writer, self.segments(1, error=RuntimeError('обрыв'))))
+        
+        self.assertEqual([self.event_name(event) for event in events], ['script', 'segment', 'error'])
+        self.assertIn('"segments_saved": 1', events[-1])
+        script = Script.objects.get()
+        self.assertEqual((script.status, script.segments.count()), ('error', 1))
+        self.assertIn('обрыв', script.error_message)
+    
+    def test_client_disconnect_marks_script_error(self):
+        events = stream_script_events(self.writer, self.segments(3))
+        next(events)
+        next(events)
+        
+        # Так сервер закрывает поток ответа, когда клиент отключился
+        events.close()
+        
+        script = Script.objects.get()
+        self.assertEqual((script.status, script.segments.count()), ('error', 1))
+        self.assertEqual(script.error_message, 'Генерация прервана: клиент отключился')
+
+
+class ScriptCacheKeyTests(SimpleTestCase):
+    """Ключ кеша сценариев"""
+    
+    passport = {'tone_tags': ['юмор'], 'speech_rate_wpm': 150}
+    patterns = [{'name': 'хук', 'description': 'вопрос в начале'}]
+    
+    def test_normalize_topic(self):
+        self.assertEqual(normalize_topic('  Как  варить\tКОФЕ?! '), 'как варить кофе')
+        self.assertEqual(normalize_topic('«Как варить кофе»'), 'как варить кофе')
+        self.assertNotEqual(normalize_topic('Как варить кофе'), normalize_topic('Как варить чай'))
+    
+    def test_equivalent_topics_and_dna_share_key(self):
+        key = script_cache_key('Как варить кофе', self.passport, self.patterns)
+        
+        reordered = {'speech_rate_wpm': 150, 'tone_tags': ['юмор']}
+        self.assertEqual(script_cache_key(' как варить  кофе. ', reordered, self.patterns), key)
+        self.assertEqual(script_cache_key('Как варить кофе', self.passport, self.patterns, []), key)
+    
+    def test_dna_and_prompt_version_change_key(self):
+        key = script_cache_key('Тема', self.passport, self.patterns)
+        transcript = [{'timestamp': '00:00', 'text': 'привет'}]
+        
+        self.assertNotEqual(script_cache_key('Тема', {**self.passport, 'speech_rate_wpm': 160}, self.patterns), key)
+        self.assertNotEqual(script_cache_key('Тема', self.passport, self.patterns[:0]), key)
+        self.assertNotEqual(script_cache_key('Тема', self.passport, self.patterns, transcript), key)
+        with mock.patch.object(GeminiService, 'SCRIPT_PROMPT_VERSION', 'test'):
+            self.assertNotEqual(script_cache_key('Тема', self.passport, self.patterns), key)
+
+
+@override_settings(
+    CACHES={'scripts': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'script-cache-tests'}},
+    SCRIPT_CACHE_ALIAS='scripts',
+)
+class GenerateScriptCachedTests(SimpleTestCase):
+    """Генерация сценариев через кеш и перегенерация из заранее созданных вариантов"""
+    
+    def setUp(self):
+        caches['scripts'].clear()
+        self.counter = itertools.count(1)
+        self.gemini_service = mock.Mock()
+        self.gemini_service.generate_script.side_effect = self.generate_script
+    
+    def generate_script(self, **kwargs):
+        return [{'timeframe': '0-5', 'visual': kwargs['topic'], 'audio': f'вариант {next(self.counter)}'}]
+    
+    def generate(self, topic='Тема', **kwargs):
+        return generate_script_cached(self.gemini_service, topic, {'tone_tags': []}, [], **kwargs)
+    
+    def test_second_request_is_cache_hit(self):
+        first, cached = self.generate()
+        self.assertFalse(cached)
+        
+        second, cached = self.generate(topic=' тема! ')
+        
+        self.assertTrue(cached)
+        self.assertEqual(second, first)
+        self.assertEqual(self.gemini_service.generate_script.call_count, 1)
+    
+    def test_regenerate_uses_pending_variants(self):
+        first, _ = self.generate(variants=3)
+        self.assertEqual(self.gemini_service.generate_script.call_count, 3)
+        
+        second, second_cached = self.generate(regenerate=True)
+        third, third_cached = self.generate(regenerate=True)
+        
+        self.assertEqual((second_cached, third_cached), (True, True))
+        self.assertEqual(len({first[0]['audio'], second[0]['audio'], third[0]['audio']}), 3)
+        # Обычный запрос после перегенерации отдает последний выданный вариант
+        self.assertEqual(self.generate(), (third, True))
+        
+        fourth, cached = self.generate(regenerate=True)
+        
+        self.assertFalse(cached)
+        self.assertEqual(fourth[0]['audio'], 'вариант 4')
+    
+    def test_failed_variants_are_skipped(self):
+        self.gemini_service.generate_script.side_effect = [RuntimeError('сбой'), [{'audio': 'ok'}], [{'audio': 'new'}]]
+        
+        segments, cached = self.generate(variants=2)
+        
+        self.assertEqual((segments, cached), ([{'audio': 'ok'}], False))
+        # Запасных вариантов нет: перегенерация обращается к модели
+        self.assertEqual(self.generate(regenerate=True), ([{'audio': 'new'}], False))
+    
+    def test_errors_and_empty_scripts_are_not_cached(self):
+        self.gemini_service.generate_script.side_effect = [RuntimeError('сбой'), [], [{'audio': 'ok'}]]
+        
+        with self.assertRaisesMessage(RuntimeError, 'сбой'):
+            self.generate()
+        self.assertEqual(self.generate(), ([], False))
+        self.assertEqual(self.generate(), ([{'audio': 'ok'}], False))
+
+
+@override_settings(
+    UPSTREAM_RETRY_ATTEMPTS=3,
+    UPSTREAM_BREAKER_FAILURE_THRESHOLD=100,
+    GEMINI_CONTEXT_CACHE_ENABLED=True,
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS=0,
+)
+class ContextCacheFallbackTests(ResilienceClockMixin, TestCase):
+    """Генерация сценария, когда кеш контекста Gemini истек или не создался"""
+    
+    def setUp(self):
+        super().setUp()
+        self.requests = []
+        self.client = mock.Mock()
+        self.client.models.generate_content.side_effect = self.generate_content
+        patcher = mock.patch.object(GeminiService, '__init__', lambda service: setattr(service, 'client', self.client))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(flush_upstream_calls)
+        self.cache_error = genai_errors.ClientError(
+            404, {'error': {'code': 404, 'message': 'CachedContent not found', 'status': 'NOT_FOUND'}}
+        )
+    
+    def generate_content(self, model, contents, config):
+        self.requests.append((config.cached_content, len(contents)))
+        if config.cached_content:
+            raise self.cache_error
+        return mock.Mock(text='[{"timeframe": "0-5", "visual": "v", "audio": "a"}]', candidates=[], usage_metadata=None)
+    
+    def generate_script(self, cached_content):
+        return GeminiService().generate_script('Тема', {'tone_tags': []}, [], cached_content=cached_content)
+    
+    def test_expired_cache_falls_back_to_inline_dna(self):
+        segments = self.generate_script('cachedContents/expired')
+        
+        self.assertEqual(segments, [{'timeframe': '0-5', 'visual': 'v', 'audio': 'a'}])
+        # Сначала запрос через кеш (только тема), затем без кеша: ДНК и тема
+        self.assertEqual(self.requests, [('cachedContents/expired', 1), (None, 2)])
+    
+    def test_other_errors_do_not_drop_cache(self):
+        self.cache_error = genai_errors.ClientError(
+            400, {'error': {'code': 400, 'message': 'Invalid argument', 'status': 'INVALID_ARGUMENT'}}
+        )
+        
+        with self.assertRaises(genai_errors.ClientError):
+            self.generate_script('cachedContents/current')
+        self.assertEqual(self.requests, [('cachedContents/current', 1)])
+    
+    def test_failed_cache_creation_sends_dna_inline(self):
+        analysis = Analysis.objects.create(status='ready', style_passport={'tone_tags': []}, patterns=[])
+        gemini_service = GeminiService()
+        
+        with mock.patch.object(GeminiService, 'create_script_context_cache', side_effect=RuntimeError('сбой')) as create:
+            context = get_script_context(analysis, gemini_service)
+            # Неудачная попытка запоминается и не повторяется на следующем сценарии
+            self.assertIsNone(ensure_context_cache(analysis, gemini_service))
+        
+        self.assertEqual(create.call_count, 1)
+        self.assertIsNone(context['cached_content'])
+        gemini_service.generate_script('Тема', **context)
+        self.assertEqual(self.requests, [(None, 2)])
@@ -0,0 +1,114 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Dict, Any, Optional
+from django.conf import settings
+
+from .scratch_space import get_scratch_root
+
+
+class TranscodeError(Exception):
+    """Ошибка перекодирования видео через ffmpeg"""
+    pass
+
+
+def get_quality_profile(name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Профиль качества видео для анализа
+    
+    Args:
+        name: Название профиля из ANALYSIS_QUALITY_PROFILES (None - ANALYSIS_QUALITY_PROFILE)
+    
+    Returns:
+        Словарь настроек профиля с ключом 'name'
+    """
+    name = name or settings.ANALYSIS_QUALITY_PROFILE
+    if name not in settings.ANALYSIS_QUALITY_PROFILES:
+        raise ValueError(f"Неизвестный профиль качества анализа: {name}")
+    return {'name': name, **settings.ANALYSIS_QUALITY_PROFILES[name]}
+
+
+def is_ffmpeg_available() -> bool:
+    """Проверка, что ffmpeg установлен"""
+    return shutil.which(settings.FFMPEG_BINARY) is not None
+
+
+def run_ffmpeg(args: list, timeout: Optional[int] = None) -> bytes:
+    """
+    Запуск ffmpeg
+    
+    Args:
+        args: Аргументы командной строки без имени программы
+        timeout: Ограничение времени в секундах (None - TRANSCODE_TIMEOUT)
+    
+    Returns:
+        Содержимое stdout
+    """
+    try:
+        result = subprocess.run(
+            [settings.FFMPEG_BINARY, *args],
+            capture_output=True,
+            timeout=timeout or settings.TRANSCODE_TIMEOUT
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise TranscodeError(f"Не удалось запустить ffmpeg: {str(e)}")
+    
+    if result.returncode != 0:
+        stderr = result.stderr.decode('utf-8', errors='replace').strip()
+        raise TranscodeError(f"ffmpeg завершился с ошибкой: {stderr[-500:]}")
+    
+    return result.stdout
+
+
+def build_ffmpeg_args(input_path: str, output_path: str, profile: Dict[str, Any]) -> list:
+    """Аргументы ffmpeg для легкой копии видео по профилю качества"""
+    filters = []
+    if profile.get('max_height'):
+        # Только уменьшаем кадр: видео ниже max_height не растягивается
+        filters.append(f"scale=-2:'min({profile['max_height']},ih)'")
+    if profile.get('fps'):
+        filters.append(f"fps={profile['fps']}")
+    
+    args = ['-y', '-v', 'error', '-i', input_path]
+    if filters:
+        args += ['-vf', ','.join(filters)]
+    args += [
+        '-c:v', 'libx264',
+        '-preset', 'veryfast',
+        '-crf', str(profile.get('crf', 30)),
+        '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac',
+    ]
+    if profile.get('audio_channels'):
+        args += ['-ac', str(profile['audio_channels'])]
+    if profile.get('audio_bitrate'):
+        args += ['-b:a', profile['audio_bitrate']]
+    args += ['-movflags', '+faststart', output_path]
+    return args
+
+
+def make_analysis_proxy(input_path: str, profile: Dict[str, Any], output_dir: Optional[str] = None) -> str:
+    """
+    Создание легкой копии видео для анализа
+    
+    Args:
+        input_path: Путь к исходному видео
+        profile: Профиль качества (get_quality_profile)
+        output_dir: Директория для копии (по умолчанию корень рабочего пространства)
+    
+    Returns:
+        Путь к временному mp4-файлу (за перенос и удаление отвечает вызывающий код)
+    """
+    fd, output_path = tempfile.mkstemp(prefix='proxy-', suffix='.mp4', dir=output_dir or get_scratch_root())
+    os.close(fd)
+    
+    try:
+        run_ffmpeg(build_ffmpeg_args(input_path, output_path, profile))
+        if os.path.getsize(output_path) == 0:
+            raise TranscodeError("ffmpeg создал пустой файл")
+    except TranscodeError:
+        os.remove(output_path)
+        raise
+    
+    return output_path
@@ -1,12 +1,26 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AnalysisViewSet, ScriptViewSet
+from .views import AnalysisViewSet, AnalysisBatchViewSet, UploadViewSet, ScriptViewSet, HealthViewSet, TelemetryViewSet
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'analyses', AnalysisViewSet, basename='analysis')
+router.register(r'batches', AnalysisBatchViewSet, basename='batch')
+router.register(r'uploads', UploadViewSet, basename='upload')
 router.register(r'scripts', ScriptViewSet, basename='script')
+router.register(r'health', HealthViewSet, basename='health')
+router.register(r'telemetry', TelemetryViewSet, basename='telemetry')
+
+# Асинхронные варианты эндпоинтов (для запуска под ASGI)
+async_urlpatterns = [
+    path('analyses/', async_views.create_analysis_view, name='async-analysis-create'),
+    path('analyses/<uuid:pk>/', async_views.analysis_detail_view, name='async-analysis-detail'),
+    path('scripts/', async_views.create_script_view, name='async-script-create'),
+    path('scripts/stream/', async_views.stream_script_view, name='async-script-stream'),
+    path('scripts/video_task_status/', async_views.video_task_status_view, name='async-video-task-status'),
+]
 
 urlpatterns = [
+    path('async/', include(async_urlpatterns)),
     path('', include(router.urls)),
 ]
-
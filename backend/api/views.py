@@ -3,12 +3,16 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django.shortcuts import get_object_or_404
+from django.conf import settings
 from django.db import transaction
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
 from django.core.files.base import ContentFile
 from django.http import HttpResponse
 import uuid
+from datetime import timedelta
 import base64
-import json
+from typing import List, Dict, Any, Tuple
 from io import BytesIO
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import cm
@@ -22,15 +26,296 @@ from xml.sax.saxutils import escape
 import os
 import platform
 
-from .models import Analysis, AnalysisSource, Script, ScriptSegment, MediaFile
+from .models import Analysis, AnalysisBatch, AnalysisSource, Upload, Script, ScriptSegment, MediaFile, UpstreamCall, Voiceover
 from .serializers import (
-    AnalysisSerializer, AnalysisCreateSerializer,
-    ScriptSerializer, ScriptCreateSerializer, ScriptSegmentCreateSerializer,
-    ScriptSegmentSerializer
+    AnalysisSerializer, AnalysisCreateSerializer, AnalysisBatchSerializer, AnalysisBatchCreateSerializer,
+    AnalysisSourcesAddSerializer, AnalysisVersionSerializer,
+    UploadSerializer, UploadCreateSerializer, UploadCompleteSerializer,
+    ScriptSerializer, ScriptCreateSerializer, ScriptStreamCreateSerializer, ScriptSegmentCreateSerializer,
+    ScriptSegmentSerializer, UpstreamCallSerializer, VoiceoverSerializer
 )
 from .gemini_service import GeminiService
-from .youtube_service import YouTubeService
-from .kie_service import KieService
+from .gemini_client import get_gemini_client_stats
+from .resilience import CircuitOpenError, get_circuit_breaker_states
+from .youtube_service import YouTubeService, DownloadThrottled, DownloadTransientError
+from .kie_service import KieService, format_task_status
+from .job_queue import enqueue_analysis, enqueue_analyses
+from .parsers import ChunkParser
+from .file_utils import get_partial_upload_path, hash_local_file, save_local_file
+from .analysis_cache import has_video_results
+from .script_cache import generate_script_cached
+from .context_cache import get_script_context
+from .script_stream import ScriptStreamWriter, sse_response, stream_script_events
+from .instrumentation import call_context, flush_upstream_calls
+from .telemetry import calls_for, summarize_queryset
+from .voiceover import generate_voiceover, synthesize_speech
+
+
+def _load_uploads(sources_lists: List[List[Dict[str, Any]]]) -> Dict[uuid.UUID, Upload]:
+    """Завершенные загрузки, на которые ссылаются источники (одним запросом)"""
+    return Upload.objects.in_bulk([
+        source_data.get('value')
+        for sources_data in sources_lists
+        for source_data in sources_data
+        if source_data.get('type') == 'upload'
+    ])
+
+
+def _build_sources(
+    sources_data: List[Dict[str, Any]],
+    uploads: Dict[uuid.UUID, Upload],
+    youtube_service: YouTubeService
+) -> List[AnalysisSource]:
+    """
+    Подготовка источников анализа без обращения к БД
+    
+    Файлы base64-источников записываются в хранилище сразу (до транзакции),
+    строки источников сохраняет вызывающий код.
+    """
+    sources = []
+    
+    for source_data in sources_data:
+        source_type = source_data.get('type')
+        label = source_data.get('label', '')
+        value = source_data.get('value')
+        
+        source = AnalysisSource(source_type=source_type, label=label)
+        
+        if source_type == 'upload':
+            # Файл уже загружен частями - источник ссылается на него без копирования
+            upload = uploads[uuid.UUID(str(value))]
+            source.source_type = 'file'
+            source.file.name = upload.file.name
+            source.file_mime_type = upload.mime_type
+            source.content_key = f"sha256:{upload.checksum}"
+            source.label = label or upload.filename
+        elif source_type == 'url':
+            # Скачивание видео выполняется воркером
+            source.url = value
+            if youtube_service.is_supported_url(value):
+                source.download_status = 'pending'
+        else:
+            # Для файлов - сохраняем base64 данные
+            if isinstance(value, dict) and 'data' in value:
+                # Сохраняем файл из base64
+                file_data = base64.b64decode(value['data'])
+                file_name = label or 'video.mp4'
+                source.file.save(file_name, ContentFile(file_data), save=False)
+                source.file_mime_type = value.get('mimeType', 'video/mp4')
+        
+        sources.append(source)
+    
+    return sources
+
+
+def _delete_source_files(sources: List[AnalysisSource], sources_data: List[Dict[str, Any]]) -> None:
+    """Удаление записанных файлов base64-источников, чтобы не оставлять сирот"""
+    for source, source_data in zip(sources, sources_data):
+        if source_data.get('type') == 'file' and source.file:
+            source.file.delete(save=False)
+
+
+def create_analysis(validated_data: Dict[str, Any]) -> Analysis:
+    """
+    Создание анализа с источниками и постановка в очередь
+    
+    Файлы источников записываются в хранилище до начала транзакции,
+    в транзакции создаются только строки анализа, источников и задачи.
+    
+    Args:
+        validated_data: Данные AnalysisCreateSerializer
+    """
+    sources_data = validated_data['sources']
+    sources = _build_sources(sources_data, _load_uploads([sources_data]), YouTubeService())
+    
+    # Короткая транзакция: воркер не увидит задачу без источников
+    try:
+        with transaction.atomic():
+            analysis = Analysis.objects.create(status='processing')
+            for source in sources:
+                source.analysis = analysis
+            AnalysisSource.objects.bulk_create(sources)
+            
+            # Ставим анализ в очередь, воркер пройдет по статусам downloading → transcribing → analyzing → ready/error
+            enqueue_analysis(
+                analysis,
+                force_refresh=validated_data['force_refresh'],
+                keep_original=validated_data['keep_original']
+            )
+    except Exception:
+        _delete_source_files(sources, sources_data)
+        raise
+    
+    return analysis
+
+
+# Статусы выполняющегося анализа: источники такого анализа менять нельзя
+ANALYSIS_BUSY_STATUSES = ('processing', 'downloading', 'transcribing', 'analyzing')
+
+
+class AnalysisBusyError(Exception):
+    """Анализ еще выполняется"""
+    pass
+
+
+def _claim_for_update(analysis: Analysis) -> None:
+    """
+    Перевод анализа в processing перед изменением источников (вызывается в транзакции)
+    
+    Захват выполняется условным UPDATE по статусу первым запросом транзакции, поэтому
+    выполняющийся анализ нельзя изменить, а два изменения не пересекаются (в том числе на SQLite).
+    
+    Raises:
+        AnalysisBusyError: Анализ еще выполняется
+    """
+    claimed = Analysis.objects.filter(id=analysis.id).exclude(status__in=ANALYSIS_BUSY_STATUSES).update(
+        status='processing',
+        error_message='',
+        # Отпечаток относится к прежнему набору источников и будет вычислен заново
+        fingerprint='',
+        updated_at=timezone.now(),
+    )
+    if not claimed:
+        raise AnalysisBusyError('Анализ еще выполняется, источники можно изменить после его завершения')
+    analysis.refresh_from_db()
+
+
+def add_analysis_sources(analysis: Analysis, validated_data: Dict[str, Any]) -> Tuple[Analysis, bool]:
+    """
+    Добавление источников в анализ и постановка пересчета ДНК в очередь
+    
+    Пересчет инкрементальный (run_analysis с incremental), если у всех прежних источников есть
+    готовые анализы видео: они берутся из кеша, новые видео анализируются по одному, затем ДНК
+    сводится заново. Иначе (анализ выполнялся в режиме single) пересчет полный, в режиме ANALYSIS_MODE.
+    
+    Args:
+        analysis: Анализ
+        validated_data: Данные AnalysisSourcesAddSerializer
+    
+    Returns:
+        (анализ, инкрементальный ли пересчет)
+    
+    Raises:
+        AnalysisBusyError: Анализ еще выполняется
+    """
+    sources_data = validated_data['sources']
+    sources = _build_sources(sources_data, _load_uploads([sources_data]), YouTubeService())
+    
+    try:
+        with transaction.atomic():
+            _claim_for_update(analysis)
+            incremental = not validated_data['force_refresh'] and has_video_results(analysis.sources.all())
+            for source in sources:
+                source.analysis = analysis
+            AnalysisSource.objects.bulk_create(sources)
+            enqueue_analysis(
+                analysis,
+                force_refresh=validated_data['force_refresh'],
+                keep_original=validated_data['keep_original'],
+                incremental=incremental
+            )
+    except Exception:
+        _delete_source_files(sources, sources_data)
+        raise
+    
+    return analysis, incremental
+
+
+def remove_analysis_source(analysis: Analysis, source_id) -> Tuple[Analysis, bool]:
+    """
+    Удаление источника из анализа и постановка пересчета ДНК в очередь
+    
+    Файл источника не удаляется: он может быть общим с кешем скачивания или другими анализами.
+    Если у всех оставшихся источников есть готовые анализы видео, пересчет инкрементальный и стоит
+    один запрос сведения. Иначе (анализ выполнялся в режиме single) пересчет полный, в режиме ANALYSIS_MODE.
+    
+    Returns:
+        (анализ, инкрементальный ли пересчет)
+    
+    Raises:
+        AnalysisBusyError: Анализ еще выполняется
+        AnalysisSource.DoesNotExist: Источника нет в анализе
+        ValueError: После удаления в анализе не останется источников, которые удалось скачать
+    """
+    with transaction.atomic():
+        _claim_for_update(analysis)
+        source = analysis.sources.get(id=source_id)
+        # Источники с ошибкой скачивания в анализ не попадают, поэтому не считаются
+        if not analysis.sources.exclude(id=source.id).exclude(download_status='error').exists():
+            raise ValueError('Нельзя удалить последний рабочий источник анализа')
+        source.delete()
+        incremental = has_video_results(analysis.sources.all())
+        enqueue_analysis(analysis, keep_original=settings.ANALYSIS_KEEP_ORIGINAL, incremental=incremental)
+    
+    return analysis, incremental
+
+
+def save_script(analysis: Analysis, topic: str, segments_data: List[Dict[str, str]], script_id=None) -> Script:
+    """
+    Сохранение сценария и его сегментов одной короткой транзакцией
+    
+    Args:
+        script_id: ID сценария, заданный до генерации (к нему привязаны замеры вызовов Gemini)
+    """
+    with transaction.atomic():
+        # Создаем сценарий
+        script = Script.objects.create(
+            id=script_id or uuid.uuid4(),
+            analysis=analysis,
+            # Версия ДНК, загруженная вместе с анализом, - та, по которой шла генерация
+            analysis_version_id=analysis.current_version_id,
+            topic=topic
+        )
+        
+        # Создаем сегменты
+        ScriptSegment.objects.bulk_create([
+            ScriptSegment(
+                script=script,
+                timeframe=segment_data.get('timeframe', ''),
+                visual=segment_data.get('visual', ''),
+                audio=segment_data.get('audio', ''),
+                order=order
+            )
+            for order, segment_data in enumerate(segments_data)
+        ])
+    
+    return script
+
+
+def recompute_response(request, analysis: Analysis, incremental: bool) -> Response:
+    """Ответ 202 на изменение источников: анализ и вид пересчета ДНК (incremental или full)"""
+    data = AnalysisSerializer(analysis, context={'request': request}).data
+    data['recompute'] = 'incremental' if incremental else 'full'
+    return Response(data, status=status.HTTP_202_ACCEPTED)
+
+
+def upstream_unavailable_response(error: CircuitOpenError) -> Response:
+    """Внешний API временно недоступен (предохранитель разомкнут): 503 с Retry-After"""
+    return Response(
+        {'error': str(error)},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={'Retry-After': str(int(error.retry_after) + 1)}
+    )
+
+
+def upstream_calls_response(request, queryset) -> Response:
+    """
+    Замеры вызовов внешних API с итогами (для анализа или сценария)
+    
+    Query params:
+        limit: Сколько последних вызовов вернуть списком (по умолчанию 100)
+    """
+    # Замеры пишутся фоновым потоком - сохраняем накопленные, чтобы ответ был полным
+    flush_upstream_calls()
+    try:
+        limit = min(max(int(request.query_params.get('limit', 100)), 0), 1000)
+    except ValueError:
+        limit = 100
+    
+    return Response({
+        **summarize_queryset(queryset),
+        'calls': UpstreamCallSerializer(queryset[:limit], many=True).data,
+    })
 
 
 class AnalysisViewSet(viewsets.ModelViewSet):
@@ -44,124 +329,53 @@ class AnalysisViewSet(viewsets.ModelViewSet):
             return AnalysisCreateSerializer
         return AnalysisSerializer
     
-    @transaction.atomic
     def create(self, request):
-        """Создание нового анализа"""
+        """Создание нового анализа (сам анализ выполняется воркером очереди)"""
         serializer = AnalysisCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        sources_data = serializer.validated_data['sources']
+        analysis = create_analysis(serializer.validated_data)
         
-        # Создаем анализ
-        analysis = Analysis.objects.create(status='processing')
+        result_serializer = AnalysisSerializer(analysis, context={'request': request})
+        return Response(result_serializer.data, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['get'])
+    def preview(self, request):
+        """
+        Проверка ссылки и метаданные видео (название, длительность, превью)
         
-        # Создаем источники
-        sources_list = []
+        Метаданные кешируются, поэтому последующее скачивание воркером не разбирает страницу видео повторно.
+        """
+        url = request.query_params.get('url', '').strip()
         youtube_service = YouTubeService()
         
-        for source_data in sources_data:
-            source_type = source_data.get('type')
-            label = source_data.get('label', '')
-            value = source_data.get('value')
-            
-            source = AnalysisSource.objects.create(
-                analysis=analysis,
-                source_type=source_type,
-                label=label
+        if not url or not youtube_service.is_supported_url(url):
+            return Response(
+                {'error': 'Поддерживаются ссылки на YouTube, TikTok и Instagram'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-            if source_type == 'url':
-                source.url = value
-                
-                # Если это YouTube, TikTok или Instagram URL, скачиваем видео
-                if youtube_service.is_supported_url(value):
-                    try:
-                        analysis.status = 'downloading'
-                        analysis.save()
-                        
-                        # Скачиваем видео
-                        video_data = youtube_service.download_video(value)
-                        
-                        # Сохраняем как файл
-                        file_name = f"{youtube_service._sanitize_filename(video_data['title'])}.mp4"
-                        source.file.save(
-                            file_name,
-                            ContentFile(video_data['file_data']),
-                            save=True
-                        )
-                        source.file_mime_type = video_data['mime_type']
-                        source.source_type = 'file'  # Меняем тип на file после скачивания
-                        source.save()
-                        
-                        # Для передачи в Gemini используем base64
-                        value = {
-                            'data': base64.b64encode(video_data['file_data']).decode('utf-8'),
-                            'mimeType': video_data['mime_type']
-                        }
-                        label = video_data['title']
-                        source_type = 'file'  # Обновляем тип для sources_list
-                        
-                    except Exception as e:
-                        # Если не удалось скачать, оставляем как URL
-                        source.save()
-                        platform = 'YouTube' if youtube_service.is_youtube_url(value) else 'TikTok'
-                        return Response(
-                            {'error': f'Ошибка при скачивании видео с {platform}: {str(e)}'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                else:
-                    source.save()
-            else:
-                # Для файлов - сохраняем base64 данные
-                if isinstance(value, dict) and 'data' in value:
-                    # Сохраняем файл из base64
-                    file_data = base64.b64decode(value['data'])
-                    file_name = label or 'video.mp4'
-                    source.file.save(
-                        file_name,
-                        ContentFile(file_data),
-                        save=True
-                    )
-                    source.file_mime_type = value.get('mimeType', 'video/mp4')
-                    source.save()
-            
-            # Формируем данные для передачи в Gemini
-            source_item = {
-                'type': source_type,
-                'value': value,
-                'label': label
-            }
-            sources_list.append(source_item)
-        
-        # Запускаем анализ в фоне (можно использовать Celery для асинхронности)
+        
         try:
-            analysis.status = 'transcribing'
-            analysis.save()
-            
-            gemini_service = GeminiService()
-            analysis_result = gemini_service.analyze_content(sources_list)
-            
-            # Сохраняем результаты
-            analysis.status = 'analyzing'
-            analysis.save()
-            
-            analysis.transcript = analysis_result['transcript']
-            analysis.style_passport = analysis_result['stylePassport']
-            analysis.patterns = analysis_result['patterns']
-            analysis.grounding_sources = analysis_result['sources']
-            analysis.status = 'ready'
-            analysis.save()
+            metadata = youtube_service.get_metadata(url)
+        except DownloadThrottled as e:
+            # Платформа ограничила частоту запросов - клиент может повторить позже
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(int(e.retry_after or settings.DOWNLOAD_RETRY_BASE_DELAY))}
+            )
+        except DownloadTransientError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
         except Exception as e:
-            analysis.status = 'error'
-            analysis.save()
             return Response(
                 {'error': str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Возвращаем результат
-        result_serializer = AnalysisSerializer(analysis, context={'request': request})
-        return Response(result_serializer.data, status=status.HTTP_201_CREATED)
+        return Response(metadata)
     
     @action(detail=False, methods=['get'])
     def history(self, request):
@@ -169,6 +383,286 @@ class AnalysisViewSet(viewsets.ModelViewSet):
         analyses = self.queryset.filter(status='ready').order_by('-created_at')[:20]
         serializer = self.get_serializer(analyses, many=True)
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['post'], url_path='sources')
+    def add_sources(self, request, pk=None):
+        """
+        Добавление источников: ДНК пересчитывается воркером
+        
+        recompute в ответе - incremental (анализируются только новые видео) или full.
+        """
+        analysis = self.get_object()
+        serializer = AnalysisSourcesAddSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        try:
+            analysis, incremental = add_analysis_sources(analysis, serializer.validated_data)
+        except AnalysisBusyError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        
+        return recompute_response(request, analysis, incremental)
+    
+    @action(detail=True, methods=['delete'], url_path=r'sources/(?P<source_id>[^/.]+)')
+    def remove_source(self, request, pk=None, source_id=None):
+        """
+        Удаление источника: ДНК пересчитывается воркером
+        
+        recompute в ответе - incremental (сведение из анализов оставшихся видео) или full.
+        """
+        analysis = self.get_object()
+        
+        try:
+            analysis, incremental = remove_analysis_source(analysis, source_id)
+        except AnalysisBusyError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        except (AnalysisSource.DoesNotExist, DjangoValidationError):
+            return Response({'error': 'Источник не найден'}, status=status.HTTP_404_NOT_FOUND)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return recompute_response(request, analysis, incremental)
+    
+    @action(detail=True, methods=['get'])
+    def versions(self, request, pk=None):
+        """История версий ДНК анализа (новые первыми) со сценариями, сгенерированными по каждой версии"""
+        analysis = self.get_object()
+        versions = analysis.versions.prefetch_related('scripts')
+        return Response(AnalysisVersionSerializer(versions, many=True).data)
+    
+    @action(detail=True, methods=['get'])
+    def upstream_calls(self, request, pk=None):
+        """Вызовы Gemini и Kie.ai анализа и его сценариев: время, токены, стоимость"""
+        analysis = self.get_object()
+        return upstream_calls_response(request, calls_for(analysis_id=analysis.id))
+
+
+class AnalysisBatchViewSet(viewsets.GenericViewSet):
+    """
+    ViewSet для пакетов анализов
+    
+    1. POST /api/batches/ - отправить несколько анализов одним запросом
+    2. GET /api/batches/{id}/ - статус всех анализов пакета
+    """
+    queryset = AnalysisBatch.objects.all()
+    serializer_class = AnalysisBatchSerializer
+    
+    def get_queryset(self):
+        return self.queryset.prefetch_related('analyses__sources')
+    
+    def create(self, request):
+        """
+        Создание пакета анализов
+        
+        Анализы и их источники создаются двумя bulk insert'ами, задачи ставятся в очередь
+        одним запросом. Видео, общие для нескольких анализов, скачиваются один раз
+        (остальные анализы берут файл из кеша скачивания).
+        """
+        serializer = AnalysisBatchCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        entries = serializer.validated_data['analyses']
+        youtube_service = YouTubeService()
+        uploads = _load_uploads([entry['sources'] for entry in entries])
+        
+        # Файлы источников записываются до транзакции
+        entry_sources = []
+        try:
+            for entry in entries:
+                entry_sources.append(_build_sources(entry['sources'], uploads, youtube_service))
+        except Exception:
+            for sources, entry in zip(entry_sources, entries):
+                _delete_source_files(sources, entry['sources'])
+            raise
+        
+        try:
+            with transaction.atomic():
+                batch = AnalysisBatch.objects.create()
+                analyses = Analysis.objects.bulk_create([
+                    Analysis(status='processing', batch=batch) for _ in entries
+                ])
+                
+                all_sources = []
+                for analysis, sources in zip(analyses, entry_sources):
+                    for source in sources:
+                        source.analysis = analysis
+                    all_sources.extend(sources)
+                AnalysisSource.objects.bulk_create(all_sources)
+                
+                enqueue_analyses(analyses, [
+                    {'force_refresh': entry['force_refresh'], 'keep_original': entry['keep_original']}
+                    for entry in entries
+                ])
+        except Exception:
+            for sources, entry in zip(entry_sources, entries):
+                _delete_source_files(sources, entry['sources'])
+            raise
+        
+        result_serializer = AnalysisBatchSerializer(self.get_queryset().get(id=batch.id), context={'request': request})
+        return Response(result_serializer.data, status=status.HTTP_202_ACCEPTED)
+    
+    def retrieve(self, request, pk=None):
+        """Статус пакета: количество анализов по статусам и состояние каждого анализа и его источников"""
+        batch = get_object_or_404(self.get_queryset(), pk=pk)
+        serializer = self.get_serializer(batch)
+        return Response(serializer.data)
+
+
+class UploadViewSet(viewsets.GenericViewSet):
+    """
+    ViewSet для загрузки файлов частями
+    
+    1. POST /api/uploads/ - начать загрузку (filename, mime_type, total_size)
+    2. PUT /api/uploads/{id}/chunk/?offset=N - записать часть (тело - байты файла)
+    3. GET /api/uploads/{id}/ - узнать, сколько байт уже получено (для продолжения после обрыва)
+    4. POST /api/uploads/{id}/complete/ - завершить загрузку с проверкой SHA-256
+    
+    Части дописываются в файл на локальном диске (UPLOAD_PARTIAL_ROOT): запись по смещению
+    поддерживает не всякое хранилище. В хранилище файл переносится при завершении загрузки.
+    """
+    queryset = Upload.objects.all()
+    serializer_class = UploadSerializer
+    
+    COPY_BLOCK_SIZE = 64 * 1024
+    
+    def create(self, request):
+        """Начало загрузки: создается пустой локальный файл для частей"""
+        serializer = UploadCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        upload = Upload(
+            filename=serializer.validated_data['filename'],
+            mime_type=serializer.validated_data['mime_type'],
+            total_size=serializer.validated_data['total_size'],
+        )
+        open(get_partial_upload_path(upload.id), 'wb').close()
+        upload.save()
+        
+        return Response(UploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+    
+    def retrieve(self, request, pk=None):
+        """Текущее состояние загрузки"""
+        upload = self.get_object()
+        return Response(UploadSerializer(upload).data)
+    
+    @action(detail=True, methods=['put'], parser_classes=[ChunkParser])
+    def chunk(self, request, pk=None):
+        """Запись части файла по смещению"""
+        upload = self.get_object()
+        
+        if upload.status == 'complete':
+            return Response(
+                {'error': 'Загрузка уже завершена'},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        try:
+            offset = int(request.query_params.get('offset', ''))
+        except ValueError:
+            return Response(
+                {'error': 'Не указано смещение offset'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Части принимаются строго по порядку: клиент продолжает с received_size
+        if offset != upload.received_size:
+            return Response(
+                {'error': 'Неверное смещение', 'received_size': upload.received_size},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        try:
+            chunk_size = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            chunk_size = 0
+        
+        if chunk_size <= 0:
+            return Response(
+                {'error': 'Пустая часть файла'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if chunk_size > settings.UPLOAD_MAX_CHUNK_BYTES:
+            return Response(
+                {'error': f'Часть больше {settings.UPLOAD_MAX_CHUNK_BYTES} байт'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        if offset + chunk_size > upload.total_size:
+            return Response(
+                {'error': 'Часть выходит за пределы объявленного размера файла'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Пишем блоками в локальный файл загрузки
+        stream = request.data
+        written = 0
+        with open(get_partial_upload_path(upload.id), 'r+b') as f:
+            f.seek(offset)
+            while written < chunk_size:
+                block = stream.read(min(self.COPY_BLOCK_SIZE, chunk_size - written))
+                if not block:
+                    break
+                f.write(block)
+                written += len(block)
+            f.truncate(offset + written)
+        
+        # Условное обновление: если параллельный запрос уже записал эту часть, смещение не сдвигается дважды
+        updated = Upload.objects.filter(id=upload.id, received_size=offset).update(
+            received_size=offset + written,
+            updated_at=timezone.now()
+        )
+        upload.refresh_from_db()
+        
+        if not updated:
+            return Response(
+                {'error': 'Неверное смещение', 'received_size': upload.received_size},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        return Response(UploadSerializer(upload).data)
+    
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        """Завершение загрузки с проверкой контрольной суммы"""
+        upload = self.get_object()
+        serializer = UploadCompleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        checksum = serializer.validated_data['checksum'].lower()
+        
+        if upload.status == 'complete':
+            if upload.checksum != checksum:
+                return Response(
+                    {'error': 'Контрольная сумма не совпадает'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            return Response(UploadSerializer(upload).data)
+        
+        if upload.received_size != upload.total_size:
+            return Response(
+                {'error': 'Файл загружен не полностью', 'received_size': upload.received_size},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        partial_path = get_partial_upload_path(upload.id)
+        if hash_local_file(partial_path) != checksum:
+            # Содержимое повреждено - загрузку нужно начать заново
+            upload.received_size = 0
+            upload.save(update_fields=['received_size', 'updated_at'])
+            with open(partial_path, 'r+b') as f:
+                f.truncate(0)
+            return Response(
+                {'error': 'Контрольная сумма не совпадает, загрузите файл заново'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Локальное хранилище перемещает файл, остальные копируют его частями
+        save_local_file(upload.file, upload.filename, partial_path)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        
+        upload.checksum = checksum
+        upload.status = 'complete'
+        upload.save(update_fields=['file', 'checksum', 'status', 'updated_at'])
+        
+        return Response(UploadSerializer(upload).data)
 
 
 class ScriptViewSet(viewsets.ModelViewSet):
@@ -179,11 +673,18 @@ class ScriptViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action == 'create':
             return ScriptCreateSerializer
+        if self.action == 'stream':
+            return ScriptStreamCreateSerializer
         return ScriptSerializer
     
-    @transaction.atomic
     def create(self, request):
-        """Создание нового сценария"""
+        """
+        Создание нового сценария
+        
+        Gemini вызывается вне транзакции, сценарий и сегменты сохраняются
+        одной короткой транзакцией после получения ответа. С use_cache сценарий
+        берется из кеша (script_cache), заголовок X-Script-Cache - hit или miss.
+        """
         serializer = ScriptCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
@@ -192,38 +693,70 @@ class ScriptViewSet(viewsets.ModelViewSet):
         
         analysis = get_object_or_404(Analysis, id=analysis_id)
         
-        # Генерируем сценарий
+        # Генерируем сценарий (ID задается заранее, чтобы привязать к нему замеры вызовов Gemini)
+        cached = False
+        script_id = uuid.uuid4()
         try:
             gemini_service = GeminiService()
-            segments_data = gemini_service.generate_script(
-                topic=topic,
-                style_passport=analysis.style_passport,
-                patterns=analysis.patterns
-            )
+            with call_context(analysis_id=analysis.id, script_id=script_id):
+                # ДНК анализа берется из кеша контекста Gemini, если он есть
+                context = get_script_context(analysis, gemini_service)
+                if serializer.validated_data['use_cache']:
+                    segments_data, cached = generate_script_cached(
+                        gemini_service,
+                        topic=topic,
+                        variants=serializer.validated_data['variants'],
+                        regenerate=serializer.validated_data['regenerate'],
+                        **context
+                    )
+                else:
+                    segments_data = gemini_service.generate_script(topic=topic, **context)
+        except CircuitOpenError as e:
+            return upstream_unavailable_response(e)
         except Exception as e:
             return Response(
                 {'error': f'Ошибка генерации сценария: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         
-        # Создаем сценарий
-        script = Script.objects.create(
-            analysis=analysis,
-            topic=topic
+        script = save_script(analysis, topic, segments_data, script_id=script_id)
+        
+        result_serializer = ScriptSerializer(script, context={'request': request})
+        return Response(
+            result_serializer.data,
+            status=status.HTTP_201_CREATED,
+            headers={'X-Script-Cache': 'hit' if cached else 'miss'}
         )
+    
+    @action(detail=False, methods=['post'])
+    def stream(self, request):
+        """
+        Потоковое создание сценария (text/event-stream)
         
-        # Создаем сегменты
-        for order, segment_data in enumerate(segments_data):
-            ScriptSegment.objects.create(
-                script=script,
-                timeframe=segment_data.get('timeframe', ''),
-                visual=segment_data.get('visual', ''),
-                audio=segment_data.get('audio', ''),
-                order=order
+        События: script (создан сценарий), segment (очередной сегмент сохранен),
+        done (сценарий целиком) или error. Каждый сегмент сохраняется и отправляется,
+        как только модель его дописала, не дожидаясь конца генерации. Кеш сценариев
+        не используется: сценарий всегда генерируется заново.
+        """
+        serializer = ScriptStreamCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        topic = serializer.validated_data['topic']
+        analysis = get_object_or_404(Analysis, id=serializer.validated_data['analysis_id'])
+        
+        try:
+            gemini_service = GeminiService()
+            with call_context(analysis_id=analysis.id):
+                context = get_script_context(analysis, gemini_service)
+        except Exception as e:
+            return Response(
+                {'error': f'Ошибка генерации сценария: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         
-        result_serializer = ScriptSerializer(script, context={'request': request})
-        return Response(result_serializer.data, status=status.HTTP_201_CREATED)
+        segments = gemini_service.generate_script_stream(topic=topic, **context)
+        writer = ScriptStreamWriter(analysis, topic, request)
+        return sse_response(stream_script_events(writer, segments))
     
     @action(detail=True, methods=['post'])
     def generate_media(self, request, pk=None):
@@ -251,7 +784,8 @@ class ScriptViewSet(viewsets.ModelViewSet):
             media_file.status = 'generating_image'
             media_file.save()
             
-            image_data = gemini_service.generate_image(segment.visual)
+            with call_context(analysis_id=script.analysis_id, script_id=script.id):
+                image_data = gemini_service.generate_image(segment.visual)
             image_file = ContentFile(image_data, name=f'image_{segment.id}.png')
             media_file.image_file = image_file
             media_file.save()
@@ -270,7 +804,8 @@ class ScriptViewSet(viewsets.ModelViewSet):
             media_file.status = 'generating_audio'
             media_file.save()
             
-            audio_data = gemini_service.generate_speech(segment.audio)
+            with call_context(analysis_id=script.analysis_id, script_id=script.id):
+                audio_data = synthesize_speech(segment.audio, gemini_service)
             audio_file = ContentFile(audio_data, name=f'audio_{segment.id}.wav')
             media_file.audio_file = audio_file
             media_file.media_type = 'audio'
@@ -279,10 +814,12 @@ class ScriptViewSet(viewsets.ModelViewSet):
             # Завершено
             media_file.status = 'done'
             media_file.save()
-            
+        
         except Exception as e:
             media_file.status = 'error'
             media_file.save()
+            if isinstance(e, CircuitOpenError):
+                return upstream_unavailable_response(e)
             return Response(
                 {'error': f'Ошибка генерации медиа: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -291,6 +828,41 @@ class ScriptViewSet(viewsets.ModelViewSet):
         serializer = ScriptSegmentSerializer(segment, context={'request': request})
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get', 'post'])
+    def voiceover(self, request, pk=None):
+        """
+        Озвучка сценария целиком
+        
+        GET возвращает последнюю озвучку, POST озвучивает все сегменты заново:
+        общая дорожка и отдельные файлы сегментов со смещениями на дорожке.
+        """
+        script = self.get_object()
+        
+        if request.method == 'GET':
+            voiceover = script.voiceovers.prefetch_related('segments').first()
+            if voiceover is None:
+                return Response({'error': 'Озвучка не найдена'}, status=status.HTTP_404_NOT_FOUND)
+            return Response(VoiceoverSerializer(voiceover, context={'request': request}).data)
+        
+        if not any(segment.audio.strip() for segment in script.segments.all()):
+            return Response({'error': 'В сценарии нет текста для озвучки'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            voiceover = generate_voiceover(script)
+        except CircuitOpenError as e:
+            return upstream_unavailable_response(e)
+        except Exception as e:
+            return Response(
+                {'error': f'Ошибка озвучки сценария: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        
+        voiceover = Voiceover.objects.prefetch_related('segments').get(id=voiceover.id)
+        return Response(
+            VoiceoverSerializer(voiceover, context={'request': request}).data,
+            status=status.HTTP_201_CREATED
+        )
+    
     @action(detail=True, methods=['post'])
     def generate_video_preview(self, request, pk=None):
         """Генерация видео через Kie.ai для одного сегмента"""
@@ -331,7 +903,7 @@ class ScriptViewSet(viewsets.ModelViewSet):
                 f"Визуальный план: {segment.visual}\n"
                 f"Текст автора: {segment.audio}"
             )
-
+            
             print(f"Prompt для сегмента {segment_id}: {prompt}")
             
             # Создаем задачу на генерацию видео
@@ -340,13 +912,16 @@ class ScriptViewSet(viewsets.ModelViewSet):
             aspect_ratio = "2:3" if model == 'grok-imagine/text-to-video' else None
             
             try:
-                task_response = kie_service.create_video_task(
-                    model=model,
-                    prompt=prompt,
-                    additional_notes=additional_notes,
-                    aspect_ratio=aspect_ratio,
-                    mode="normal"
-                )
+                with call_context(analysis_id=script.analysis_id, script_id=script.id):
+                    task_response = kie_service.create_video_task(
+                        model=model,
+                        prompt=prompt,
+                        additional_notes=additional_notes,
+                        aspect_ratio=aspect_ratio,
+                        mode="normal"
+                    )
+            except CircuitOpenError as e:
+                return upstream_unavailable_response(e)
             except Exception as e:
                 return Response(
                     {'error': f'Ошибка создания задачи в Kie.ai: {str(e)}'},
@@ -410,7 +985,8 @@ class ScriptViewSet(viewsets.ModelViewSet):
             
             def poll_and_update():
                 try:
-                    result = kie_service.poll_task_until_complete(task_id)
+                    with call_context(analysis_id=script.analysis_id, script_id=script.id):
+                        result = kie_service.poll_task_until_complete(task_id)
                     if result['status'] == 'success':
                         video_urls = result['result'].get('resultUrls', [])
                         if video_urls:
@@ -436,13 +1012,19 @@ class ScriptViewSet(viewsets.ModelViewSet):
                 'status': 'generating',
                 'message': 'Задача на генерацию видео создана'
             }, status=status.HTTP_202_ACCEPTED)
-            
+        
         except Exception as e:
             return Response(
                 {'error': f'Ошибка генерации видео: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=True, methods=['get'])
+    def upstream_calls(self, request, pk=None):
+        """Вызовы Gemini и Kie.ai сценария: время, токены, стоимость"""
+        script = self.get_object()
+        return upstream_calls_response(request, calls_for(script_id=script.id))
+    
     @action(detail=False, methods=['get'], url_path='video_task_status')
     def video_task_status(self, request):
         """Получение статуса задачи генерации видео"""
@@ -455,25 +1037,9 @@ class ScriptViewSet(viewsets.ModelViewSet):
         
         try:
             kie_service = KieService()
-            status_data = kie_service.get_task_status(task_id)
-            data = status_data.get('data', {})
-            state = data.get('state', 'waiting')
-            
-            result = {
-                'state': state,
-            }
-            
-            if state == 'success':
-                result_json = data.get('resultJson', '{}')
-                try:
-                    result_data = json.loads(result_json) if isinstance(result_json, str) else result_json
-                    result['resultUrls'] = result_data.get('resultUrls', [])
-                except json.JSONDecodeError:
-                    result['resultUrls'] = []
-            elif state == 'fail':
-                result['failMsg'] = data.get('failMsg', 'Неизвестная ошибка')
-            
-            return Response(result)
+            return Response(format_task_status(kie_service.get_task_status(task_id)))
+        except CircuitOpenError as e:
+            return upstream_unavailable_response(e)
         except Exception as e:
             return Response(
                 {'error': f'Ошибка получения статуса: {str(e)}'},
@@ -687,3 +1253,44 @@ class ScriptViewSet(viewsets.ModelViewSet):
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
         
         return response
+
+
+class HealthViewSet(viewsets.ViewSet):
+    """Состояние процесса: статистика пулов соединений с внешними API"""
+    
+    def list(self, request):
+        """GET /api/health/ - запросы, ошибки и соединения общих клиентов Gemini, состояние предохранителей"""
+        return Response({
+            'gemini': get_gemini_client_stats(),
+            'circuit_breakers': get_circuit_breaker_states(),
+        })
+
+
+class TelemetryViewSet(viewsets.ViewSet):
+    """Сводка замеров вызовов внешних API: перцентили времени, ошибки, токены, стоимость"""
+    
+    def list(self, request):
+        """
+        GET /api/telemetry/ - сводка по (сервис, операция, модель)
+        
+        Query params:
+            hours: Окно в часах (по умолчанию 24)
+            service, operation, model: Фильтры
+        """
+        flush_upstream_calls()
+        try:
+            hours = float(request.query_params.get('hours', 24))
+        except ValueError:
+            return Response({'error': 'hours должен быть числом'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        since = timezone.now() - timedelta(hours=hours)
+        queryset = UpstreamCall.objects.filter(started_at__gte=since)
+        for field in ('service', 'operation', 'model'):
+            value = request.query_params.get(field)
+            if value:
+                queryset = queryset.filter(**{field: value})
+        
+        return Response({
+            'since': since,
+            **summarize_queryset(queryset),
+        })
@@ -0,0 +1,197 @@
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Script, Voiceover, VoiceoverSegment
+from .gemini_service import GeminiService
+from .instrumentation import call_context
+
+
+# Предложение: текст до знака конца предложения вместе с закрывающими кавычками и скобками
+_SENTENCE = re.compile(r'[^.!?…]+(?:[.!?…]+["»)\]]*|$)')
+# Граница внутри предложения, на которой можно разрезать длинное предложение
+_CLAUSE_BOUNDARY = re.compile(r'(?<=[,;:—])\s+')
+
+
+def _pack(parts: List[str], max_chars: int) -> List[str]:
+    """Объединение частей подряд в куски не длиннее max_chars (часть длиннее max_chars остается целой)"""
+    chunks = []
+    for part in parts:
+        if chunks and len(chunks[-1]) + 1 + len(part) <= max_chars:
+            chunks[-1] = f"{chunks[-1]} {part}"
+        else:
+            chunks.append(part)
+    return chunks
+
+
+def split_text(text: str, max_chars: Optional[int] = None) -> List[str]:
+    """
+    Разбиение текста для синтеза речи на части по границам предложений
+    
+    Предложения объединяются в части не длиннее max_chars. Предложение длиннее max_chars
+    режется по запятым и другим знакам внутри предложения, а если и этого мало - по словам.
+    
+    Args:
+        text: Текст сегмента
+        max_chars: Максимальная длина части (по умолчанию VOICEOVER_CHUNK_MAX_CHARS)
+    
+    Returns:
+        Части текста по порядку (пустой список для пустого текста)
+    """
+    max_chars = max_chars or settings.VOICEOVER_CHUNK_MAX_CHARS
+    text = ' '.join(text.split())
+    if not text:
+        return []
+    if len(text) <= max_chars:
+        return [text]
+    
+    sentences = [sentence.strip() for sentence in _SENTENCE.findall(text) if sentence.strip()] or [text]
+    pieces = []
+    for sentence in sentences:
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        for clause in _pack(_CLAUSE_BOUNDARY.split(sentence), max_chars):
+            pieces.extend([clause] if len(clause) <= max_chars else _pack(clause.split(), max_chars))
+    
+    return _pack(pieces, max_chars)
+
+
+def synthesize_texts(texts: List[str], gemini_service: GeminiService) -> List[Tuple[bytes, int]]:
+    """
+    Синтез речи для нескольких текстов
+    
+    Части всех текстов синтезируются в общем пуле потоков (не больше VOICEOVER_TTS_CONCURRENCY
+    запросов одновременно), PCM частей каждого текста склеиваются по порядку.
+    Контекст копируется, чтобы замеры вызовов были привязаны к сценарию.
+    
+    Returns:
+        [(PCM текста, число частей), ...] в порядке текстов
+    
+    Raises:
+        Exception: Ошибка синтеза любой части (оставшиеся части отменяются)
+    """
+    chunks = [(index, chunk) for index, text in enumerate(texts) for chunk in split_text(text)]
+    pcm_by_text = [bytearray() for _ in texts]
+    counts = [0] * len(texts)
+    if not chunks:
+        return [(b'', 0) for _ in texts]
+    
+    max_workers = max(min(settings.VOICEOVER_TTS_CONCURRENCY, len(chunks)), 1)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tts') as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, gemini_service.generate_speech_pcm, chunk)
+            for _, chunk in chunks
+        ]
+        try:
+            chunk_pcm = [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    
+    for (index, _), pcm in zip(chunks, chunk_pcm):
+        pcm_by_text[index].extend(pcm)
+        counts[index] += 1
+    
+    return [(bytes(pcm), count) for pcm, count in zip(pcm_by_text, counts)]
+
+
+def synthesize_speech(text: str, gemini_service: GeminiService) -> bytes:
+    """Озвучка одного текста (WAV): длинный текст синтезируется параллельно по частям"""
+    pcm, _ = synthesize_texts([text], gemini_service)[0]
+    if not pcm:
+        raise ValueError('Нет текста для озвучки')
+    return gemini_service.pcm_to_wav(pcm)
+
+
+def _duration_ms(pcm_length: int) -> int:
+    """Длительность PCM 16 бит, моно в миллисекундах"""
+    return round(pcm_length / 2 / GeminiService.SPEECH_SAMPLE_RATE * 1000)
+
+
+def _silence(duration_ms: int) -> bytes:
+    """Тишина PCM 16 бит, моно заданной длительности"""
+    return bytes(int(GeminiService.SPEECH_SAMPLE_RATE * duration_ms / 1000) * 2)
+
+
+def generate_voiceover(script: Script, gemini_service: Optional[GeminiService] = None) -> Voiceover:
+    """
+    Озвучка сценария целиком
+    
+    Тексты всех сегментов синтезируются параллельно. Для каждого сегмента сохраняется
+    свой WAV-файл и его смещение на общей дорожке, общая дорожка - сегменты по порядку
+    с паузой VOICEOVER_SEGMENT_PAUSE_MS между ними. Сегменты без текста пропускаются.
+    
+    Args:
+        script: Сценарий
+        gemini_service: Сервис Gemini (по умолчанию создается новый)
+    
+    Returns:
+        Озвучка со статусом done
+    
+    Raises:
+        ValueError: В сценарии нет текста для озвучки
+        Exception: Ошибка синтеза или сохранения (озвучка сохраняется со статусом error,
+            уже записанные файлы удаляются)
+    """
+    segments = [segment for segment in script.segments.order_by('order') if segment.audio.strip()]
+    if not segments:
+        raise ValueError('В сценарии нет текста для озвучки')
+    
+    gemini_service = gemini_service or GeminiService()
+    voiceover = Voiceover.objects.create(script=script)
+    rows = []
+    
+    try:
+        with call_context(analysis_id=script.analysis_id, script_id=script.id):
+            results = synthesize_texts([segment.audio for segment in segments], gemini_service)
+        
+        pause = _silence(settings.VOICEOVER_SEGMENT_PAUSE_MS)
+        track = bytearray()
+        
+        for order, (segment, (pcm, chunk_count)) in enumerate(zip(segments, results)):
+            if track:
+                track.extend(pause)
+            row = VoiceoverSegment(
+                voiceover=voiceover,
+                segment=segment,
+                start_ms=_duration_ms(len(track)),
+                duration_ms=_duration_ms(len(pcm)),
+                chunk_count=chunk_count,
+                order=order
+            )
+            rows.append(row)
+            # Файлы записываются в хранилище до транзакции, в ней сохраняются только строки
+            row.audio_file.save(f'voiceover_{segment.id}.wav', ContentFile(gemini_service.pcm_to_wav(pcm)), save=False)
+            track.extend(pcm)
+        
+        voiceover.audio_file.save(
+            f'voiceover_{script.id}.wav', ContentFile(gemini_service.pcm_to_wav(bytes(track))), save=False
+        )
+        voiceover.duration_ms = _duration_ms(len(track))
+        voiceover.status = 'done'
+        
+        with transaction.atomic():
+            VoiceoverSegment.objects.bulk_create(rows)
+            voiceover.save()
+    except Exception as e:
+        # Уже записанные файлы больше ни к чему не привязаны
+        for field in [row.audio_file for row in rows] + [voiceover.audio_file]:
+            if field:
+                field.delete(save=False)
+        Voiceover.objects.filter(id=voiceover.id).update(
+            status='error',
+            error_message=str(e),
+            audio_file=None,
+            duration_ms=0,
+            updated_at=timezone.now()
+        )
+        raise
+    
+    return voiceover
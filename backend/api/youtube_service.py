@@ -1,24 +1,117 @@
+import hashlib
 import os
+import re
+import shutil
 import tempfile
 import yt_dlp
-from typing import Optional, Dict, Any
+from contextlib import contextmanager
+from yt_dlp.extractor import get_info_extractor
+from yt_dlp.networking.exceptions import HTTPError, TransportError
+from typing import Optional, Dict, Any, Iterator, List, Tuple
 from pathlib import Path
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
+from django.conf import settings
+from django.core.cache import caches
+
+from .subtitles import parse_subtitles, select_subtitle_track
+from .scratch_space import get_scratch_root
+
+
+class DownloadError(Exception):
+    """Ошибка скачивания видео, повтор не поможет (видео удалено, приватное, не поддерживается)"""
+    pass
+
+
+class DownloadTransientError(DownloadError):
+    """Временная ошибка скачивания (сеть, 5xx платформы) - можно повторить"""
+    pass
+
+
+class DownloadThrottled(DownloadTransientError):
+    """Платформа ограничивает частоту запросов (429, rate limit) - повторять с паузой"""
+    
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Признаки ограничения частоты запросов в сообщениях yt-dlp (Instagram и TikTok не всегда отдают 429)
+THROTTLE_PATTERNS = re.compile(
+    r'HTTP Error 429|Too Many Requests|rate[- ]limit|Please wait a few minutes|try again later',
+    re.IGNORECASE
+)
+TRANSIENT_PATTERNS = re.compile(
+    r'HTTP Error 5\d\d|timed? ?out|Connection (reset|refused|aborted)|Temporary failure|'
+    r'Remote end closed|IncompleteRead|Unable to download (webpage|JSON)',
+    re.IGNORECASE
+)
+
+
+def classify_download_error(error: Exception, prefix: str = 'Ошибка при скачивании видео') -> DownloadError:
+    """
+    Тип ошибки yt-dlp: ограничение частоты, временная или постоянная
+    
+    Args:
+        error: Исключение yt-dlp
+        prefix: Начало текста ошибки
+    
+    Returns:
+        DownloadThrottled, DownloadTransientError или DownloadError с исходным текстом ошибки
+    """
+    if isinstance(error, DownloadError):
+        return error
+    
+    message = f"{prefix}: {str(error)}"
+    
+    # yt-dlp оборачивает сетевые ошибки в DownloadError/ExtractorError, исходная лежит в exc_info
+    cause = error
+    while cause is not None and not isinstance(cause, (HTTPError, TransportError)):
+        exc_info = getattr(cause, 'exc_info', None)
+        cause = exc_info[1] if exc_info else cause.__cause__
+    
+    if isinstance(cause, HTTPError):
+        if cause.status == 429:
+            retry_after = cause.response.headers.get('Retry-After') if cause.response else None
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None
+            return DownloadThrottled(message, retry_after=retry_after)
+        if cause.status >= 500:
+            return DownloadTransientError(message)
+    elif isinstance(cause, TransportError):
+        return DownloadTransientError(message)
+    
+    if THROTTLE_PATTERNS.search(str(error)):
+        return DownloadThrottled(message)
+    if TRANSIENT_PATTERNS.search(str(error)):
+        return DownloadTransientError(message)
+    return DownloadError(message)
 
 
 class YouTubeService:
     """Сервис для скачивания видео с YouTube, TikTok и Instagram через yt-dlp"""
     
-    def __init__(self, cookies_file: Optional[str] = None, instagram_cookies_file: Optional[str] = None):
+    # Экстракторы yt-dlp, по URL-шаблонам которых определяется id видео
+    CANONICAL_EXTRACTORS = ['Youtube', 'TikTok', 'TikTokVM', 'Instagram']
+    
+    def __init__(
+        self,
+        cookies_file: Optional[str] = None,
+        instagram_cookies_file: Optional[str] = None,
+        max_height: Optional[int] = None
+    ):
         """
         Инициализация сервиса
         
         Args:
             cookies_file: Путь к файлу cookies для YouTube/TikTok (Netscape формат)
             instagram_cookies_file: Путь к файлу cookies для Instagram
+            max_height: Максимальная высота кадра скачиваемого видео (None - лучшее доступное качество)
         """
         backend_dir = os.path.dirname(os.path.dirname(__file__))
+        self.max_height = max_height
         
         if cookies_file:
             self.cookies_file = cookies_file
@@ -75,13 +168,213 @@ class YouTubeService:
         """Проверка, поддерживается ли URL для скачивания"""
         return self.is_youtube_url(url) or self.is_tiktok_url(url) or self.is_instagram_url(url)
     
-    def download_video(self, url: str, output_dir: Optional[str] = None) -> Dict[str, Any]:
+    def get_platform(self, url: str) -> Optional[str]:
+        """Определение платформы по URL ('youtube', 'tiktok', 'instagram' или None)"""
+        if self.is_youtube_url(url):
+            return 'youtube'
+        if self.is_tiktok_url(url):
+            return 'tiktok'
+        if self.is_instagram_url(url):
+            return 'instagram'
+        return None
+    
+    def get_format_selector(self, url: str) -> str:
+        """Формат yt-dlp для платформы (с учетом ограничения высоты кадра)"""
+        if self.max_height:
+            h = f"[height<={self.max_height}]"
+            # Если видео нужной высоты нет, берется худшее доступное, а не лучшее
+            if self.is_tiktok_url(url) or self.is_instagram_url(url):
+                return f'best[ext=mp4]{h}/best{h}/worst[ext=mp4]/worst'
+            return (
+                f'bestvideo[ext=mp4]{h}+bestaudio[ext=m4a]/best[ext=mp4]{h}/best{h}'
+                f'/worstvideo[ext=mp4]+bestaudio[ext=m4a]/worst'
+            )
+        
+        # Для TikTok используем другой формат, так как там обычно нет раздельных аудио/видео потоков
+        if self.is_tiktok_url(url):
+            return 'best[ext=mp4]/best'
+        if self.is_instagram_url(url):
+            # Для Instagram используем лучший доступный формат
+            return 'best[ext=mp4]/best'
+        # Для YouTube можно использовать лучший формат с аудио
+        return 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
+    
+    def get_canonical_id(self, url: str) -> Optional[Tuple[str, str]]:
+        """
+        Канонический идентификатор видео по URL без обращения к сети
+        
+        Используются URL-шаблоны экстракторов yt-dlp, поэтому разные формы ссылки
+        (youtu.be, watch?v=, shorts/) дают один и тот же идентификатор.
+        
+        Returns:
+            (ключ экстрактора, id видео) или None, если id не удалось определить
+        """
+        for ie_key in self.CANONICAL_EXTRACTORS:
+            extractor = get_info_extractor(ie_key)
+            if extractor.suitable(url):
+                video_id = extractor.get_temp_id(url)
+                if video_id:
+                    return ie_key, video_id
+        return None
+    
+    def _fetch_transcript(self, ydl: yt_dlp.YoutubeDL, info: Dict[str, Any]) -> List[Dict[str, str]]:
+        """
+        Транскрипт из субтитров видео (ручных или автоматических)
+        
+        Используется результат уже выполненного extract_info, поэтому видео не запрашивается
+        повторно. Ошибка получения субтитров не мешает скачиванию видео.
+        
+        Returns:
+            Сегменты транскрипта [{'start', 'end', 'text'}] или пустой список
+        """
+        if not settings.SUBTITLES_ENABLED:
+            return []
+        
+        track = select_subtitle_track(info, settings.SUBTITLE_LANGUAGES)
+        if not track:
+            return []
+        
+        try:
+            text = track.get('data')
+            if not text:
+                with ydl.urlopen(track['url']) as response:
+                    text = response.read().decode('utf-8', errors='replace')
+            return parse_subtitles(text)
+        except Exception as e:
+            print(f"Предупреждение: не удалось получить субтитры {info.get('webpage_url')}: {e}")
+            return []
+    
+    def _build_ydl_opts(
+        self,
+        url: str,
+        output_dir: Optional[str] = None,
+        cookie_file: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Настройки yt-dlp для URL: формат, cookies и шаблон имени файла
+        
+        Args:
+            url: URL видео
+            output_dir: Директория для скачанного файла
+            cookie_file: Файл cookies для yt-dlp (копия из _cookie_copy)
+        """
+        ydl_opts = {
+            'format': self.get_format_selector(url),
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'extract_flat': False,
+        }
+        
+        if cookie_file:
+            ydl_opts['cookiefile'] = cookie_file
+        
+        if output_dir:
+            # Имя по id видео: путь к файлу берется из ответа yt-dlp, а не угадывается по названию
+            ydl_opts['outtmpl'] = os.path.join(output_dir, '%(id)s.%(ext)s')
+        
+        return ydl_opts
+    
+    def get_cookie_file(self, url: str) -> Optional[str]:
+        """Файл cookies, с которым скачивается URL (None - без авторизации)"""
+        cookie_file = self.instagram_cookies_file if self.is_instagram_url(url) else self.cookies_file
+        if cookie_file and os.path.exists(cookie_file):
+            return cookie_file
+        return None
+    
+    @contextmanager
+    def _cookie_copy(self, url: str) -> Iterator[Optional[str]]:
+        """
+        Копия файла cookies платформы в рабочем пространстве (None - без авторизации)
+        
+        yt-dlp перезаписывает cookiefile при закрытии YoutubeDL, поэтому ему передается
+        копия: исходный файл не меняется. Копия удаляется при выходе.
+        """
+        cookie_file = self.get_cookie_file(url)
+        if not cookie_file:
+            yield None
+            return
+        
+        fd, copy_path = tempfile.mkstemp(prefix='cookies-', suffix='.txt', dir=get_scratch_root())
+        os.close(fd)
+        try:
+            shutil.copyfile(cookie_file, copy_path)
+            yield copy_path
+        finally:
+            try:
+                os.remove(copy_path)
+            except OSError:
+                pass
+    
+    def _metadata_cache_key(self, url: str) -> str:
+        """Ключ кеша метаданных: канонический id видео (разные формы ссылки дают один ключ) или URL"""
+        canonical_id = self.get_canonical_id(url)
+        raw_key = ':'.join(canonical_id) if canonical_id else url.strip()
+        return f"ytdlp-info:{hashlib.sha1(raw_key.encode('utf-8')).hexdigest()}"
+    
+    def _get_cached_info(self, url: str) -> Optional[Dict[str, Any]]:
+        """Метаданные видео из кеша (None, если их нет или срок истек)"""
+        return caches[settings.YTDLP_METADATA_CACHE_ALIAS].get(self._metadata_cache_key(url))
+    
+    def _cache_info(self, url: str, ydl: yt_dlp.YoutubeDL, info: Dict[str, Any]) -> None:
+        """Сохранение метаданных видео в кеш (без данных о скачанных файлах)"""
+        # Так же yt-dlp сохраняет info.json, который потом можно скачать без повторного разбора страницы
+        info = ydl.sanitize_info(info, remove_private_keys=True)
+        for key in ('requested_downloads', 'filepath', '_filename', 'filename'):
+            info.pop(key, None)
+        caches[settings.YTDLP_METADATA_CACHE_ALIAS].set(
+            self._metadata_cache_key(url), info, settings.YTDLP_METADATA_CACHE_TTL
+        )
+    
+    def _summarize_info(self, info: Dict[str, Any]) -> Dict[str, Any]:
+        """Краткие метаданные видео"""
+        return {
+            'id': info.get('id'),
+            'extractor_key': info.get('extractor_key'),
+            'title': info.get('title', 'video'),
+            'duration': info.get('duration', 0),
+            'description': info.get('description', ''),
+            'thumbnail': info.get('thumbnail'),
+            'formats_count': len(info.get('formats') or []),
+        }
+    
+    def get_metadata(self, url: str) -> Dict[str, Any]:
+        """
+        Метаданные видео без скачивания
+        
+        Результат извлечения кешируется на YTDLP_METADATA_CACHE_TTL секунд, поэтому
+        скачивание после проверки или превью ссылки не обращается к платформе повторно.
+        
+        Returns:
+            {'id', 'extractor_key', 'title', 'duration', 'description', 'thumbnail', 'formats_count'}
+        """
+        if not self.is_supported_url(url):
+            raise ValueError(f"URL не поддерживается для скачивания (YouTube, TikTok или Instagram): {url}")
+        
+        info = self._get_cached_info(url)
+        if info is None:
+            try:
+                with self._cookie_copy(url) as cookie_file, \
+                        yt_dlp.YoutubeDL(self._build_ydl_opts(url, cookie_file=cookie_file)) as ydl:
+                    info = ydl.extract_info(url, download=False)
+                    self._cache_info(url, ydl, info)
+            except Exception as e:
+                raise classify_download_error(e, 'Ошибка при получении информации о видео') from e
+        
+        return self._summarize_info(info)
+    
+    def download_video(self, url: str, output_dir: Optional[str] = None, keep_file: bool = False) -> Dict[str, Any]:
         """
         Скачивание видео с YouTube, TikTok или Instagram
         
+        Страница видео разбирается один раз: скачивание выполняется тем же вызовом
+        extract_info (или по метаданным из кеша get_metadata), путь к файлу берется из ответа yt-dlp.
+        
         Args:
             url: URL видео на YouTube, TikTok или Instagram
-            output_dir: Директория для сохранения (если None, используется временная)
+            output_dir: Директория для сохранения (если None, создается временная в SCRATCH_ROOT)
+            keep_file: Потоковый режим - файл остается на диске и не читается в память
+                (ключ 'file_data' отсутствует, за перенос и удаление файла отвечает вызывающий код)
         
         Returns:
             Dict с информацией о скачанном видео:
@@ -89,92 +382,72 @@ class YouTubeService:
                 'file_path': путь к файлу,
                 'title': название видео,
                 'duration': длительность,
-                'file_data': bytes данных файла,
+                'transcript': сегменты транскрипта из субтитров (пустой список, если субтитров нет),
+                'file_data': bytes данных файла (только если keep_file=False),
                 'mime_type': тип файла
             }
         """
         if not self.is_supported_url(url):
             raise ValueError(f"URL не поддерживается для скачивания (YouTube, TikTok или Instagram): {url}")
         
-        # Настройки yt-dlp
-        # Для TikTok используем другой формат, так как там обычно нет раздельных аудио/видео потоков
-        if self.is_tiktok_url(url):
-            format_selector = 'best[ext=mp4]/best'
-        elif self.is_instagram_url(url):
-            # Для Instagram используем лучший доступный формат
-            format_selector = 'best[ext=mp4]/best'
-        else:
-            # Для YouTube можно использовать лучший формат с аудио
-            format_selector = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
-        
-        ydl_opts = {
-            'format': format_selector,
-            'outtmpl': '%(title)s.%(ext)s',
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-        }
-        
-        # Добавляем cookies в зависимости от платформы
-        if self.is_instagram_url(url):
-            # Для Instagram используем специальные cookies
-            if self.instagram_cookies_file and os.path.exists(self.instagram_cookies_file):
-                ydl_opts['cookiefile'] = self.instagram_cookies_file
-        else:
-            # Для YouTube и TikTok используем обычные cookies
-            if self.cookies_file and os.path.exists(self.cookies_file):
-                ydl_opts['cookiefile'] = self.cookies_file
-        
-        # Используем временную директорию если не указана
-        if output_dir is None:
-            output_dir = tempfile.mkdtemp()
+        # Используем временную директорию в рабочем пространстве, если не указана
+        owns_output_dir = output_dir is None
+        if owns_output_dir:
+            output_dir = tempfile.mkdtemp(prefix='download-', dir=get_scratch_root())
         else:
             os.makedirs(output_dir, exist_ok=True)
         
-        ydl_opts['outtmpl'] = os.path.join(output_dir, '%(title)s.%(ext)s')
-        
-        video_info = {}
         file_path = None
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Получаем информацию о видео
-                info = ydl.extract_info(url, download=False)
-                video_info = {
-                    'title': info.get('title', 'video'),
-                    'duration': info.get('duration', 0),
-                    'description': info.get('description', ''),
-                }
+            with self._cookie_copy(url) as cookie_file, \
+                    yt_dlp.YoutubeDL(self._build_ydl_opts(url, output_dir, cookie_file)) as ydl:
+                cached_info = self._get_cached_info(url)
+                if cached_info is not None:
+                    # Форматы уже известны - выбираем формат и скачиваем без повторного разбора страницы
+                    info = ydl.process_ie_result(cached_info, download=True)
+                else:
+                    info = ydl.extract_info(url, download=True)
+                    self._cache_info(url, ydl, info)
                 
-                # Скачиваем видео
-                ydl.download([url])
+                video_info = self._summarize_info(info)
                 
-                # Ищем скачанный файл
-                # yt-dlp может изменить расширение, поэтому ищем по названию
-                title_safe = self._sanitize_filename(video_info['title'])
-                for ext in ['mp4', 'webm', 'mkv', 'm4a']:
-                    potential_path = os.path.join(output_dir, f"{title_safe}.{ext}")
-                    if os.path.exists(potential_path):
-                        file_path = potential_path
-                        break
-                
-                # Если не нашли по точному названию, ищем любой файл в директории
-                if not file_path:
-                    files = list(Path(output_dir).glob('*'))
-                    if files:
-                        file_path = str(files[0])
+                # Итоговый путь (после склейки видео и аудио) yt-dlp записывает в requested_downloads
+                requested = info.get('requested_downloads') or [{}]
+                file_path = requested[-1].get('filepath') or info.get('filepath')
                 
                 if not file_path or not os.path.exists(file_path):
                     raise FileNotFoundError("Не удалось найти скачанный файл")
                 
-                # Читаем файл
-                with open(file_path, 'rb') as f:
-                    file_data = f.read()
+                # Субтитры берем из того же ответа yt-dlp
+                transcript = self._fetch_transcript(ydl, info)
                 
                 # Определяем MIME тип
                 mime_type = self._get_mime_type(file_path)
                 
+                if keep_file:
+                    return {
+                        'id': video_info['id'],
+                        'extractor_key': video_info['extractor_key'],
+                        'format': ydl.params['format'],
+                        'file_path': file_path,
+                        'title': video_info['title'],
+                        'duration': video_info['duration'],
+                        'description': video_info.get('description', ''),
+                        'mime_type': mime_type,
+                        'file_size': os.path.getsize(file_path),
+                        'transcript': transcript,
+                        'temp_dir': output_dir
+                    }
+                
+                # Читаем файл
+                with open(file_path, 'rb') as f:
+                    file_data = f.read()
+                
                 result = {
+                    'id': video_info['id'],
+                    'extractor_key': video_info['extractor_key'],
+                    'format': ydl.params['format'],
                     'file_path': file_path,
                     'title': video_info['title'],
                     'duration': video_info['duration'],
@@ -182,6 +455,7 @@ class YouTubeService:
                     'file_data': file_data,
                     'mime_type': mime_type,
                     'file_size': len(file_data),
+                    'transcript': transcript,
                     'temp_dir': output_dir  # Сохраняем для последующей очистки
                 }
                 
@@ -195,13 +469,15 @@ class YouTubeService:
                 return result
         
         except Exception as e:
-            # Очищаем временные файлы при ошибке
-            if file_path and os.path.exists(file_path):
+            # Очищаем временные файлы при ошибке (вместе с недокачанными фрагментами)
+            if owns_output_dir:
+                shutil.rmtree(output_dir, ignore_errors=True)
+            elif file_path and os.path.exists(file_path):
                 try:
                     os.remove(file_path)
                 except:
                     pass
-            raise Exception(f"Ошибка при скачивании видео: {str(e)}")
+            raise classify_download_error(e) from e
     
     def _sanitize_filename(self, filename: str) -> str:
         """Очистка имени файла от недопустимых символов"""
@@ -13,4 +13,26 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dnk.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from api.loop_resources import close_loop_resources  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """
+    Приложение Django с обработкой lifespan
+    
+    Django принимает только HTTP, поэтому события запуска и остановки сервера обрабатываются здесь:
+    при остановке закрываются асинхронные HTTP-клиенты цикла событий сервера.
+    """
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+    
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_loop_resources()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
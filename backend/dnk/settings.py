@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 from dotenv import load_dotenv
 
@@ -86,6 +87,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Сколько секунд ждать блокировку записи, прежде чем вернуть "database is locked"
+            'timeout': int(os.environ.get('SQLITE_TIMEOUT', 20)),
+        },
     }
 }
 
@@ -175,6 +180,11 @@ CORS_ALLOW_HEADERS = [
     'x-csrftoken',
     'x-requested-with',
 ]
+# Заголовки ответа, доступные фронтенду
+CORS_EXPOSE_HEADERS = [
+    'retry-after',
+    'x-script-cache',
+]
 
 # REST Framework settings
 REST_FRAMEWORK = {
@@ -189,3 +199,226 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.FormParser',
     ],
 }
+
+# Очередь анализов (воркер запускается командой: python manage.py run_analysis_worker)
+ANALYSIS_WORKER_CONCURRENCY = int(os.environ.get('ANALYSIS_WORKER_CONCURRENCY', '2'))
+ANALYSIS_WORKER_POLL_INTERVAL = float(os.environ.get('ANALYSIS_WORKER_POLL_INTERVAL', '2'))
+# Сколько раз задача может быть захвачена воркером (повторный захват - после падения воркера)
+ANALYSIS_JOB_MAX_ATTEMPTS = int(os.environ.get('ANALYSIS_JOB_MAX_ATTEMPTS', '3'))
+# Через сколько секунд без heartbeat задача считается зависшей
+ANALYSIS_JOB_STALE_TIMEOUT = int(os.environ.get('ANALYSIS_JOB_STALE_TIMEOUT', '600'))
+
+# Параллельное скачивание источников анализа
+DOWNLOAD_MAX_WORKERS = int(os.environ.get('DOWNLOAD_MAX_WORKERS', '6'))
+# Ограничение одновременных скачиваний на платформу (общее для всех анализов в процессе воркера)
+DOWNLOAD_PLATFORM_CONCURRENCY = {
+    'youtube': int(os.environ.get('DOWNLOAD_YOUTUBE_CONCURRENCY', '4')),
+    'tiktok': int(os.environ.get('DOWNLOAD_TIKTOK_CONCURRENCY', '2')),
+    'instagram': int(os.environ.get('DOWNLOAD_INSTAGRAM_CONCURRENCY', '1')),
+}
+# Ограничение частоты скачиваний: запросов в минуту и допустимый всплеск
+# (отдельно для каждого файла cookies платформы)
+DOWNLOAD_RATE_LIMITS = {
+    'youtube': {
+        'per_minute': float(os.environ.get('DOWNLOAD_YOUTUBE_PER_MINUTE', '30')),
+        'burst': int(os.environ.get('DOWNLOAD_YOUTUBE_BURST', '4')),
+    },
+    'tiktok': {
+        'per_minute': float(os.environ.get('DOWNLOAD_TIKTOK_PER_MINUTE', '10')),
+        'burst': int(os.environ.get('DOWNLOAD_TIKTOK_BURST', '2')),
+    },
+    'instagram': {
+        'per_minute': float(os.environ.get('DOWNLOAD_INSTAGRAM_PER_MINUTE', '4')),
+        'burst': int(os.environ.get('DOWNLOAD_INSTAGRAM_BURST', '1')),
+    },
+}
+# Повторы при ограничении частоты и временных ошибках (экспоненциальная задержка в секундах)
+DOWNLOAD_MAX_RETRIES = int(os.environ.get('DOWNLOAD_MAX_RETRIES', '4'))
+DOWNLOAD_RETRY_BASE_DELAY = float(os.environ.get('DOWNLOAD_RETRY_BASE_DELAY', '5'))
+DOWNLOAD_RETRY_MAX_DELAY = float(os.environ.get('DOWNLOAD_RETRY_MAX_DELAY', '120'))
+
+# Файлы больше этого размера передаются в Gemini через Files API, а не внутри запроса
+GEMINI_INLINE_MAX_BYTES = int(os.environ.get('GEMINI_INLINE_MAX_BYTES', str(15 * 1024 * 1024)))
+
+# Кеш скачанных видео (по каноническому id видео и формату)
+DOWNLOAD_CACHE_ENABLED = os.environ.get('DOWNLOAD_CACHE_ENABLED', 'True') == 'True'
+DOWNLOAD_CACHE_MAX_BYTES = int(os.environ.get('DOWNLOAD_CACHE_MAX_BYTES', str(10 * 1024 ** 3)))
+DOWNLOAD_CACHE_TTL = int(os.environ.get('DOWNLOAD_CACHE_TTL', str(7 * 24 * 3600)))
+
+# Максимальное количество анализов в одном пакете (POST /api/batches/)
+ANALYSIS_BATCH_MAX_SIZE = int(os.environ.get('ANALYSIS_BATCH_MAX_SIZE', '100'))
+
+# Повторное использование результатов анализа того же набора видео
+ANALYSIS_RESULT_CACHE_ENABLED = os.environ.get('ANALYSIS_RESULT_CACHE_ENABLED', 'True') == 'True'
+
+# Загрузка видео в Gemini Files API: число параллельных загрузок и минимальный
+# оставшийся срок жизни файла (в секундах), при котором загруженный файл переиспользуется
+GEMINI_UPLOAD_CONCURRENCY = int(os.environ.get('GEMINI_UPLOAD_CONCURRENCY', '4'))
+GEMINI_FILE_REUSE_MARGIN = int(os.environ.get('GEMINI_FILE_REUSE_MARGIN', '3600'))
+
+# Загрузка файлов частями (POST /api/uploads/)
+UPLOAD_MAX_CHUNK_BYTES = int(os.environ.get('UPLOAD_MAX_CHUNK_BYTES', str(16 * 1024 * 1024)))
+UPLOAD_MAX_FILE_BYTES = int(os.environ.get('UPLOAD_MAX_FILE_BYTES', str(2 * 1024 ** 3)))
+# Незавершенные загрузки собираются на локальном диске (дописывать по смещению умеет только
+# локальный файл), в хранилище файл переносится после проверки контрольной суммы
+UPLOAD_PARTIAL_ROOT = os.environ.get('UPLOAD_PARTIAL_ROOT', str(BASE_DIR / 'uploads_partial'))
+
+# Качество видео для анализа: видео скачивается с ограничением высоты кадра и (если есть ffmpeg)
+# перекодируется в легкую копию, которая и передается в Gemini
+ANALYSIS_QUALITY_PROFILES = {
+    # Исходное качество, без перекодирования
+    'original': {
+        'max_height': None,
+        'transcode': False,
+    },
+    'low': {
+        'max_height': 480,
+        'transcode': True,
+        'fps': 12,
+        'audio_channels': 1,
+        'audio_bitrate': '64k',
+        'crf': 30,
+    },
+    'minimal': {
+        'max_height': 360,
+        'transcode': True,
+        'fps': 8,
+        'audio_channels': 1,
+        'audio_bitrate': '48k',
+        'crf': 34,
+    },
+}
+ANALYSIS_QUALITY_PROFILE = os.environ.get('ANALYSIS_QUALITY_PROFILE', 'low')
+# Скачивать и хранить оригинал в исходном качестве (легкая копия для Gemini делается локально)
+ANALYSIS_KEEP_ORIGINAL = os.environ.get('ANALYSIS_KEEP_ORIGINAL', 'False') == 'True'
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+TRANSCODE_MAX_WORKERS = int(os.environ.get('TRANSCODE_MAX_WORKERS', '2'))
+TRANSCODE_TIMEOUT = int(os.environ.get('TRANSCODE_TIMEOUT', '900'))
+
+# Входные данные анализа: 'video' - видео (или его легкая копия) целиком,
+# 'keyframes' - ключевые кадры сцен, звуковая дорожка и метрики монтажа (нужен ffmpeg)
+ANALYSIS_INPUT_MODE = os.environ.get('ANALYSIS_INPUT_MODE', 'video')
+# Режим анализа группы: 'single' - все видео одним запросом, 'map_reduce' - каждое видео
+# анализируется отдельно (параллельно, результат кешируется по содержимому видео),
+# затем анализы сводятся в ДНК группы текстовым запросом
+ANALYSIS_MODE = os.environ.get('ANALYSIS_MODE', 'single')
+# Одновременные запросы анализа отдельных видео в режиме map_reduce
+ANALYSIS_MAP_CONCURRENCY = int(os.environ.get('ANALYSIS_MAP_CONCURRENCY', '4'))
+# Поиск склеек: частота и размер кадров для сравнения, порог разницы кадров (0..1),
+# минимальная длина сцены в секундах
+SCENE_DETECTION_FPS = float(os.environ.get('SCENE_DETECTION_FPS', '4'))
+SCENE_DETECTION_FRAME_WIDTH = int(os.environ.get('SCENE_DETECTION_FRAME_WIDTH', '64'))
+SCENE_DETECTION_FRAME_HEIGHT = int(os.environ.get('SCENE_DETECTION_FRAME_HEIGHT', '36'))
+SCENE_DETECTION_THRESHOLD = float(os.environ.get('SCENE_DETECTION_THRESHOLD', '0.12'))
+SCENE_DETECTION_MIN_SCENE_SECONDS = float(os.environ.get('SCENE_DETECTION_MIN_SCENE_SECONDS', '0.5'))
+# Сколько ключевых кадров на видео передается в Gemini и их высота
+SCENE_DETECTION_MAX_KEYFRAMES = int(os.environ.get('SCENE_DETECTION_MAX_KEYFRAMES', '24'))
+SCENE_DETECTION_KEYFRAME_HEIGHT = int(os.environ.get('SCENE_DETECTION_KEYFRAME_HEIGHT', '360'))
+
+# Транскрипт из субтитров видео (ручных или автоматических) вместо расшифровки в Gemini
+SUBTITLES_ENABLED = os.environ.get('SUBTITLES_ENABLED', 'True') == 'True'
+# Предпочитаемые языки субтитров, по порядку
+SUBTITLE_LANGUAGES = [lang.strip() for lang in os.environ.get('SUBTITLE_LANGUAGES', 'ru,en').split(',') if lang.strip()]
+
+# Кеши: 'metadata' и 'scripts' хранятся в файлах, чтобы их видели все процессы
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'metadata': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('METADATA_CACHE_DIR', str(BASE_DIR / '.cache' / 'metadata')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('METADATA_CACHE_MAX_ENTRIES', '2000')),
+        },
+    },
+    'scripts': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('SCRIPT_CACHE_DIR', str(BASE_DIR / '.cache' / 'scripts')),
+        'TIMEOUT': int(os.environ.get('SCRIPT_CACHE_TTL', str(7 * 24 * 3600))),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('SCRIPT_CACHE_MAX_ENTRIES', '1000')),
+        },
+    },
+}
+
+# Метаданные yt-dlp (id, название, длительность, форматы): проверка или превью ссылки
+# и последующее скачивание разбирают страницу видео один раз
+YTDLP_METADATA_CACHE_ALIAS = os.environ.get('YTDLP_METADATA_CACHE_ALIAS', 'metadata')
+YTDLP_METADATA_CACHE_TTL = int(os.environ.get('YTDLP_METADATA_CACHE_TTL', '300'))
+
+# Кеш сгенерированных сценариев (включается в запросе, use_cache): ключ - тема, ДНК анализа, модель
+# и температура. Срок хранения и число записей задаются в CACHES['scripts']
+SCRIPT_CACHE_ALIAS = os.environ.get('SCRIPT_CACHE_ALIAS', 'scripts')
+# Сколько вариантов сценария можно сгенерировать заранее для мгновенной перегенерации
+SCRIPT_CACHE_MAX_VARIANTS = int(os.environ.get('SCRIPT_CACHE_MAX_VARIANTS', '5'))
+
+# Озвучка сценария: длинный текст сегмента делится по границам предложений на части не длиннее
+# VOICEOVER_CHUNK_MAX_CHARS символов, части синтезируются параллельно (не больше VOICEOVER_TTS_CONCURRENCY
+# запросов одновременно). На общей дорожке между сегментами - пауза VOICEOVER_SEGMENT_PAUSE_MS
+VOICEOVER_CHUNK_MAX_CHARS = int(os.environ.get('VOICEOVER_CHUNK_MAX_CHARS', '400'))
+VOICEOVER_TTS_CONCURRENCY = int(os.environ.get('VOICEOVER_TTS_CONCURRENCY', '4'))
+VOICEOVER_SEGMENT_PAUSE_MS = int(os.environ.get('VOICEOVER_SEGMENT_PAUSE_MS', '300'))
+
+# Рабочее пространство для скачиваний и перекодирования: у каждой задачи своя директория,
+# которая удаляется после задачи. Если занято больше квоты, новые скачивания ждут
+SCRATCH_ROOT = os.environ.get('SCRATCH_ROOT', str(BASE_DIR / 'scratch'))
+SCRATCH_QUOTA_BYTES = int(os.environ.get('SCRATCH_QUOTA_BYTES', str(20 * 1024 ** 3)))
+# Сколько места резервируется под одно скачивание до того, как файл появится на диске
+SCRATCH_DOWNLOAD_RESERVE_BYTES = int(os.environ.get('SCRATCH_DOWNLOAD_RESERVE_BYTES', str(500 * 1024 ** 2)))
+# Сколько секунд скачивание ждет освобождения места
+SCRATCH_WAIT_TIMEOUT = int(os.environ.get('SCRATCH_WAIT_TIMEOUT', '600'))
+# Брошенные директории (упавшие процессы) удаляются через столько секунд
+SCRATCH_ORPHAN_TTL = int(os.environ.get('SCRATCH_ORPHAN_TTL', str(6 * 3600)))
+# Как часто воркер очереди запускает очистку
+SCRATCH_SWEEP_INTERVAL = int(os.environ.get('SCRATCH_SWEEP_INTERVAL', '900'))
+
+# Общий клиент Gemini процесса: пул HTTP-соединений и таймаут запроса в секундах
+GEMINI_HTTP_MAX_CONNECTIONS = int(os.environ.get('GEMINI_HTTP_MAX_CONNECTIONS', '20'))
+GEMINI_HTTP_MAX_KEEPALIVE = int(os.environ.get('GEMINI_HTTP_MAX_KEEPALIVE', '10'))
+GEMINI_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('GEMINI_HTTP_KEEPALIVE_EXPIRY', '60'))
+GEMINI_HTTP_TIMEOUT = float(os.environ.get('GEMINI_HTTP_TIMEOUT', '600'))
+GEMINI_IMAGE_MODEL = os.environ.get('GEMINI_IMAGE_MODEL', 'gemini-2.5-flash-image')
+
+# Кеш контекста Gemini с ДНК анализа: создается при первом сценарии анализа и используется
+# всеми следующими до истечения TTL, поэтому ДНК не пересылается в каждом запросе
+GEMINI_CONTEXT_CACHE_ENABLED = os.environ.get('GEMINI_CONTEXT_CACHE_ENABLED', 'True') == 'True'
+GEMINI_CONTEXT_CACHE_TTL = int(os.environ.get('GEMINI_CONTEXT_CACHE_TTL', '3600'))
+# Кеш пересоздается, если до истечения осталось меньше этого времени (секунды)
+GEMINI_CONTEXT_CACHE_REFRESH_MARGIN = int(os.environ.get('GEMINI_CONTEXT_CACHE_REFRESH_MARGIN', '120'))
+# Gemini не кеширует контекст меньше минимального размера (токенов); примерная оценка - 4 символа на токен
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get('GEMINI_CONTEXT_CACHE_MIN_TOKENS', '1024'))
+
+# Замеры вызовов Gemini и Kie.ai (модель UpstreamCall): время, повторы, токены, объем данных,
+# результат. Записи сохраняются фоновым потоком пачками раз в UPSTREAM_CALLS_FLUSH_INTERVAL секунд
+UPSTREAM_CALLS_ENABLED = os.environ.get('UPSTREAM_CALLS_ENABLED', 'True') == 'True'
+UPSTREAM_CALLS_FLUSH_INTERVAL = float(os.environ.get('UPSTREAM_CALLS_FLUSH_INTERVAL', '2'))
+# Тарифы для оценки стоимости (JSON): {"модель": {"input": $ за 1M токенов, "cached_input": ...,
+# "output": ..., "per_call": $ за вызов}}. Для моделей без тарифа стоимость не считается
+UPSTREAM_PRICING = json.loads(os.environ.get('UPSTREAM_PRICING') or '{}')
+
+# Повторы запросов к Gemini и Kie.ai (api/resilience.py): число повторов и экспоненциальная
+# задержка с разбросом в секундах. Если API просит ждать (Retry-After) дольше
+# UPSTREAM_RETRY_AFTER_MAX секунд, ошибка возвращается сразу
+UPSTREAM_RETRY_ATTEMPTS = int(os.environ.get('UPSTREAM_RETRY_ATTEMPTS', '3'))
+UPSTREAM_RETRY_BASE_DELAY = float(os.environ.get('UPSTREAM_RETRY_BASE_DELAY', '0.5'))
+UPSTREAM_RETRY_MAX_DELAY = float(os.environ.get('UPSTREAM_RETRY_MAX_DELAY', '20'))
+UPSTREAM_RETRY_AFTER_MAX = float(os.environ.get('UPSTREAM_RETRY_AFTER_MAX', '60'))
+# Время на операцию вместе с повторами (секунды): '<сервис>.<операция>', остальные - 'default'
+UPSTREAM_DEADLINES = {
+    'default': float(os.environ.get('UPSTREAM_DEADLINE_DEFAULT', '120')),
+    'gemini.upload_file': float(os.environ.get('GEMINI_UPLOAD_DEADLINE', '900')),
+    'gemini.analyze_content': float(os.environ.get('GEMINI_ANALYZE_DEADLINE', '900')),
+    'gemini.generate_script': float(os.environ.get('GEMINI_SCRIPT_DEADLINE', '180')),
+    'gemini.generate_script_stream': float(os.environ.get('GEMINI_SCRIPT_DEADLINE', '180')),
+    'gemini.create_context_cache': float(os.environ.get('GEMINI_CONTEXT_CACHE_DEADLINE', '60')),
+    'kie.get_task_status': float(os.environ.get('KIE_STATUS_DEADLINE', '30')),
+    'kie.download_file': float(os.environ.get('KIE_DOWNLOAD_DEADLINE', '300')),
+}
+# Предохранитель: после стольких сбоев подряд запросы к сервису сразу завершаются ошибкой
+# в течение UPSTREAM_BREAKER_RESET_TIMEOUT секунд, затем выполняется пробный запрос
+UPSTREAM_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('UPSTREAM_BREAKER_FAILURE_THRESHOLD', '5'))
+UPSTREAM_BREAKER_RESET_TIMEOUT = float(os.environ.get('UPSTREAM_BREAKER_RESET_TIMEOUT', '30'))
+
+# Размер пула HTTP-соединений к Kie.ai
+KIE_HTTP_POOL_SIZE = int(os.environ.get('KIE_HTTP_POOL_SIZE', '10'))
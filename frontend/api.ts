@@ -33,16 +33,122 @@ function transformAnalysisResponse(data: any): AnalysisResult {
   };
 }
 
+const ANALYSIS_POLL_INTERVAL_MS = 3000;
+
+// Размер части файла (не больше UPLOAD_MAX_CHUNK_BYTES на бекенде) и число повторов части
+const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+const UPLOAD_CHUNK_RETRIES = 3;
+
+/**
+ * SHA-256 файла в hex
+ */
+async function sha256Hex(file: File): Promise<string> {
+  const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, '0'))
+    .join('');
+}
+
+/**
+ * Загрузка файла на бекенд частями
+ *
+ * Части отправляются по порядку с offset. При обрыве часть повторяется, а на 409
+ * загрузка продолжается с received_size, который вернул бекенд.
+ *
+ * @returns ID завершенной загрузки для источника {type: 'upload'}
+ */
+export async function uploadFile(file: File): Promise<string> {
+  const createResponse = await fetch(`${API_BASE_URL}/uploads/`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({
+      filename: file.name,
+      mime_type: file.type || 'video/mp4',
+      total_size: file.size,
+    }),
+  });
+
+  if (!createResponse.ok) {
+    const error = await createResponse.json().catch(() => ({ error: 'Ошибка загрузки файла' }));
+    throw new Error(error.error || error.detail || 'Ошибка загрузки файла');
+  }
+
+  const upload = await createResponse.json();
+  let offset = 0;
+  let failures = 0;
+
+  while (offset < file.size) {
+    let response: Response;
+    try {
+      response = await fetch(`${API_BASE_URL}/uploads/${upload.id}/chunk/?offset=${offset}`, {
+        method: 'PUT',
+        headers: {
+          'Content-Type': 'application/octet-stream',
+        },
+        body: file.slice(offset, offset + UPLOAD_CHUNK_SIZE),
+      });
+    } catch (e) {
+      if (++failures > UPLOAD_CHUNK_RETRIES) throw e;
+      continue;
+    }
+
+    if (response.ok || response.status === 409) {
+      // На 409 бекенд сообщает, сколько байт у него уже есть
+      const data = await response.json();
+      offset = data.received_size;
+      failures = 0;
+      continue;
+    }
+
+    if (response.status >= 500 && ++failures <= UPLOAD_CHUNK_RETRIES) {
+      continue;
+    }
+
+    const error = await response.json().catch(() => ({ error: 'Ошибка загрузки файла' }));
+    throw new Error(error.error || error.detail || 'Ошибка загрузки файла');
+  }
+
+  const completeResponse = await fetch(`${API_BASE_URL}/uploads/${upload.id}/complete/`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({ checksum: await sha256Hex(file) }),
+  });
+
+  if (!completeResponse.ok) {
+    const error = await completeResponse.json().catch(() => ({ error: 'Ошибка загрузки файла' }));
+    throw new Error(error.error || error.detail || 'Ошибка загрузки файла');
+  }
+
+  return upload.id;
+}
+
 /**
  * Создание нового анализа
+ *
+ * Локальные файлы сначала загружаются частями и передаются как источники типа upload.
+ * Бекенд ставит анализ в очередь и сразу возвращает 202 с ID анализа,
+ * поэтому дожидаемся готовности, периодически опрашивая его статус.
  */
 export async function createAnalysis(inputs: AnalysisInput[]): Promise<AnalysisResult> {
+  const sources = [];
+  for (const input of inputs) {
+    if (input.type === 'file' && input.file) {
+      sources.push({ type: 'upload', value: await uploadFile(input.file), label: input.label });
+    } else {
+      sources.push({ type: input.type, value: input.value, label: input.label });
+    }
+  }
+
   const response = await fetch(`${API_BASE_URL}/analyses/`, {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
     },
-    body: JSON.stringify({ sources: inputs }),
+    body: JSON.stringify({ sources }),
   });
 
   if (!response.ok) {
@@ -51,7 +157,30 @@ export async function createAnalysis(inputs: AnalysisInput[]): Promise<AnalysisR
   }
 
   const data = await response.json();
-  return transformAnalysisResponse(data);
+  return waitForAnalysis(data.id);
+}
+
+/**
+ * Ожидание завершения анализа в очереди
+ */
+export async function waitForAnalysis(id: string): Promise<AnalysisResult> {
+  while (true) {
+    const response = await fetch(`${API_BASE_URL}/analyses/${id}/`);
+
+    if (!response.ok) {
+      throw new Error('Ошибка загрузки анализа');
+    }
+
+    const data = await response.json();
+    if (data.status === 'ready') {
+      return transformAnalysisResponse(data);
+    }
+    if (data.status === 'error') {
+      throw new Error(data.error_message || 'Ошибка анализа');
+    }
+
+    await new Promise((resolve) => setTimeout(resolve, ANALYSIS_POLL_INTERVAL_MS));
+  }
 }
 
 /**
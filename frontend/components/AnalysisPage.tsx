@@ -58,16 +58,12 @@ const AnalysisPage: React.FC<{ onComplete: (res: AnalysisResult) => void }> = ({
         return;
       }
       
-      const reader = new FileReader();
-      reader.onload = () => {
-        const base64 = (reader.result as string).split(',')[1];
-        setInputs(prev => [...prev, { 
-          type: 'file', 
-          value: { data: base64, mimeType: file.type },
-          label: file.name
-        }]);
-      };
-      reader.readAsDataURL(file);
+      setInputs(prev => [...prev, {
+        type: 'file',
+        value: { data: '', mimeType: file.type },
+        label: file.name,
+        file,
+      }]);
     });
   }, [inputs.length]);
 
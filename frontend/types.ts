@@ -61,6 +61,8 @@ export interface AnalysisInput {
   type: 'url' | 'file';
   value: string | { data: string; mimeType: string };
   label: string;
+  // Локальный файл: загружается на бекенд частями при создании анализа
+  file?: File;
 }
 
 export interface AnalysisResult {